@@ -1,73 +1,125 @@
 from flask import Flask, request, Response, jsonify, send_file, send_from_directory
 from flask_cors import CORS
-import requests
 import base64
 import json
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 import os
 from pathlib import Path
-from chat_manager import ChatManager
+from chat_manager import ChatManager, get_stage_timings
 from pdf_manager import PDFManager
+from session_manager import SessionManager
+from ollama_client import get_client
+from model_catalog import ModelCatalog
+from response_cache import ResponseCache
+from warmup import Warmup
+import config
 
 app = Flask(__name__)
 CORS(app)
 
-OLLAMA_API_URL = "http://localhost:11434"
-
-# Initialize managers
-chat_manager = ChatManager()
+# Initialize managers; embeddings and vector stores are shared by all sessions
 pdf_manager = PDFManager()
+response_cache = None
+if config.RESPONSE_CACHE:
+    response_cache = ResponseCache(
+        embeddings=pdf_manager.embeddings,
+        max_entries=config.RESPONSE_CACHE_SIZE,
+        ttl=config.RESPONSE_CACHE_TTL,
+        similarity_threshold=config.RESPONSE_CACHE_SIMILARITY,
+        cache_path=config.RESPONSE_CACHE_PATH
+    )
+sessions = SessionManager(
+    pdf_manager,
+    max_sessions=config.MAX_SESSIONS,
+    idle_timeout=config.SESSION_IDLE_TIMEOUT,
+    response_cache=response_cache
+)
+
+model_catalog = ModelCatalog(get_client(), ttl=config.MODEL_CATALOG_TTL)
+
+# Open stores and load models in the background; /api/ready reports when done
+warmup = Warmup(
+    pdf_manager,
+    model_catalog,
+    get_client(),
+    stores=config.WARMUP_STORES,
+    chat_model=config.CHAT_MODEL if config.WARMUP_MODELS else None,
+    embedding_model=pdf_manager.embeddings.model_name if config.WARMUP_MODELS else None,
+    keep_alive=config.WARMUP_KEEP_ALIVE
+)
+warmup.start()
 
-# Store selected chapters per book
-selected_chapters = {}
+def get_chat_manager() -> ChatManager:
+    """Get the ChatManager of the session making the current request"""
+    session_id = request.headers.get('X-Session-ID') or request.args.get('session_id') or 'default'
+    return sessions.get(session_id)
 
 # Get the absolute path to the resources directory
 current_dir = Path(__file__).parent
 resources_dir = current_dir.parent / "resources"
 
 def get_available_models() -> List[Dict]:
-    """Get list of available models from Ollama"""
-    try:
-        # Get list of models
-        response = requests.get(f"{OLLAMA_API_URL}/api/tags")
-        if response.status_code == 200:
-            models = response.json().get("models", [])
-            available_models = []
-            
-            for model in models:
-                # Check if model name contains vision-related keywords
-                model_name = model["name"].lower()
-                supports_vision = any(keyword in model_name for keyword in ["vision", "llava", "bakllava"])
-                
-                available_models.append({
-                    "name": model["name"],
-                    "supportsVision": supports_vision
-                })
-            
-            return available_models
-    except Exception as e:
-        print(f"Error fetching models: {e}")
-    return []
+    """Get list of available models from the cached catalog"""
+    return model_catalog.get_models()
+
+def validate_chat_model(model_name: str, has_image: bool) -> Optional[Tuple[str, int]]:
+    """Check a requested chat model against the catalog, returning an error and status code if unusable"""
+    if not model_catalog.is_known():
+        # Ollama has not answered yet; let the request reach it
+        return None
+    model = model_catalog.get_model(model_name)
+    if model is None:
+        return f"Model '{model_name}' is not available", 404
+    if has_image and not model["supportsVision"]:
+        return f"Model '{model_name}' does not support image input", 400
+    return None
 
 @app.route('/api/models', methods=['GET'])
 def models():
     """Get available models"""
     return jsonify(get_available_models())
 
+@app.route('/api/health', methods=['GET'])
+def health():
+    """Liveness check"""
+    return jsonify({"status": "ok"})
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    """Readiness check: 503 until the warm-up has finished"""
+    return jsonify(warmup.status()), 200 if warmup.ready else 503
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """Get cache and runtime counters for operators"""
+    return jsonify({
+        "embedding_cache": pdf_manager.embeddings.stats(),
+        "store_cache": pdf_manager.store_cache.stats(),
+        "pdf_index": pdf_manager.index_stats(),
+        "exact_search": pdf_manager.exact_index_stats(),
+        "embedding_stores": pdf_manager.embedding_stats(),
+        "sessions": sessions.stats(),
+        "stage_timings": get_stage_timings(),
+        "ollama": get_client().stats(),
+        "model_catalog": model_catalog.stats(),
+        "response_cache": response_cache.stats() if response_cache else None
+    })
+
 @app.route('/api/pdfs', methods=['GET'])
 def get_pdfs():
     """Get list of all available PDFs"""
-    return jsonify(chat_manager.get_available_pdfs())
+    return jsonify(pdf_manager.get_available_pdfs())
 
 @app.route('/api/pdfs/active', methods=['GET'])
 def get_active_pdfs():
     """Get list of active PDFs in the current conversation"""
-    return jsonify(chat_manager.get_active_pdfs())
+    return jsonify(get_chat_manager().get_active_pdfs())
 
 @app.route('/api/pdf/active', methods=['POST'])
 def set_active_pdfs():
     """Set which PDFs to use for context"""
     try:
+        chat_manager = get_chat_manager()
         data = request.get_json()
         pdf_hashes = data.get('pdf_hashes', [])
         book_title = data.get('book_title', '')
@@ -77,8 +129,8 @@ def set_active_pdfs():
         
         # Store selected chapters for the book
         if book_title:
-            selected_chapters[book_title] = pdf_hashes
-            print(f"Stored chapters for {book_title}: {selected_chapters[book_title]}")
+            chat_manager.selected_chapters[book_title] = pdf_hashes
+            print(f"Stored chapters for {book_title}: {chat_manager.selected_chapters[book_title]}")
         
         # Update active PDFs in chat manager with the actual PDF hashes
         chat_manager.set_active_pdfs(pdf_hashes)
@@ -91,7 +143,7 @@ def set_active_pdfs():
 def get_active_chapters(book_title: str):
     """Get active chapters for a specific book"""
     try:
-        chapters = selected_chapters.get(book_title, [])
+        chapters = get_chat_manager().selected_chapters.get(book_title, [])
         return jsonify({"chapters": chapters})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -114,6 +166,14 @@ def chat(model_name: str = None):
         if not message and not image:
             return jsonify({"error": "No message or image provided"}), 400
         
+        if model_name:
+            invalid = validate_chat_model(model_name, bool(image))
+            if invalid:
+                error, status = invalid
+                return jsonify({"error": error}), status
+        
+        chat_manager = get_chat_manager()
+        
         def generate():
             try:
                 # Convert image to base64 if present
@@ -123,18 +183,23 @@ def chat(model_name: str = None):
                 
                 # Update the model if specified
                 if model_name:
-                    chat_manager.llm.model = model_name
+                    chat_manager.set_model(model_name)
                 
-                response = chat_manager.get_response(message, image_base64)
-                if not response:
-                    yield f"data: {json.dumps({'error': 'No response from model'})}\n\n"
-                else:
-                    yield f"data: {json.dumps({'response': response})}\n\n"
+                # Forward token events as they arrive; the final event carries
+                # the full response together with sources and timing
+                for event in chat_manager.stream_response(message, image_base64):
+                    if event.get('done') and not event.get('response'):
+                        event = {'error': 'No response from model'}
+                    yield f"data: {json.dumps(event)}\n\n"
             except Exception as e:
                 print(f"Chat error: {str(e)}")  # Add logging
                 yield f"data: {json.dumps({'error': str(e)})}\n\n"
         
-        return Response(generate(), mimetype='text/event-stream')
+        return Response(
+            generate(),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
     except Exception as e:
         print(f"Chat error: {str(e)}")  # Add logging
         return jsonify({"error": str(e)}), 500
@@ -142,7 +207,7 @@ def chat(model_name: str = None):
 @app.route('/api/chat/history', methods=['GET'])
 def get_chat_history():
     try:
-        history = chat_manager.get_chat_history()
+        history = get_chat_manager().get_chat_history()
         return jsonify({"history": history})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -151,7 +216,7 @@ def get_chat_history():
 def get_raw_messages():
     """Get raw LangChain messages"""
     try:
-        messages = chat_manager.get_raw_messages()
+        messages = get_chat_manager().get_raw_messages()
         return jsonify({"messages": messages})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -160,7 +225,7 @@ def get_raw_messages():
 def clear_chat_history():
     """Clear the chat history"""
     try:
-        chat_manager.clear_chat_history()
+        get_chat_manager().clear_chat_history()
         return jsonify({
             "message": "Chat history cleared successfully",
             "status": "success"
@@ -174,15 +239,29 @@ def clear_chat_history():
 
 @app.route('/api/pdf/index', methods=['GET'])
 def get_pdf_index():
-    """Get the PDF index file"""
+    """Get the PDF index, answering 304 when the client's copy is current"""
     try:
-        index_file = resources_dir / "pdf_index.json"
-        if not index_file.exists():
+        index = pdf_manager.get_index()
+        if index.mtime is None:
             return jsonify({"error": "PDF index not found"}), 404
         
-        with open(index_file, 'r', encoding='utf-8') as f:
-            index_data = json.load(f)
-        return jsonify(index_data)
+        if request.if_none_match.contains(index.etag):
+            response = Response(status=304)
+        else:
+            response = Response(index.body, mimetype='application/json')
+        response.set_etag(index.etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/pdf/index/reload', methods=['POST'])
+def reload_pdf_index():
+    """Reload pdf_index.json after the preprocessor has run"""
+    try:
+        reloaded = pdf_manager.reload_index()
+        index = pdf_manager.get_index()
+        return jsonify({"reloaded": reloaded, "chapters": len(index.available_pdfs), "etag": index.etag})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
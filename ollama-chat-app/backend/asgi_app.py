@@ -0,0 +1,361 @@
+"""Async serving mode for the chat backend
+
+Serves the same routes as app.py on an ASGI server:
+    
+    uvicorn asgi_app:app --port 5000
+
+Model tokens are streamed from Ollama over async HTTP, blocking Chroma and
+LangChain calls run in a bounded thread pool, and chats beyond the configured
+concurrency wait in a bounded queue or are rejected with 503.
+"""
+import asyncio
+import base64
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from app import (
+    get_available_models, model_catalog, pdf_manager, resources_dir, response_cache, sessions,
+    validate_chat_model, warmup
+)
+from chat_manager import ChatManager, get_stage_timings
+from ollama_client import get_client
+import config
+
+# Blocking work (retrieval, memory, session setup) runs here instead of the event loop
+_blocking_executor = ThreadPoolExecutor(
+    max_workers=config.ASGI_BLOCKING_WORKERS,
+    thread_name_prefix="asgi-blocking"
+)
+_http_client = None
+
+class ChatLimiter:
+    """Limit concurrent chats, queueing a bounded number of waiters"""
+    
+    def __init__(self, max_concurrent: int, max_queued: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+    
+    async def acquire(self) -> bool:
+        """Wait for a free slot, returning False when the chat should be rejected"""
+        if self._slots.locked() and self.queued >= self.max_queued:
+            self.rejected += 1
+            return False
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return False
+        finally:
+            self.queued -= 1
+        self.active += 1
+        return True
+    
+    def release(self):
+        self.active -= 1
+        self._slots.release()
+    
+    def stats(self) -> Dict:
+        return {
+            "active": self.active,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued
+        }
+
+class SlotStreamingResponse(StreamingResponse):
+    """Streaming response that frees its chat slot however it ends
+    
+    The slot is released when the response finishes, fails or is cancelled,
+    including when the client disconnects before the body is first
+    iterated, in which case the body generator never runs its own cleanup.
+    """
+    
+    def __init__(self, content, limiter: ChatLimiter, **kwargs):
+        super().__init__(content, **kwargs)
+        self._limiter = limiter
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._limiter.release()
+
+chat_limiter = ChatLimiter(
+    config.ASGI_MAX_CONCURRENT_CHATS,
+    config.ASGI_MAX_QUEUED_CHATS,
+    config.ASGI_QUEUE_TIMEOUT
+)
+
+async def run_blocking(func, *args):
+    """Run a blocking call in the bounded executor"""
+    return await asyncio.get_running_loop().run_in_executor(_blocking_executor, func, *args)
+
+def get_chat_manager(request: Request) -> ChatManager:
+    """Get the ChatManager of the session making the request"""
+    session_id = request.headers.get('X-Session-ID') or request.query_params.get('session_id') or 'default'
+    return sessions.get(session_id)
+
+def resolve_resource(filename: str):
+    """Resolve a file inside the resources directory, or None if it is outside or missing"""
+    root = resources_dir.resolve()
+    path = (root / filename).resolve()
+    if root not in path.parents or not path.is_file():
+        return None
+    return path
+
+async def models(request: Request):
+    """Get available models"""
+    return JSONResponse(await run_blocking(get_available_models))
+
+async def health(request: Request):
+    """Liveness check"""
+    return JSONResponse({"status": "ok"})
+
+async def ready(request: Request):
+    """Readiness check: 503 until the warm-up has finished"""
+    return JSONResponse(warmup.status(), status_code=200 if warmup.ready else 503)
+
+async def stats(request: Request):
+    """Get cache and runtime counters for operators"""
+    return JSONResponse({
+        "embedding_cache": pdf_manager.embeddings.stats(),
+        "store_cache": pdf_manager.store_cache.stats(),
+        "pdf_index": pdf_manager.index_stats(),
+        "exact_search": pdf_manager.exact_index_stats(),
+        "embedding_stores": pdf_manager.embedding_stats(),
+        "sessions": sessions.stats(),
+        "stage_timings": get_stage_timings(),
+        "chat_limiter": chat_limiter.stats(),
+        "ollama": get_client().stats(),
+        "model_catalog": model_catalog.stats(),
+        "response_cache": response_cache.stats() if response_cache else None
+    })
+
+async def get_pdfs(request: Request):
+    """Get list of all available PDFs"""
+    return JSONResponse(await run_blocking(pdf_manager.get_available_pdfs))
+
+async def get_active_pdfs(request: Request):
+    """Get list of active PDFs in the current conversation"""
+    chat_manager = await run_blocking(get_chat_manager, request)
+    return JSONResponse(chat_manager.get_active_pdfs())
+
+async def set_active_pdfs(request: Request):
+    """Set which PDFs to use for context"""
+    try:
+        data = await request.json()
+        pdf_hashes = data.get('pdf_hashes', [])
+        book_title = data.get('book_title', '')
+        
+        def update(chat_manager: ChatManager):
+            if book_title:
+                chat_manager.selected_chapters[book_title] = pdf_hashes
+            chat_manager.set_active_pdfs(pdf_hashes)
+        
+        chat_manager = await run_blocking(get_chat_manager, request)
+        await run_blocking(update, chat_manager)
+        return JSONResponse({"message": "Active PDFs updated successfully"})
+    except Exception as e:
+        print(f"Error in set_active_pdfs: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def get_active_chapters(request: Request):
+    """Get active chapters for a specific book"""
+    try:
+        chat_manager = await run_blocking(get_chat_manager, request)
+        chapters = chat_manager.selected_chapters.get(request.path_params['book_title'], [])
+        return JSONResponse({"chapters": chapters})
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def chat(request: Request):
+    """Handle chat requests with optional model specification"""
+    try:
+        model_name = request.path_params.get('model_name')
+        if request.headers.get('content-type', '').startswith('application/json'):
+            data = await request.json()
+            message = data.get('message') or data.get('prompt')
+            image = None
+        else:
+            form = await request.form()
+            message = form.get('message') or form.get('prompt')
+            image_file = form.get('image')
+            image = await image_file.read() if image_file else None
+        
+        if not message and not image:
+            return JSONResponse({"error": "No message or image provided"}, status_code=400)
+        
+        if model_name:
+            invalid = await run_blocking(validate_chat_model, model_name, bool(image))
+            if invalid:
+                error, status = invalid
+                return JSONResponse({"error": error}, status_code=status)
+        
+        image_base64 = base64.b64encode(image).decode('utf-8') if image else None
+        if not await chat_limiter.acquire():
+            return JSONResponse(
+                {"error": "Server is busy, please retry shortly"},
+                status_code=503,
+                headers={"Retry-After": str(max(1, int(config.ASGI_QUEUE_TIMEOUT)))}
+            )
+        
+        try:
+            chat_manager = await run_blocking(get_chat_manager, request)
+            if model_name:
+                await run_blocking(chat_manager.set_model, model_name)
+        except Exception:
+            chat_limiter.release()
+            raise
+        
+        async def generate():
+            # Forward token events as they arrive; the final event carries
+            # the full response together with sources and timing
+            async for event in chat_manager.astream_response(
+                message, image_base64, client=_http_client, executor=_blocking_executor
+            ):
+                if event.get('done') and not event.get('response'):
+                    event = {'error': 'No response from model'}
+                yield f"data: {json.dumps(event)}\n\n"
+        
+        # The response releases the slot taken above once it ends
+        return SlotStreamingResponse(
+            generate(),
+            chat_limiter,
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    except Exception as e:
+        print(f"Chat error: {str(e)}")  # Add logging
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def get_chat_history(request: Request):
+    try:
+        chat_manager = await run_blocking(get_chat_manager, request)
+        history = await run_blocking(chat_manager.get_chat_history)
+        return JSONResponse({"history": history})
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def get_raw_messages(request: Request):
+    """Get raw LangChain messages"""
+    try:
+        chat_manager = await run_blocking(get_chat_manager, request)
+        messages = await run_blocking(chat_manager.get_raw_messages)
+        return JSONResponse({"messages": messages})
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def clear_chat_history(request: Request):
+    """Clear the chat history"""
+    try:
+        chat_manager = await run_blocking(get_chat_manager, request)
+        await run_blocking(chat_manager.clear_chat_history)
+        return JSONResponse({
+            "message": "Chat history cleared successfully",
+            "status": "success"
+        })
+    except Exception as e:
+        print(f"Error clearing chat history: {str(e)}")  # Add logging
+        return JSONResponse({
+            "error": "Failed to clear chat history",
+            "details": str(e)
+        }, status_code=500)
+
+async def get_pdf_index(request: Request):
+    """Get the PDF index, answering 304 when the client's copy is current"""
+    try:
+        index = await run_blocking(pdf_manager.get_index)
+        if index.mtime is None:
+            return JSONResponse({"error": "PDF index not found"}, status_code=404)
+        
+        etag = f'"{index.etag}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=headers)
+        return Response(index.body, media_type="application/json", headers=headers)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def reload_pdf_index(request: Request):
+    """Reload pdf_index.json after the preprocessor has run"""
+    try:
+        reloaded = await run_blocking(pdf_manager.reload_index)
+        index = pdf_manager.get_index()
+        return JSONResponse({"reloaded": reloaded, "chapters": len(index.available_pdfs), "etag": index.etag})
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+async def get_pdf(request: Request):
+    """Serve PDF files and preview images from the resources directory"""
+    path = resolve_resource(request.path_params['filename'])
+    if path is None:
+        return JSONResponse({"error": "File not found"}, status_code=404)
+    return FileResponse(path)
+
+async def get_pdf_hash(request: Request):
+    """Get the hash of a PDF file"""
+    try:
+        pdf_hash = await run_blocking(pdf_manager.get_pdf_hash, request.path_params['filename'])
+        return JSONResponse({"hash": pdf_hash})
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    """Share one pooled HTTP client to Ollama for the lifetime of the server"""
+    global _http_client
+    _http_client = get_client().create_async_client(max_connections=config.ASGI_MAX_CONCURRENT_CHATS + 8)
+    try:
+        yield
+    finally:
+        await _http_client.aclose()
+        _blocking_executor.shutdown(wait=False)
+
+# Specific routes come before the catch-all file routes
+routes = [
+    Route('/api/models', models, methods=['GET']),
+    Route('/api/health', health, methods=['GET']),
+    Route('/api/ready', ready, methods=['GET']),
+    Route('/api/stats', stats, methods=['GET']),
+    Route('/api/pdfs', get_pdfs, methods=['GET']),
+    Route('/api/pdfs/active', get_active_pdfs, methods=['GET']),
+    Route('/api/pdf/active', set_active_pdfs, methods=['POST']),
+    Route('/api/pdf/active/{book_title}', get_active_chapters, methods=['GET']),
+    Route('/api/chat/history', get_chat_history, methods=['GET']),
+    Route('/api/chat/history', clear_chat_history, methods=['DELETE']),
+    Route('/api/chat/raw-messages', get_raw_messages, methods=['GET']),
+    Route('/api/chat', chat, methods=['POST']),
+    Route('/api/chat/{model_name}', chat, methods=['POST']),
+    Route('/api/pdf/index', get_pdf_index, methods=['GET']),
+    Route('/api/pdf/index/reload', reload_pdf_index, methods=['POST']),
+    Route('/api/pdf/hash/{filename:path}', get_pdf_hash, methods=['GET']),
+    Route('/api/pdf/preview/{filename:path}', get_pdf, methods=['GET']),
+    Route('/api/pdf/{filename:path}', get_pdf, methods=['GET']),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, port=5000)
@@ -0,0 +1,105 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, List
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain.schema import BaseMessage, SystemMessage, get_buffer_string
+from pydantic import PrivateAttr
+from text_utils import estimate_tokens
+
+# Summaries are computed off the request path
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-summary")
+
+class TokenBudgetMemory(BaseChatMemory):
+    """Conversation memory bounded by a token budget
+    
+    Recent messages are kept verbatim as long as they fit in
+    max_token_limit. Older messages are folded into a running summary by the
+    LLM in a background thread, and the summary is presented to the model
+    ahead of the recent messages. Token counts are computed once per message
+    and cached, so budgeting costs O(1) per turn.
+    """
+    
+    llm: Any
+    memory_key: str = "chat_history"
+    max_token_limit: int = 1500
+    summary: str = ""
+    
+    _token_counts: Deque[int] = PrivateAttr(default_factory=deque)
+    _total_tokens: int = PrivateAttr(default=0)
+    _pending: List[BaseMessage] = PrivateAttr(default_factory=list)
+    _summarizing: bool = PrivateAttr(default=False)
+    _generation: int = PrivateAttr(default=0)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+    
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the running summary followed by the recent messages"""
+        with self._lock:
+            # Messages still being summarized are passed on verbatim meanwhile
+            messages = self._pending + list(self.chat_memory.messages)
+            if self.summary:
+                messages.insert(0, SystemMessage(content=f"Summary of the earlier conversation: {self.summary}"))
+        if self.return_messages:
+            return {self.memory_key: messages}
+        return {self.memory_key: get_buffer_string(messages)}
+    
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        """Save a turn and fold the oldest messages out of the budget"""
+        super().save_context(inputs, outputs)
+        with self._lock:
+            for message in self.chat_memory.messages[len(self._token_counts):]:
+                count = estimate_tokens(message.content)
+                self._token_counts.append(count)
+                self._total_tokens += count
+            
+            # Always keep the latest turn verbatim
+            messages = self.chat_memory.messages
+            while self._total_tokens > self.max_token_limit and len(messages) > 2:
+                self._pending.append(messages.pop(0))
+                self._total_tokens -= self._token_counts.popleft()
+            
+            if self._pending and not self._summarizing:
+                self._summarizing = True
+                _summary_executor.submit(self._summarize, self._generation)
+    
+    def _summarize(self, generation: int):
+        """Fold pending messages into the running summary until none are left"""
+        while True:
+            with self._lock:
+                if generation != self._generation or not self._pending:
+                    self._summarizing = False
+                    return
+                pending = list(self._pending)
+                summary = self.summary
+            
+            try:
+                new_summary = self.llm.invoke(
+                    SUMMARY_PROMPT.format(summary=summary, new_lines=get_buffer_string(pending))
+                )
+            except Exception as e:
+                print(f"Error summarizing conversation: {e}")
+                with self._lock:
+                    self._summarizing = False
+                return
+            
+            with self._lock:
+                if generation != self._generation:
+                    return
+                self.summary = str(new_summary).strip()
+                del self._pending[:len(pending)]
+    
+    def clear(self) -> None:
+        """Clear the messages, the summary and any summarization in flight"""
+        with self._lock:
+            super().clear()
+            self.summary = ""
+            self._token_counts.clear()
+            self._total_tokens = 0
+            self._pending.clear()
+            self._summarizing = False
+            self._generation += 1
@@ -1,76 +1,370 @@
 import os
+import re
 import json
-from typing import List, Dict, Optional
+import time
+import asyncio
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, List, Dict, Optional, Iterator, Tuple
 from pathlib import Path
-from langchain_community.llms import Ollama
 from langchain.chains import ConversationalRetrievalChain, ConversationChain
+from langchain.chains.base import Chain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
 from langchain.memory import ConversationBufferMemory
 from langchain.prompts import PromptTemplate
+from langchain_core.prompts import format_document
 from langchain.schema import AIMessage, HumanMessage, BaseRetriever, Document
 from pdf_manager import PDFManager
-import requests
+from lexical_index import is_decisive, search_lexical
+from budget_memory import TokenBudgetMemory
+from response_cache import ResponseCache
+from ollama_client import create_llm, get_client
+import config
+import httpx
 from langchain.retrievers import MultiVectorRetriever
 from langchain.vectorstores import Chroma
 from langchain.storage import InMemoryStore
 from pydantic import BaseModel, Field
 
+# Shared pool for fanning a query out across vector stores
+_search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="store-search")
+
 class MultiStoreRetriever(BaseRetriever):
-    """Custom retriever that combines results from multiple vector stores"""
+    """Custom retriever that combines results from multiple vector stores
+    
+    The query is embedded once and the resulting vector is searched against
+    every store concurrently, each search bounded by store_timeout seconds.
+    In "global" mode the scored candidates of all stores are merged into a
+    single top_k list, so the prompt size stays bounded however many
+    chapters are selected. In "per_store" mode the top k of each store are
+    concatenated.
+    
+    Chapters with a lexical index are also searched with BM25, and the two
+    rankings are fused by reciprocal rank. Chunks found only lexically take
+    the largest distance of the vector results. When the best lexical hit
+    is decisive, the lexical hits are returned without a distance (None) and
+    the query is never embedded; score_threshold does not apply to them.
+    
+    When the selected chapters are small enough to have an exact_index, it
+    answers for all stores with one matrix-vector product instead.
+    """
     
     vector_stores: List = Field(default_factory=list)
+    filters: List[Optional[Dict]] = Field(default_factory=list)  # Metadata filter per store
     docstore: InMemoryStore = Field(default_factory=InMemoryStore)
+    embeddings: Optional[Any] = None
+    mode: str = "global"
+    k: int = 3  # Candidates fetched per store, and the most kept from one store
+    top_k: int = 6
+    score_threshold: Optional[float] = None  # Maximum distance, lower is closer
+    store_timeout: float = 10.0
+    lexical_targets: List = Field(default_factory=list)  # (LexicalIndex, store) per indexed chapter
+    exact_index: Optional[Any] = None  # In-process copy of the selected stores, searched instead of them
+    rrf_k: int = 60
+    decisive_ratio: float = 0.0
+    
+    def _get_embeddings(self):
+        """Get the embedding function shared by the vector stores"""
+        if self.embeddings is not None:
+            return self.embeddings
+        return self.vector_stores[0].embeddings
+    
+    def _get_filter(self, idx: int) -> Optional[Dict]:
+        """Get the metadata filter for the store at idx"""
+        return self.filters[idx] if idx < len(self.filters) else None
+    
+    def _search_store(self, store, embedding: List[float], where: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        """Search a single store with a precomputed query embedding"""
+        if not where:
+            return store.similarity_search_by_vector_with_relevance_scores(embedding, k=self.k)
+        # A consolidated store answers for several chapters in one query
+        num_chapters = len(where.get("pdf_hash", {}).get("$in", [None]))
+        return store.similarity_search_by_vector_with_relevance_scores(
+            embedding,
+            k=self.k * num_chapters,
+            filter=where
+        )
+    
+    @staticmethod
+    def _doc_key(doc: Document) -> str:
+        return f"{doc.metadata.get('source', '')}_{doc.page_content[:100]}"
+    
+    def _result_limit(self) -> int:
+        return self.top_k if self.mode == "global" else self.k * len(self.vector_stores)
+    
+    def _search_lexical(self, query: str) -> Tuple[List, bool]:
+        """Rank lexical hits for a query, returning them with whether the best one is decisive"""
+        if not self.lexical_targets:
+            return [], False
+        hits = search_lexical([index for index, _ in self.lexical_targets], query, self._result_limit())
+        return hits, is_decisive(hits, self.decisive_ratio)
+    
+    def _fetch_chunks(self, hits: List) -> List[Document]:
+        """Load the chunks of lexical hits from their stores, keeping the hit order"""
+        ids_by_target: Dict[int, List[str]] = {}
+        for position, chunk_id, _, _ in hits:
+            ids_by_target.setdefault(position, []).append(chunk_id)
+        
+        docs_by_id = {}
+        for position, ids in ids_by_target.items():
+            store = self.lexical_targets[position][1]
+            records = store._collection.get(ids=ids, include=["documents", "metadatas"])
+            for chunk_id, text, metadata in zip(records["ids"], records["documents"], records["metadatas"]):
+                docs_by_id[chunk_id] = Document(page_content=text, metadata=metadata or {})
+        return [docs_by_id[chunk_id] for _, chunk_id, _, _ in hits if chunk_id in docs_by_id]
+    
+    def _fuse(self, scored_docs: List[Tuple[Document, float]], lexical_docs: List[Document]) -> List[Tuple[Document, float]]:
+        """Combine the vector and lexical rankings by reciprocal-rank fusion"""
+        if not lexical_docs:
+            return scored_docs
+        fused: Dict[str, float] = {}
+        found: Dict[str, Tuple[Document, float]] = {}
+        worst = max((score for _, score in scored_docs), default=0.0)
+        for ranking in (scored_docs, [(doc, worst) for doc in lexical_docs]):
+            for rank, (doc, score) in enumerate(ranking):
+                key = self._doc_key(doc)
+                fused[key] = fused.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+                found.setdefault(key, (doc, score))
+        ranked = sorted(fused, key=fused.get, reverse=True)[:self._result_limit()]
+        print(f"---> [MultiStoreRetriever] Fused {len(scored_docs)} vector and {len(lexical_docs)} lexical results.")
+        return [found[key] for key in ranked]
+    
+    def _merge_results(self, results: List) -> List[Tuple[Document, float]]:
+        """Merge per-store results, skipping duplicates and failed stores"""
+        candidates = []
+        seen_docs = set()  # To avoid duplicates
+        per_chapter = {}  # Candidates kept per chapter, capped at k
+        
+        for idx, scored_docs in enumerate(results):
+            if isinstance(scored_docs, BaseException):
+                print(f"Error retrieving from store {idx+1}: {scored_docs!r}")
+                continue
+            print(f"---> [MultiStoreRetriever] Store {idx+1} returned {len(scored_docs)} documents.")
+            for doc, score in scored_docs:
+                # Use a unique identifier for each document
+                doc_id = self._doc_key(doc)
+                if doc_id in seen_docs:
+                    print(f"---> [MultiStoreRetriever] Skipping duplicate doc: {doc_id[:50]}...")
+                    continue
+                seen_docs.add(doc_id)
+                if self.score_threshold is not None and score > self.score_threshold:
+                    continue
+                chapter = doc.metadata.get("pdf_hash", idx)
+                if per_chapter.get(chapter, 0) >= self.k:
+                    continue
+                per_chapter[chapter] = per_chapter.get(chapter, 0) + 1
+                candidates.append((score, len(candidates), doc))
+        
+        if self.mode == "global":
+            # Keep the closest top_k candidates across all stores
+            candidates = heapq.nsmallest(self.top_k, candidates)
+        scored_docs = [(doc, score) for score, _, doc in candidates]
+        
+        print(f"---> [MultiStoreRetriever] Total unique documents found: {len(scored_docs)}")
+        return scored_docs
     
     def get_relevant_documents(self, query: str) -> List[Document]:
         """Get relevant documents from all vector stores"""
-        all_docs = []
-        seen_docs = set()  # To avoid duplicates
+        return [doc for doc, _ in self.search_with_scores(query)]
+
+    async def aget_relevant_documents(self, query: str) -> List[Document]:
+        """Async version of get_relevant_documents"""
+        return [doc for doc, _ in await self.asearch_with_scores(query)]
+    
+    def _search_stores(self, embedding: List[float]) -> List:
+        """Search every store concurrently, each bounded by store_timeout"""
+        futures = [
+            _search_executor.submit(self._search_store, store, embedding, self._get_filter(idx))
+            for idx, store in enumerate(self.vector_stores)
+        ]
+        wait(futures, timeout=self.store_timeout)
         
+        results = []
+        for future in futures:
+            if not future.done():
+                future.cancel()
+                results.append(TimeoutError(f"search timed out after {self.store_timeout}s"))
+            elif future.exception() is not None:
+                results.append(future.exception())
+            else:
+                results.append(future.result())
+        return results
+    
+    def search_with_scores(self, query: str) -> List[Tuple[Document, Optional[float]]]:
+        """Get relevant documents with their distances from all vector stores"""
         print(f"---> [MultiStoreRetriever] Received query: {query}")
         print(f"---> [MultiStoreRetriever] Searching {len(self.vector_stores)} vector stores.")
+        if not self.vector_stores:
+            return []
+        
+        hits, decisive = self._search_lexical(query)
+        if decisive:
+            print("---> [MultiStoreRetriever] Lexical match is decisive, skipping vector search.")
+            try:
+                docs = self._fetch_chunks(hits)
+            except Exception as e:
+                print(f"Error fetching lexical results: {e!r}")
+                docs = []
+            if docs:
+                return [(doc, None) for doc in docs]
+            # Fall back to vector search alone
+            hits = []
+        lexical_future = _search_executor.submit(self._fetch_chunks, hits) if hits else None
+        
+        embedding = self._get_embeddings().embed_query(query)
+        if self.exact_index is not None:
+            scored_docs = self._merge_results(self.exact_index.search(embedding, self.k))
+        else:
+            scored_docs = self._merge_results(self._search_stores(embedding))
+        if lexical_future is None:
+            return scored_docs
+        try:
+            return self._fuse(scored_docs, lexical_future.result(timeout=self.store_timeout))
+        except Exception as e:
+            print(f"Error fetching lexical results: {e!r}")
+            return scored_docs
 
-        for idx, store in enumerate(self.vector_stores):
+    async def asearch_with_scores(self, query: str) -> List[Tuple[Document, Optional[float]]]:
+        """Async version of search_with_scores"""
+        print(f"---> [MultiStoreRetriever] Received query: {query}")
+        print(f"---> [MultiStoreRetriever] Searching {len(self.vector_stores)} vector stores.")
+        if not self.vector_stores:
+            return []
+        
+        loop = asyncio.get_running_loop()
+        hits, decisive = self._search_lexical(query)
+        if decisive:
+            print("---> [MultiStoreRetriever] Lexical match is decisive, skipping vector search.")
             try:
-                print(f"---> [MultiStoreRetriever] Searching store {idx+1}...")
-                # Get relevant documents from each store
-                docs = store.similarity_search(query, k=3)  # Get top 3 from each store
-                print(f"---> [MultiStoreRetriever] Store {idx+1} returned {len(docs)} documents.")
-                for doc in docs:
-                    # Use a unique identifier for each document
-                    doc_id = f"{doc.metadata.get('source', '')}_{doc.page_content[:100]}"
-                    if doc_id not in seen_docs:
-                        seen_docs.add(doc_id)
-                        all_docs.append(doc)
-                    else:
-                        print(f"---> [MultiStoreRetriever] Skipping duplicate doc: {doc_id[:50]}...")
+                docs = await asyncio.wait_for(
+                    loop.run_in_executor(_search_executor, self._fetch_chunks, hits),
+                    timeout=self.store_timeout
+                )
             except Exception as e:
-                print(f"Error retrieving from store {idx+1}: {e}")
+                print(f"Error fetching lexical results: {e!r}")
+                docs = []
+            if docs:
+                return [(doc, None) for doc in docs]
+            # Fall back to vector search alone
+            hits = []
+        lexical_future = loop.run_in_executor(_search_executor, self._fetch_chunks, hits) if hits else None
         
-        print(f"---> [MultiStoreRetriever] Total unique documents found: {len(all_docs)}")
-        return all_docs
+        embedding = await self._get_embeddings().aembed_query(query)
+        if self.exact_index is not None:
+            results = await loop.run_in_executor(_search_executor, self.exact_index.search, embedding, self.k)
+        else:
+            results = await asyncio.gather(
+                *(
+                    asyncio.wait_for(
+                        loop.run_in_executor(
+                            _search_executor, self._search_store, store, embedding, self._get_filter(idx)
+                        ),
+                        timeout=self.store_timeout
+                    )
+                    for idx, store in enumerate(self.vector_stores)
+                ),
+                return_exceptions=True
+            )
+        scored_docs = self._merge_results(results)
+        if lexical_future is None:
+            return scored_docs
+        try:
+            return self._fuse(scored_docs, await asyncio.wait_for(lexical_future, timeout=self.store_timeout))
+        except Exception as e:
+            print(f"Error fetching lexical results: {e!r}")
+            return scored_docs
 
-    async def aget_relevant_documents(self, query: str) -> List[Document]:
-        """Async version of get_relevant_documents"""
-        return self.get_relevant_documents(query)
+def _replay_tokens(response: str) -> Iterator[str]:
+    """Split a cached answer into word tokens, so it streams like a generated one"""
+    return iter(re.findall(r"\S+\s*|\s+", response))
 
-class ChatManager:
-    def __init__(self):
-        self.llm = Ollama(base_url='http://localhost:11434', model="llama3.1")
-        self.pdf_manager = PDFManager()
-        self.active_pdfs: List[str] = []
-        self._update_chain()
+async def _areplay_tokens(response: str) -> AsyncIterator[str]:
+    for token in _replay_tokens(response):
+        yield token
+
+def _check_generate_response(response):
+    if response.status_code != 200:
+        raise RuntimeError(f"Error from Ollama API: {response.text}")
+
+async def _astream_generate(payload: Dict, client: Optional[httpx.AsyncClient] = None) -> AsyncIterator[str]:
+    """Stream response tokens from Ollama's generate API over async HTTP
     
-    def _update_chain(self):
-        """Update the chain with current active PDFs"""
-        
-        # Re-initialize memory each time the chain might change configuration
-        # This ensures the memory's input/output keys match the chain type
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history", 
-            return_messages=True
-        )
+    The host is picked by the shared client's routing policy; hosts that
+    refuse the connection are skipped.
+    """
+    ollama = get_client()
+    owns_client = client is None
+    if owns_client:
+        client = ollama.create_async_client()
+    tried = []
+    try:
+        while True:
+            host = ollama.acquire_host(payload["model"], exclude=tuple(tried))
+            if host is None:
+                raise RuntimeError("No Ollama host is reachable")
+            tried.append(host)
+            succeeded = False
+            try:
+                async with client.stream("POST", f"{host.url}/api/generate", json=payload) as response:
+                    if response.status_code != 200:
+                        body = await response.aread()
+                        raise RuntimeError(f"Error from Ollama API: {body.decode(errors='replace')}")
+                    succeeded = True
+                    
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        if "error" in chunk:
+                            raise RuntimeError(f"Error from Ollama API: {chunk['error']}")
+                        yield chunk.get("response", "")
+                        if chunk.get("done"):
+                            break
+                return
+            except httpx.ConnectError as e:
+                print(f"Ollama host {host.url} unreachable: {e}")
+                ollama.release_host(host, failed=True)
+                host = None
+            finally:
+                if host is not None:
+                    ollama.release_host(host, payload["model"] if succeeded else None)
+    finally:
+        if owns_client:
+            await client.aclose()
+
+# Runs the raw-question retrieval while the question is condensed
+_condense_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="condense-race")
+
+def _mean_distance(scored_docs: List[Tuple[Document, Optional[float]]]) -> float:
+    """Average distance of a result set; empty sets and decisive lexical hits, which have no distance, rank last"""
+    scores = [score for _, score in scored_docs if score is not None]
+    if not scores:
+        return float("inf")
+    return sum(scores) / len(scores)
+
+# Aggregated stage timings across all sessions, for choosing settings per deployment
+_stage_timings: Dict[str, List[float]] = {}
+_stage_timings_lock = threading.Lock()
+
+def record_stage_timings(timing: Dict):
+    """Add a request's stage timings to the running totals"""
+    with _stage_timings_lock:
+        for stage, seconds in timing.items():
+            totals = _stage_timings.setdefault(stage, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
 
-        # Define the base conversation template
-        base_template = """The following is a friendly conversation between a human and an AI.
+def get_stage_timings() -> Dict:
+    """Get the count and mean seconds of every stage"""
+    with _stage_timings_lock:
+        return {
+            stage: {"count": count, "mean": round(total / count, 3)}
+            for stage, (count, total) in _stage_timings.items()
+        }
+
+# Base conversation template
+BASE_TEMPLATE = """The following is a friendly conversation between a human and an AI.
 
 Current conversation:
 {chat_history}
@@ -83,8 +377,8 @@ Directly give your reponse without any other text.
 Human: {input}
 AI:"""
 
-        # Define the retrieval template
-        retrieval_template = """The following is a friendly conversation between a human and an AI.
+# Retrieval template
+RETRIEVAL_TEMPLATE = """The following is a friendly conversation between a human and an AI.
 Use the following pieces of context to answer the question at the end.
 If you don't know the answer, just say that you don't know, don't try to make up an answer.
 
@@ -103,90 +397,142 @@ Directly give your reponse without any other text.
 Human: {question}
 AI:"""
 
-        if not self.active_pdfs:
-            # Create a simple conversation chain without PDF context
-            prompt = PromptTemplate(
-                input_variables=["chat_history", "input"],
-                template=base_template
-            )
-            # For ConversationChain, default memory keys might work, 
-            # but we are re-initializing memory above anyway.
-            # Ensure the input key matches the prompt's variable.
-            self.memory.input_key = 'input' 
-            # Chain's output key needs to be known or handled. Let's assume 'response' is default.
-            # If ConversationChain outputs a different key, memory might need adjustment.
-            self.chain = ConversationChain(
-                llm=self.llm,
-                memory=self.memory,
-                prompt=prompt,
-                verbose=True
-            )
-            return
-        
-        # --- Configuration for ConversationalRetrievalChain ---
-
-        # Set the correct input and output keys for memory when using RetrievalQA
-        self.memory.input_key = 'question'
-        self.memory.output_key = 'answer' # Chain returns 'answer' as the main response key
+# Prompts are immutable, so every session shares the same instances
+BASE_PROMPT = PromptTemplate(
+    input_variables=["chat_history", "input"],
+    template=BASE_TEMPLATE
+)
+RETRIEVAL_PROMPT = PromptTemplate(
+    input_variables=["chat_history", "question", "context"],
+    template=RETRIEVAL_TEMPLATE
+)
+DOCUMENT_PROMPT = PromptTemplate(
+    input_variables=["page_content"],
+    template="{page_content}"
+)
 
-        # Get vector stores for active PDFs
-        vector_stores = []
-        for pdf_hash in self.active_pdfs:
-            store = self.pdf_manager.get_vector_store(pdf_hash)
-            if store:
-                vector_stores.append(store)
+class ChatManager:
+    def __init__(self, pdf_manager: Optional[PDFManager] = None, model: str = config.CHAT_MODEL,
+                 response_cache: Optional[ResponseCache] = None):
+        self.llm = create_llm(model)
+        # How follow-ups are condensed before retrieval, optionally with a smaller model
+        self.condense_mode = config.CONDENSE_MODE
+        self.condense_llm = None
+        if config.CONDENSE_MODEL and self.condense_mode in ("fast", "race"):
+            self.condense_llm = create_llm(config.CONDENSE_MODEL)
+        # The PDF manager holds embeddings and opened vector stores and may be shared
+        self.pdf_manager = pdf_manager or PDFManager()
+        self.active_pdfs: List[str] = []
+        # Chapters selected per book, as reported by the client
+        self.selected_chapters: Dict[str, List[str]] = {}
+        # Answers shared by all sessions for repeated questions, if enabled
+        self.response_cache = response_cache
         
-        if not vector_stores:
-            # Fall back to simple conversation chain if no valid vector stores
-            prompt = PromptTemplate(
-                input_variables=["chat_history", "input"],
-                template=base_template
-            )
-            self.chain = ConversationChain(
+        # Memory, retriever and chains are built once and reconfigured in place,
+        # so changing the chapter selection keeps the conversation
+        if config.MEMORY_MODE == "budget":
+            self.memory = TokenBudgetMemory(
                 llm=self.llm,
-                memory=self.memory,
-                prompt=prompt,
-                verbose=True
+                memory_key="chat_history",
+                max_token_limit=config.MEMORY_TOKEN_BUDGET,
+                return_messages=True
             )
+        else:
+            self.memory = ConversationBufferMemory(
+                memory_key="chat_history",
+                return_messages=True
+            )
+        self.retriever = MultiStoreRetriever(
+            embeddings=self.pdf_manager.embeddings,
+            mode=config.RETRIEVAL_MODE,
+            k=config.RETRIEVAL_PER_STORE_K,
+            top_k=config.RETRIEVAL_TOP_K,
+            score_threshold=config.RETRIEVAL_SCORE_THRESHOLD,
+            store_timeout=config.RETRIEVAL_STORE_TIMEOUT,
+            rrf_k=config.RETRIEVAL_RRF_K,
+            decisive_ratio=config.RETRIEVAL_LEXICAL_DECISIVE_RATIO
+        )
+        self._chains: Dict[str, Chain] = {}
+        self._update_chain()
+    
+    def set_model(self, model_name: str):
+        """Switch the chat model for this conversation, keeping its history"""
+        if model_name == self.llm.model:
             return
+        self.llm = create_llm(model_name)
+        if isinstance(self.memory, TokenBudgetMemory):
+            self.memory.llm = self.llm
+        # Cached chains hold the previous LLM
+        self._chains.clear()
+        self._update_chain()
+    
+    def _get_chain(self, chain_type: str) -> Chain:
+        """Get the cached chain of a type, building it on first use"""
+        if chain_type not in self._chains:
+            if chain_type == "retrieval":
+                self._chains[chain_type] = ConversationalRetrievalChain.from_llm(
+                    llm=self.llm,
+                    retriever=self.retriever,
+                    memory=self.memory,
+                    return_source_documents=True,
+                    combine_docs_chain_kwargs={
+                        "prompt": RETRIEVAL_PROMPT,
+                        "document_prompt": DOCUMENT_PROMPT
+                    },
+                    verbose=True
+                )
+            else:
+                self._chains[chain_type] = ConversationChain(
+                    llm=self.llm,
+                    memory=self.memory,
+                    prompt=BASE_PROMPT,
+                    verbose=True
+                )
+        return self._chains[chain_type]
+    
+    def _update_chain(self):
+        """Point the chain at the current active PDFs"""
+        self._stores_generation = self.pdf_manager.stores_generation
+        # Get vector stores for active PDFs, with a chapter filter for consolidated stores
+        search_targets = self.pdf_manager.get_search_targets(self.active_pdfs) if self.active_pdfs else []
         
-        # Create a docstore to hold all documents
-        # docstore = InMemoryStore() # Removed: Not used by MultiStoreRetriever.get_relevant_documents
-        
-        # Create our custom retriever that combines results from all stores
-        # Pass only the vector_stores, docstore is not needed for this implementation
-        retriever = MultiStoreRetriever(vector_stores=vector_stores)
+        if not search_targets:
+            # Simple conversation without PDF context, also used when no
+            # valid vector stores were found
+            self.memory.input_key = 'input'
+            self.memory.output_key = None
+            self.chain = self._get_chain("conversation")
+            return
         
-        # Create a new chain with our custom retriever
-        prompt = PromptTemplate(
-            input_variables=["chat_history", "question", "context"],
-            template=retrieval_template
-        )
+        # Swap the selected stores into the shared retriever
+        self.retriever.vector_stores = [store for store, _ in search_targets]
+        self.retriever.filters = [where for _, where in search_targets]
+        if config.RETRIEVAL_HYBRID:
+            self.retriever.lexical_targets = self.pdf_manager.get_lexical_targets(self.active_pdfs)
+        self.retriever.exact_index = self.pdf_manager.get_exact_index(self.active_pdfs)
         
-        # Configure the chain to properly use the context
-        self.chain = ConversationalRetrievalChain.from_llm(
-            llm=self.llm,
-            retriever=retriever,
-            memory=self.memory, # Pass the correctly configured memory
-            return_source_documents=True,
-            combine_docs_chain_kwargs={
-                "prompt": prompt,
-                "document_prompt": PromptTemplate(
-                    input_variables=["page_content"],
-                    template="{page_content}"
-                )
-            },
-            verbose=True
-        )
+        # ConversationalRetrievalChain takes 'question' and returns 'answer'
+        self.memory.input_key = 'question'
+        self.memory.output_key = 'answer'
+        self.chain = self._get_chain("retrieval")
     
     def set_active_pdfs(self, pdf_hashes: List[str]):
         """Set which PDFs to use for context"""
         print(f"Setting active PDFs: {pdf_hashes}")
+        # Keep the selected stores open for as long as this conversation uses them
+        self.pdf_manager.pin_selection(pdf_hashes)
+        self.pdf_manager.unpin_selection(self.active_pdfs)
         self.active_pdfs = pdf_hashes
+        self.pdf_manager.record_usage(pdf_hashes)
         print(f"Active PDFs after setting: {self.active_pdfs}")
         self._update_chain()
         print(f"Active PDFs after chain update: {self.active_pdfs}")
     
+    def close(self):
+        """Release the stores this conversation kept open"""
+        self.pdf_manager.unpin_selection(self.active_pdfs)
+        self.active_pdfs = []
+    
     def get_active_pdfs(self) -> List[str]:
         """Get list of active PDFs"""
         return self.active_pdfs
@@ -197,66 +543,268 @@ AI:"""
     
     def get_response(self, message: str, image_base64: Optional[str] = None) -> str:
         """Get a response from the model"""
+        response = ""
+        for event in self.stream_response(message, image_base64):
+            if "error" in event:
+                return f"Error getting response: {event['error']}"
+            if event.get("done"):
+                response = event["response"]
+        
+        if not response:
+            return "I apologize, but I couldn't process your request. Please try again."
+        
+        return response
+    
+    def stream_response(self, message: str, image_base64: Optional[str] = None) -> Iterator[Dict]:
+        """Stream a response from the model as incremental events
+        
+        Yields {"token": ...} events while the model generates, then a final
+        {"done": True, "response": ..., "sources": [...], "timing": {...}} event.
+        The full turn is written into memory once the stream finishes.
+        """
+        start = time.perf_counter()
+        timing = {}
+        sources = []
+        chunks = []
         try:
-            # Prepare the input for the model
-            if isinstance(self.chain, ConversationalRetrievalChain):
-                # For retrieval chain, we need to provide both input and question
-                # The question will be used for retrieval, while input maintains conversation context
-                input_data = {
-                    "question": message
-                }
+            cache_scope, cached = None, None
+            if not image_base64:
+                cache_scope, cached = self._lookup_cache(message, timing)
+            
+            if cached:
+                sources = cached[1]
+                tokens = _replay_tokens(cached[0])
+            elif image_base64:
+                # Vision requests go straight to Ollama and are not kept in memory
+                tokens = self._stream_vision(message, image_base64)
             else:
-                input_data = {"input": message}
+                prompt_text, docs = self._build_prompt(message, timing)
+                sources = [self._describe_source(doc) for doc in docs]
+                tokens = self.llm.stream(prompt_text)
+            
+            generation_start = time.perf_counter()
+            for token in tokens:
+                if not token:
+                    continue
+                if not chunks:
+                    timing["first_token"] = round(time.perf_counter() - start, 3)
+                chunks.append(token)
+                yield {"token": token}
             
-            # If there's an image, add it to the input in the format Ollama expects
-            if image_base64:
-                # Ollama expects images in a specific format
-                input_data = {
-                    "model": self.llm.model,
-                    "prompt": message,
-                    "images": [image_base64],
-                    "stream": False
-                }
-                
-                # Make a direct request to Ollama's API for vision models
-                response = requests.post(
-                    "http://localhost:11434/api/generate",
-                    json=input_data
+            timing["generation"] = round(time.perf_counter() - generation_start, 3)
+            
+            response = "".join(chunks)
+            if not image_base64 and response:
+                self.memory.save_context(
+                    {self.memory.input_key or "input": message},
+                    {self.memory.output_key or "response": response}
                 )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    return result.get("response", "")
-                else:
-                    return f"Error from Ollama API: {response.text}"
+                if cache_scope and not cached:
+                    self.response_cache.put(cache_scope, message, response, sources)
             
-            # For non-vision requests, use the chain
-            result = self.chain.invoke(input_data)
-            print(f"Result: {result}")
-
-            # Extract the response content
-            if isinstance(result, dict):
-                # ConversationalRetrievalChain returns 'answer'
-                response = result.get("answer") 
-                if response is None:
-                    # Fallback for other potential dict formats or if 'answer' is missing
-                    response = result.get("response", "") 
-            elif isinstance(result, AIMessage):
-                response = result.content
-            elif isinstance(result, list) and len(result) > 0:
-                # Handle list of messages
-                response = result[0].content if hasattr(result[0], 'content') else str(result[0])
+            timing["total"] = round(time.perf_counter() - start, 3)
+            record_stage_timings(timing)
+            yield self._done_event(response, sources, timing, cached)
+        except Exception as e:
+            error_msg = str(e)
+            print(f"Chat error: {error_msg}")  # Add logging
+            yield {"error": error_msg}
+    
+    async def astream_response(self, message: str, image_base64: Optional[str] = None,
+                               client: Optional[httpx.AsyncClient] = None,
+                               executor: Optional[ThreadPoolExecutor] = None) -> AsyncIterator[Dict]:
+        """Async version of stream_response
+        
+        Retrieval and memory updates block on Chroma and LangChain, so they run
+        in the given executor; the model's tokens are streamed over async HTTP.
+        """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        timing = {}
+        sources = []
+        chunks = []
+        try:
+            cache_scope, cached = None, None
+            if not image_base64:
+                cache_scope, cached = await loop.run_in_executor(
+                    executor, self._lookup_cache, message, timing
+                )
+            
+            if cached:
+                sources = cached[1]
+                tokens = _areplay_tokens(cached[0])
+            elif image_base64:
+                tokens = _astream_generate(self._generate_payload(message, [image_base64]), client)
             else:
-                response = str(result)
+                prompt_text, docs = await loop.run_in_executor(
+                    executor, self._build_prompt, message, timing
+                )
+                sources = [self._describe_source(doc) for doc in docs]
+                tokens = _astream_generate(self._generate_payload(prompt_text), client)
+            
+            generation_start = time.perf_counter()
+            async for token in tokens:
+                if not token:
+                    continue
+                if not chunks:
+                    timing["first_token"] = round(time.perf_counter() - start, 3)
+                chunks.append(token)
+                yield {"token": token}
             
-            if not response:
-                return "I apologize, but I couldn't process your request. Please try again."
+            timing["generation"] = round(time.perf_counter() - generation_start, 3)
             
-            return response
+            response = "".join(chunks)
+            if not image_base64 and response:
+                await loop.run_in_executor(
+                    executor,
+                    self.memory.save_context,
+                    {self.memory.input_key or "input": message},
+                    {self.memory.output_key or "response": response}
+                )
+                if cache_scope and not cached:
+                    await loop.run_in_executor(
+                        executor, self.response_cache.put, cache_scope, message, response, sources
+                    )
+            
+            timing["total"] = round(time.perf_counter() - start, 3)
+            record_stage_timings(timing)
+            yield self._done_event(response, sources, timing, cached)
         except Exception as e:
-            error_msg = f"Error getting response: {str(e)}"
+            error_msg = str(e) or type(e).__name__
             print(f"Chat error: {error_msg}")  # Add logging
-            return error_msg
+            yield {"error": error_msg}
+    
+    def _lookup_cache(self, message: str, timing: Dict) -> Tuple[Optional[str], Optional[tuple]]:
+        """Look a message up in the response cache, returning the cache scope and any hit"""
+        if self.response_cache is None:
+            return None, None
+        stage_start = time.perf_counter()
+        # Only the last few exchanges are part of the key, so the same opening
+        # question is shared across sessions
+        turns = config.RESPONSE_CACHE_HISTORY_TURNS
+        messages = self.memory.chat_memory.messages[-2 * turns:] if turns else []
+        scope = ResponseCache.scope(self.llm.model, self.active_pdfs, [msg.content for msg in messages])
+        cached = self.response_cache.get(scope, message)
+        timing["cache_lookup"] = round(time.perf_counter() - stage_start, 3)
+        return scope, cached
+    
+    @staticmethod
+    def _done_event(response: str, sources: List[Dict], timing: Dict, cached: Optional[tuple]) -> Dict:
+        event = {"done": True, "response": response, "sources": sources, "timing": timing}
+        if cached:
+            # "exact" or "semantic"
+            event["cached"] = cached[2]
+        return event
+    
+    def _generate_payload(self, prompt: str, images: Optional[List[str]] = None) -> Dict:
+        """Build a streaming request for Ollama's generate API"""
+        payload = {
+            "model": self.llm.model,
+            "prompt": prompt,
+            "stream": True
+        }
+        if images:
+            payload["images"] = images
+        return payload
+    
+    def _build_prompt(self, message: str, timing: Dict) -> tuple:
+        """Build the full prompt for the current chain, returning it with the retrieved documents"""
+        if self._stores_generation != self.pdf_manager.stores_generation:
+            # The index was reloaded and the selected stores may have been rebuilt
+            self._update_chain()
+        chat_history = self.memory.load_memory_variables({})["chat_history"]
+        
+        if not isinstance(self.chain, ConversationalRetrievalChain):
+            return self.chain.prompt.format(input=message, chat_history=chat_history), []
+        
+        # Mirror ConversationalRetrievalChain: condense the question when there is
+        # history, retrieve with it, then stuff the documents into the QA prompt
+        get_chat_history = self.chain.get_chat_history or _get_chat_history
+        history_str = get_chat_history(chat_history)
+        question, docs = self._retrieve(message, history_str if chat_history else "", timing)
+        
+        combine_chain = self.chain.combine_docs_chain
+        context = combine_chain.document_separator.join(
+            format_document(doc, combine_chain.document_prompt) for doc in docs
+        )
+        prompt_text = combine_chain.llm_chain.prompt.format(
+            context=context,
+            question=question,
+            chat_history=history_str
+        )
+        return prompt_text, docs
+    
+    def _condense_question(self, message: str, history_str: str, timing: Dict) -> str:
+        """Rephrase a follow-up into a standalone question"""
+        stage_start = time.perf_counter()
+        prompt_text = self.chain.question_generator.prompt.format(
+            question=message,
+            chat_history=history_str
+        )
+        question = str((self.condense_llm or self.llm).invoke(prompt_text)).strip() or message
+        timing["condense"] = round(time.perf_counter() - stage_start, 3)
+        return question
+    
+    def _retrieve(self, message: str, history_str: str, timing: Dict) -> Tuple[str, List[Document]]:
+        """Retrieve documents for a message, condensing it first according to the condense mode
+        
+        Returns the question to answer together with the documents.
+        """
+        if not history_str or self.condense_mode == "skip":
+            stage_start = time.perf_counter()
+            docs = self.retriever.invoke(message)
+            timing["retrieval"] = round(time.perf_counter() - stage_start, 3)
+            return message, docs
+        
+        if self.condense_mode != "race":
+            question = self._condense_question(message, history_str, timing)
+            stage_start = time.perf_counter()
+            docs = self.retriever.invoke(question)
+            timing["retrieval"] = round(time.perf_counter() - stage_start, 3)
+            return question, docs
+        
+        # Retrieve with the raw message while the question is condensed, then
+        # keep whichever result set is closer on average
+        stage_start = time.perf_counter()
+        raw_future = _condense_executor.submit(self.retriever.search_with_scores, message)
+        question = self._condense_question(message, history_str, timing)
+        condensed_start = time.perf_counter()
+        condensed = self.retriever.search_with_scores(question)
+        timing["retrieval"] = round(time.perf_counter() - condensed_start, 3)
+        raw = raw_future.result()
+        timing["retrieval_raw"] = round(time.perf_counter() - stage_start, 3)
+        
+        if _mean_distance(raw) < _mean_distance(condensed):
+            print("---> [ChatManager] Raw question retrieved closer documents than the condensed one")
+            return message, [doc for doc, _ in raw]
+        return question, [doc for doc, _ in condensed]
+    
+    def _stream_vision(self, message: str, image_base64: str) -> Iterator[str]:
+        """Stream a response from Ollama's generate API for vision models"""
+        input_data = self._generate_payload(message, [image_base64])
+        
+        # Make a direct request to Ollama's API for vision models
+        for line in get_client().stream_lines(
+            "/api/generate",
+            model=self.llm.model,
+            check=_check_generate_response,
+            json=input_data
+        ):
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if "error" in chunk:
+                raise RuntimeError(f"Error from Ollama API: {chunk['error']}")
+            yield chunk.get("response", "")
+            if chunk.get("done"):
+                break
+    
+    @staticmethod
+    def _describe_source(doc: Document) -> Dict:
+        """Summarize a retrieved document for the client"""
+        source = {key: doc.metadata[key] for key in ("source", "page") if key in doc.metadata}
+        source["snippet"] = doc.page_content[:200]
+        return source
     
     def get_chat_history(self) -> List[Dict]:
         """Get the chat history"""
@@ -268,7 +816,8 @@ AI:"""
     def get_raw_messages(self) -> List[Dict]:
         """Get raw LangChain messages with their full structure"""
         messages = []
-        for msg in self.memory.chat_memory.messages:
+        # Includes the running summary when the memory keeps one
+        for msg in self.memory.load_memory_variables({})["chat_history"]:
             messages.append({
                 "type": msg.type,
                 "content": msg.content,
@@ -278,10 +827,4 @@ AI:"""
     
     def clear_chat_history(self):
         """Clear the chat history"""
-        # Create a new memory instance with default settings
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
-        )
-        # Reinitialize the chain, which will correctly configure memory in _update_chain
-        self._update_chain() 
\ No newline at end of file
+        self.memory.clear() 
\ No newline at end of file
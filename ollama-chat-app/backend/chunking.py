@@ -0,0 +1,192 @@
+import hashlib
+import re
+from collections import Counter, deque
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from langchain.text_splitter import RecursiveCharacterTextSplitter, TextSplitter
+from langchain_core.documents import Document
+from text_utils import estimate_tokens, join_wrapped_lines, normalize_text
+
+# Chunk size and overlap of each chunker, in its unit
+CHUNKER_DEFAULTS = {"tokens": (512, 32), "characters": (1000, 200)}
+# A sentence with its closing punctuation and quotes, or a paragraph break
+_SENTENCE = re.compile(r".*?(?:[。！？；]+[”’」』）)]*|[.!?;]+(?=\s|$)|\n\s*\n|$)\s*", re.S)
+# Separators for sentences too long to fit in a chunk on their own
+_CLAUSE_SEPARATORS = ["\n", "，", "、", "：", ", ", ": ", " ", ""]
+_DIGITS = re.compile(r"\d+")
+_WORD_CHAR = re.compile(r"[^\W\d_]")
+# Lines at the top and bottom of a page checked for running headers and footers
+EDGE_LINES = 2
+# Pages read before the first one is checked for running headers and footers
+HEADER_WINDOW = 16
+
+class SentenceSplitter(TextSplitter):
+    """Packs whole sentences into chunks of up to chunk_size estimated tokens
+    
+    Sentences end at Chinese or English sentence punctuation or at a
+    paragraph break; a sentence longer than a chunk is cut at clauses, then
+    words. Overlap is made of whole trailing sentences.
+    """
+    
+    def __init__(self, **kwargs):
+        super().__init__(length_function=estimate_tokens, **kwargs)
+        self._clause_splitter = RecursiveCharacterTextSplitter(
+            separators=_CLAUSE_SEPARATORS,
+            keep_separator="end",
+            chunk_size=self._chunk_size,
+            chunk_overlap=0,
+            length_function=estimate_tokens
+        )
+    
+    def _pieces(self, text: str) -> Iterator[str]:
+        for sentence in _SENTENCE.findall(text):
+            if not sentence:
+                continue
+            if self._length_function(sentence) > self._chunk_size:
+                yield from self._clause_splitter.split_text(sentence)
+            else:
+                yield sentence
+    
+    def split_text(self, text: str) -> List[str]:
+        return [chunk for chunk, _ in self.split_texts([text])]
+    
+    def split_texts(self, texts: Iterable[str]) -> Iterator[Tuple[str, int]]:
+        """Pack the sentences of consecutive texts, read one at a time, into chunks
+        
+        Chunks and their overlap run on across texts. Each chunk is yielded
+        with the index of the text its first sentence comes from.
+        """
+        current: Deque[Tuple[str, int, int]] = deque()  # (piece, length, text index)
+        total = 0
+        for source, text in enumerate(texts):
+            for piece in self._pieces(text):
+                length = self._length_function(piece)
+                if current and total + length > self._chunk_size:
+                    chunk = _join_pieces(current)
+                    if chunk:
+                        yield chunk
+                    # Keep trailing sentences within the overlap that leave room for this one
+                    while current and (total > self._chunk_overlap or total + length > self._chunk_size):
+                        total -= current.popleft()[1]
+                current.append((piece, length, source))
+                total += length
+        chunk = _join_pieces(current)
+        if chunk:
+            yield chunk
+
+def _join_pieces(pieces: Deque[Tuple[str, int, int]]) -> Optional[Tuple[str, int]]:
+    text = "".join(piece for piece, _, _ in pieces).strip()
+    if not text:
+        return None
+    return text, next(source for piece, _, source in pieces if piece.strip())
+
+def _line_key(line: str) -> str:
+    # Page numbers change from page to page, the rest of a running header does not
+    return _DIGITS.sub("#", normalize_text(line))
+
+def _edge_keys(text: str) -> Set[str]:
+    lines = [line for line in text.splitlines() if line.strip()]
+    return {_line_key(line) for line in lines[:EDGE_LINES] + lines[-EDGE_LINES:]}
+
+def _strip_edges(text: str, repeated: Set[str]) -> str:
+    lines = text.splitlines()
+    content = [i for i, line in enumerate(lines) if line.strip()]
+    edge_rows = set(content[:EDGE_LINES] + content[-EDGE_LINES:])
+    return "\n".join(
+        line for i, line in enumerate(lines)
+        if i not in edge_rows or _line_key(line) not in repeated
+    )
+
+def strip_repeated_lines(pages: Iterable[str], min_share: float = 0.5, min_pages: int = 3,
+                         window: int = HEADER_WINDOW) -> Iterator[str]:
+    """Remove running headers and footers from the text of a PDF's pages, read one at a time
+    
+    A line among the first or last EDGE_LINES of a page counts as a header
+    or footer when, digits aside, it is found at the edge of at least
+    `min_share` of the pages read so far, and of at least `min_pages` pages.
+    The first `window` pages are held back and judged together; each later
+    page is judged as it is read.
+    """
+    counts: Counter = Counter()
+    held: List[Tuple[str, Set[str]]] = []
+    read = 0
+    for text in pages:
+        edges = _edge_keys(text)
+        counts.update(edges)
+        read += 1
+        held.append((text, edges))
+        if read < window:
+            continue
+        yield from _release(held, counts, max(min_pages, min_share * read))
+        held = []
+    yield from _release(held, counts, max(min_pages, min_share * read))
+
+def _release(held: List[Tuple[str, Set[str]]], counts: Counter, threshold: float) -> Iterator[str]:
+    for text, edges in held:
+        repeated = {key for key in edges if counts[key] >= threshold}
+        yield _strip_edges(text, repeated) if repeated else text
+
+def dedup_chunks(chunks: List[Document]) -> List[Document]:
+    """Drop chunks whose normalized text repeats an earlier chunk, or that hold no words"""
+    seen = set()
+    unique = []
+    for chunk in chunks:
+        text = normalize_text(chunk.page_content)
+        if not _WORD_CHAR.search(text):
+            continue
+        digest = hashlib.sha1(text.encode("utf-8")).digest()
+        if digest not in seen:
+            seen.add(digest)
+            unique.append(chunk)
+    return unique
+
+class Chunker:
+    """Cuts the pages of a PDF into the chunks that are embedded
+    
+    "characters" is the original splitter, cutting each page on its own
+    into `chunk_size` characters. "tokens" strips running headers and
+    footers, joins wrapped Chinese lines, packs sentences across page breaks
+    into chunks of up to `chunk_size` estimated tokens (so Chinese and
+    English chunks cost the prompt about the same), and drops duplicate
+    chunks. Either way pages are read one at a time and each chunk keeps
+    the metadata of the page it starts on.
+    """
+    
+    def __init__(self, kind: str = "characters", chunk_size: Optional[int] = None, chunk_overlap: Optional[int] = None):
+        if kind not in CHUNKER_DEFAULTS:
+            raise ValueError(f"Unknown chunker: {kind}")
+        default_size, default_overlap = CHUNKER_DEFAULTS[kind]
+        self.kind = kind
+        self.chunk_size = chunk_size or default_size
+        self.chunk_overlap = default_overlap if chunk_overlap is None else chunk_overlap
+        if kind == "characters":
+            self.splitter = RecursiveCharacterTextSplitter(
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                length_function=len
+            )
+        else:
+            self.splitter = SentenceSplitter(
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap
+            )
+    
+    def settings(self) -> Dict:
+        """Settings that change the chunks, recorded in the manifest"""
+        return {"chunker": self.kind, "chunk_size": self.chunk_size, "chunk_overlap": self.chunk_overlap}
+    
+    def split_pages(self, pages: Iterable[Document]) -> List[Document]:
+        if self.kind == "characters":
+            return [chunk for page in pages for chunk in self.splitter.split_documents([page])]
+        
+        metadatas = []
+        def page_texts() -> Iterator[str]:
+            for page in pages:
+                metadatas.append(page.metadata)
+                yield page.page_content
+        # Pages end in a paragraph break, so no sentence runs on across one
+        texts = (join_wrapped_lines(text) + "\n\n" for text in strip_repeated_lines(page_texts()))
+        chunks = [
+            Document(page_content=text, metadata=dict(metadatas[page]))
+            for text, page in self.splitter.split_texts(texts)
+        ]
+        return dedup_chunks(chunks)
@@ -0,0 +1,166 @@
+import os
+from typing import Optional
+
+# Backend settings, overridable through environment variables
+
+
+def _get_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _get_float(name: str, default: Optional[float]) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+# Ollama
+# Comma-separated base URLs of the Ollama hosts requests are spread over
+OLLAMA_BASE_URLS = [
+    url.strip() for url in os.environ.get("OLLAMA_BASE_URLS", "http://localhost:11434").split(",") if url.strip()
+]
+# Seconds to wait for a response, and for a connection to open
+OLLAMA_TIMEOUT = _get_float("OLLAMA_TIMEOUT", 300.0)
+OLLAMA_CONNECT_TIMEOUT = _get_float("OLLAMA_CONNECT_TIMEOUT", 5.0)
+# Retries of requests that failed to connect
+OLLAMA_RETRIES = _get_int("OLLAMA_RETRIES", 2)
+# Keep-alive connections pooled per Ollama host
+OLLAMA_POOL_SIZE = _get_int("OLLAMA_POOL_SIZE", 32)
+# How requests are spread over the hosts: "least_outstanding" picks the host
+# with the fewest requests in flight, "model_affinity" prefers hosts that
+# already have the model loaded
+OLLAMA_ROUTING = os.environ.get("OLLAMA_ROUTING", "least_outstanding")
+# Seconds between health checks of the hosts (only with more than one host)
+OLLAMA_HEALTH_INTERVAL = _get_float("OLLAMA_HEALTH_INTERVAL", 15.0)
+# Embedding requests sent to each host at once when embedding documents
+OLLAMA_EMBED_PARALLEL = _get_int("OLLAMA_EMBED_PARALLEL", 1)
+
+# Chat model of new conversations
+CHAT_MODEL = os.environ.get("CHAT_MODEL", "llama3.1")
+# Model embedding chunks and questions; every vector store records the model
+# it was built with, and stores built with another one are not searched until
+# they are re-embedded (preprocess_pdfs.py --reembed)
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "llama3.1")
+
+# Seconds the model list is served from cache before it is refreshed in the background
+MODEL_CATALOG_TTL = _get_float("MODEL_CATALOG_TTL", 60.0)
+
+# Retrieval
+# "global" merges scored candidates from every store into one top-k list,
+# "per_store" keeps the top RETRIEVAL_PER_STORE_K of each store
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "global")
+# Number of chunks passed to the prompt in global mode
+RETRIEVAL_TOP_K = _get_int("RETRIEVAL_TOP_K", 6)
+# Candidates fetched from (and the most kept from) a single store
+RETRIEVAL_PER_STORE_K = _get_int("RETRIEVAL_PER_STORE_K", 3)
+# Drop candidates whose distance is above this value (lower is closer)
+RETRIEVAL_SCORE_THRESHOLD = _get_float("RETRIEVAL_SCORE_THRESHOLD", None)
+# Seconds to wait for a single store search
+RETRIEVAL_STORE_TIMEOUT = _get_float("RETRIEVAL_STORE_TIMEOUT", 10.0)
+# Also search chapters with a BM25 index and fuse the results by reciprocal rank
+RETRIEVAL_HYBRID = os.environ.get("RETRIEVAL_HYBRID", "1").lower() in ("1", "true", "yes")
+# Rank offset of reciprocal-rank fusion; larger values flatten the ranks
+RETRIEVAL_RRF_K = _get_int("RETRIEVAL_RRF_K", 60)
+# Skip the embedding call when the best lexical hit scores at least this many
+# times the runner-up (0 always runs the vector search)
+RETRIEVAL_LEXICAL_DECISIVE_RATIO = _get_float("RETRIEVAL_LEXICAL_DECISIVE_RATIO", 0.0)
+# Selections of at most this many chunks are copied into memory and searched
+# exactly with numpy instead of through their stores (0 turns this off)
+EXACT_SEARCH_MAX_CHUNKS = _get_int("EXACT_SEARCH_MAX_CHUNKS", 2048)
+# In-memory copies kept, most recently used selections first
+EXACT_SEARCH_CACHE_SIZE = _get_int("EXACT_SEARCH_CACHE_SIZE", 4)
+# Megabytes of in-memory copies kept at once, counted apart from
+# STORE_CACHE_MAX_MB; larger copies are not made (0 for no limit)
+EXACT_SEARCH_MAX_MB = _get_int("EXACT_SEARCH_MAX_MB", 0)
+
+# Vector index layout
+# "per_pdf" keeps one Chroma store per PDF hash under vector_stores/<hash>,
+# "per_book" and "global" keep consolidated collections under
+# vector_stores/consolidated and select chapters with a metadata filter
+VECTOR_INDEX_LAYOUT = os.environ.get("VECTOR_INDEX_LAYOUT", "per_pdf")
+
+# Chunking done by the preprocessor
+# "characters" is the original per-page character splitter; "tokens" packs
+# sentences (split on Chinese and English punctuation) into chunks sized in
+# estimated model tokens, without running headers, footers or duplicate chunks.
+# Changing it re-chunks every PDF on the next incremental run
+CHUNKER = os.environ.get("CHUNKER", "characters")
+# Chunk size and overlap in the chunker's unit; unset uses 1000/200 characters or 512/32 tokens
+CHUNK_SIZE = _get_int("CHUNK_SIZE", None)
+CHUNK_OVERLAP = _get_int("CHUNK_OVERLAP", None)
+
+# Per-PDF store format opened by the backend: "chroma", or a quantized copy
+# written by the preprocessor ("float16" or "int8"); chapters without the
+# quantized copy fall back to Chroma
+VECTOR_STORE_FORMAT = os.environ.get("VECTOR_STORE_FORMAT", "chroma")
+# Candidates per result re-scored with float32 vectors when the quantized copy keeps them (0 turns this off)
+QUANTIZED_RERANK = _get_int("QUANTIZED_RERANK", 4)
+# IVF lists searched per query in large quantized stores
+QUANTIZED_NPROBE = _get_int("QUANTIZED_NPROBE", 8)
+
+# Embedding cache
+# Query and document embeddings kept in memory
+EMBEDDING_CACHE_SIZE = _get_int("EMBEDDING_CACHE_SIZE", 2048)
+# SQLite file that persists cached embeddings across restarts (disabled when unset)
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH") or None
+
+# PDF index
+# Seconds between checks of pdf_index.json for changes (0 only reloads through the admin endpoint)
+PDF_INDEX_CHECK_INTERVAL = _get_float("PDF_INDEX_CHECK_INTERVAL", 5.0)
+
+# Opened vector stores
+# Stores kept open at once; the least recently used one is closed beyond this (0 for no limit)
+STORE_CACHE_MAX_STORES = _get_int("STORE_CACHE_MAX_STORES", 64)
+# Estimated megabytes of vectors kept open at once (0 for no limit)
+STORE_CACHE_MAX_MB = _get_int("STORE_CACHE_MAX_MB", 0)
+
+# Chat sessions
+# Conversations kept at once; the least recently used one is dropped beyond this
+MAX_SESSIONS = _get_int("MAX_SESSIONS", 200)
+# Seconds of inactivity after which a conversation is dropped
+SESSION_IDLE_TIMEOUT = _get_float("SESSION_IDLE_TIMEOUT", 3600.0)
+
+# Conversation memory
+# "buffer" re-sends the whole conversation, "budget" keeps recent turns within
+# MEMORY_TOKEN_BUDGET and folds older ones into a running summary
+MEMORY_MODE = os.environ.get("MEMORY_MODE", "buffer")
+MEMORY_TOKEN_BUDGET = _get_int("MEMORY_TOKEN_BUDGET", 1500)
+
+# Follow-up question condensing
+# "llm" rephrases follow-ups with the chat model before retrieval, "fast" does
+# so with CONDENSE_MODEL, "skip" retrieves with the raw message, and "race"
+# retrieves with the raw message while condensing and keeps the closer result
+CONDENSE_MODE = os.environ.get("CONDENSE_MODE", "llm")
+# Smaller model used to condense in "fast" and "race" modes (the chat model when unset)
+CONDENSE_MODEL = os.environ.get("CONDENSE_MODEL") or None
+
+# Async serving mode (asgi_app.py)
+# Chats generating at once; further chats wait in a queue for a free slot
+ASGI_MAX_CONCURRENT_CHATS = _get_int("ASGI_MAX_CONCURRENT_CHATS", 8)
+# Chats allowed to wait for a slot before new ones are rejected with 503
+ASGI_MAX_QUEUED_CHATS = _get_int("ASGI_MAX_QUEUED_CHATS", 32)
+# Seconds a queued chat waits for a slot before it is rejected with 503
+ASGI_QUEUE_TIMEOUT = _get_float("ASGI_QUEUE_TIMEOUT", 30.0)
+# Threads running blocking Chroma and LangChain calls
+ASGI_BLOCKING_WORKERS = _get_int("ASGI_BLOCKING_WORKERS", 16)
+
+# Response cache for repeated questions (opt-in)
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_SIZE = _get_int("RESPONSE_CACHE_SIZE", 1000)
+# Seconds a cached answer is reused
+RESPONSE_CACHE_TTL = _get_float("RESPONSE_CACHE_TTL", 86400.0)
+# Cosine similarity above which a differently worded question reuses an answer (0 turns this off)
+RESPONSE_CACHE_SIMILARITY = _get_float("RESPONSE_CACHE_SIMILARITY", 0.95)
+# Recent exchanges that must match for an answer to be reused (0 ignores the conversation)
+RESPONSE_CACHE_HISTORY_TURNS = _get_int("RESPONSE_CACHE_HISTORY_TURNS", 1)
+# SQLite file that keeps cached answers across restarts
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH") or None
+
+# Warm-up at startup
+# Vector stores opened before the instance reports ready: "all", "none", or
+# the number of most often selected chapters
+WARMUP_STORES = os.environ.get("WARMUP_STORES", "all")
+# Load the chat and embedding models into Ollama at startup
+WARMUP_MODELS = os.environ.get("WARMUP_MODELS", "1").lower() in ("1", "true", "yes")
+# How long Ollama keeps the preloaded models in memory
+WARMUP_KEEP_ALIVE = os.environ.get("WARMUP_KEEP_ALIVE", "30m")
@@ -0,0 +1,122 @@
+import hashlib
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+from text_utils import normalize_text
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that caches vectors by (model, normalized text)
+    
+    Lookups go through a bounded in-memory LRU first and then, when a
+    cache_path is given, a SQLite table that survives restarts. Query and
+    document embeddings are cached separately because Ollama embeds them
+    with different instructions.
+    """
+    
+    def __init__(self, embeddings: Embeddings, model_name: str, max_entries: int = 2048,
+                 cache_path: Optional[str] = None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_entries = max_entries
+        # Vectors are kept as float32 arrays, a quarter the size of a list of floats
+        self._memory: "OrderedDict[str, array]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        
+        self._db = None
+        if cache_path:
+            Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(cache_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
+    
+    def _key(self, kind: str, text: str) -> str:
+        raw = f"{self.model_name}\0{kind}\0{normalize_text(text)}"
+        # PDF text extraction can leave lone surrogates behind
+        return hashlib.sha1(raw.encode("utf-8", "surrogatepass")).hexdigest()
+    
+    def _remember(self, key: str, vector: array):
+        """Insert into the in-memory LRU, evicting the least recently used entry"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+    
+    def _lookup(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return vector.tolist()
+            
+            if self._db is not None:
+                row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row:
+                    vector = array("f", row[0])
+                    self._remember(key, vector)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return vector.tolist()
+            
+            self.misses += 1
+            return None
+    
+    def _store(self, items: Dict[str, List[float]]):
+        packed = {key: array("f", vector) for key, vector in items.items()}
+        with self._lock:
+            for key, vector in packed.items():
+                self._remember(key, vector)
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    [(key, vector.tobytes()) for key, vector in packed.items()]
+                )
+                self._db.commit()
+    
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key("query", text)
+        vector = self._lookup(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self._store({key: vector})
+        return vector
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key("document", text) for text in texts]
+        vectors = [self._lookup(key) for key in keys]
+        
+        # Embed all misses in one call, once per distinct key
+        missing = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None and key not in missing:
+                missing[key] = text
+        if missing:
+            embedded = self.embeddings.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), embedded))
+            self._store(new_vectors)
+            vectors = [vector if vector is not None else new_vectors[key] for key, vector in zip(keys, vectors)]
+        return vectors
+    
+    def stats(self) -> Dict:
+        """Get cache counters for operators"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "model": self.model_name,
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "persistent": self._db is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
@@ -0,0 +1,27 @@
+from typing import Any, Dict, Optional, Tuple
+from ollama_client import _base_model
+
+# Collection metadata keys recording how a store's vectors were produced
+MODEL_KEY = "embedding_model"
+DIMENSION_KEY = "embedding_dimension"
+# Stores written before the embedding model was configurable were embedded with this
+LEGACY_EMBEDDING_MODEL = "llama3.1"
+
+def read_embedding_record(collection: Any) -> Tuple[str, Optional[int]]:
+    """Get the embedding model and dimension a collection's vectors were produced with"""
+    metadata = getattr(collection, "metadata", None) or {}
+    return metadata.get(MODEL_KEY, LEGACY_EMBEDDING_MODEL), metadata.get(DIMENSION_KEY)
+
+def write_embedding_record(collection: Any, model: str, dimension: int):
+    """Record the embedding model and dimension in a Chroma collection's metadata"""
+    collection.modify(metadata={
+        **(collection.metadata or {}),
+        MODEL_KEY: model,
+        DIMENSION_KEY: dimension
+    })
+
+def embedding_record(model: str, dimension: int) -> Dict:
+    return {MODEL_KEY: model, DIMENSION_KEY: dimension}
+
+def same_model(recorded: str, configured: str) -> bool:
+    return _base_model(recorded) == _base_model(configured)
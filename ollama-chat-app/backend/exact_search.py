@@ -0,0 +1,59 @@
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+
+class ExactSearchIndex:
+    """In-process exact search over the chunks of a chapter selection
+    
+    The embeddings of every selected store are copied into one contiguous
+    float32 matrix, rows grouped by store, with their squared norms. A query
+    is answered with a single matrix-vector product and an argpartition per
+    store, giving the same squared L2 distances and per-store results as
+    searching each Chroma store, without a client, SQLite or HNSW per query.
+    """
+    
+    def __init__(self, targets: List[Tuple[object, Optional[Dict]]]):
+        matrices = []
+        self.documents: List[Document] = []
+        # Row range and number of chapters of every store, in target order
+        self.ranges: List[Tuple[int, int, int]] = []
+        for store, where in targets:
+            records = store._collection.get(where=where or None, include=["embeddings", "documents", "metadatas"])
+            start = len(self.documents)
+            if len(records["ids"]):
+                matrices.append(np.asarray(records["embeddings"], dtype=np.float32))
+            self.documents.extend(
+                Document(page_content=text, metadata=metadata or {})
+                for text, metadata in zip(records["documents"], records["metadatas"])
+            )
+            num_chapters = len(where.get("pdf_hash", {}).get("$in", [None])) if where else 1
+            self.ranges.append((start, len(self.documents), num_chapters))
+        self.matrix = np.ascontiguousarray(np.concatenate(matrices)) if matrices else np.zeros((0, 0), dtype=np.float32)
+        self.sq_norms = (self.matrix ** 2).sum(axis=1)
+    
+    @property
+    def num_chunks(self) -> int:
+        return len(self.documents)
+    
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + self.sq_norms.nbytes
+    
+    def search(self, embedding: List[float], k: int) -> List[List[Tuple[Document, float]]]:
+        """Get the k closest chunks of every store (k per chapter for consolidated ones), closest first"""
+        if not self.num_chunks:
+            return [[] for _ in self.ranges]
+        query = np.asarray(embedding, dtype=np.float32)
+        distances = self.sq_norms + float(query @ query) - 2 * (self.matrix @ query)
+        
+        results = []
+        for start, end, num_chapters in self.ranges:
+            store_k = min(k * num_chapters, end - start)
+            if store_k <= 0:
+                results.append([])
+                continue
+            block = distances[start:end]
+            best = np.argpartition(block, store_k - 1)[:store_k]
+            best = best[np.argsort(block[best])]
+            results.append([(self.documents[start + row], float(block[row])) for row in best])
+        return results
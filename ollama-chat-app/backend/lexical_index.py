@@ -0,0 +1,157 @@
+import os
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from text_utils import lexical_terms
+
+# Directory under vector_stores holding one lexical index per chapter
+LEXICAL_DIR = "lexical"
+# BM25 term frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def lexical_index_path(resources_dir: Path, pdf_hash: str) -> Path:
+    return Path(resources_dir) / "vector_stores" / LEXICAL_DIR / f"{pdf_hash}.npz"
+
+class LexicalIndex:
+    """BM25 inverted index over the chunks of one chapter
+    
+    Terms come from `lexical_terms`, so Chinese text is matched on character
+    bigrams. Postings are stored as flat arrays (terms sorted, with offsets
+    into the chunk numbers and term frequencies) and saved as a compressed
+    .npz file next to the vector stores. Chunks are identified by their
+    Chroma ids, so a hit is fetched from the vector store without embedding.
+    """
+    
+    def __init__(self, pdf_hash: str, ids: np.ndarray, terms: np.ndarray, offsets: np.ndarray,
+                 postings: np.ndarray, frequencies: np.ndarray, lengths: np.ndarray):
+        self.pdf_hash = pdf_hash
+        self.ids = ids
+        self.terms = terms
+        self.offsets = offsets
+        self.postings = postings
+        self.frequencies = frequencies
+        self.lengths = lengths
+    
+    @classmethod
+    def build(cls, pdf_hash: str, ids: Sequence[str], texts: Sequence[str]) -> "LexicalIndex":
+        """Index the chunks of a chapter"""
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = []
+        for chunk, text in enumerate(texts):
+            counts = Counter(lexical_terms(text))
+            lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                postings.setdefault(term, []).append((chunk, count))
+        
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int32)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        flat = [entry for term in terms for entry in postings[term]]
+        return cls(
+            pdf_hash,
+            ids=np.array(ids, dtype=str),
+            terms=np.array(terms, dtype=str),
+            offsets=offsets,
+            postings=np.array([chunk for chunk, _ in flat], dtype=np.int32),
+            frequencies=np.array([min(count, 65535) for _, count in flat], dtype=np.uint16),
+            lengths=np.array(lengths, dtype=np.int32)
+        )
+    
+    def save(self, path: Path):
+        """Write the index atomically"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = path.with_name(path.name + ".tmp")
+        with open(tmp_file, 'wb') as f:
+            np.savez_compressed(
+                f, ids=self.ids, terms=self.terms, offsets=self.offsets,
+                postings=self.postings, frequencies=self.frequencies, lengths=self.lengths
+            )
+        os.replace(tmp_file, path)
+    
+    @classmethod
+    def load(cls, pdf_hash: str, path: Path) -> Optional["LexicalIndex"]:
+        """Load a chapter's index, or None when it has not been built"""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                return cls(pdf_hash, **{name: data[name] for name in data.files})
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading lexical index {path}: {e}")
+            return None
+    
+    @property
+    def num_chunks(self) -> int:
+        return len(self.lengths)
+    
+    def document_frequencies(self, terms: List[str]) -> np.ndarray:
+        """Number of chunks containing each term"""
+        if not len(self.terms):
+            return np.zeros(len(terms), dtype=np.int64)
+        positions = np.searchsorted(self.terms, terms)
+        found = (positions < len(self.terms)) & (self.terms[np.minimum(positions, len(self.terms) - 1)] == terms)
+        counts = np.zeros(len(terms), dtype=np.int64)
+        counts[found] = self.offsets[positions[found] + 1] - self.offsets[positions[found]]
+        return counts
+    
+    def score(self, terms: List[str], idf: np.ndarray, avg_length: float) -> Tuple[np.ndarray, np.ndarray]:
+        """BM25 score and number of matched query terms of every chunk
+        
+        The idf and average length are passed in so that several chapters
+        searched together are scored as one collection.
+        """
+        scores = np.zeros(self.num_chunks, dtype=np.float32)
+        matched = np.zeros(self.num_chunks, dtype=np.int32)
+        if not self.num_chunks:
+            return scores, matched
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / max(avg_length, 1.0))
+        positions = np.searchsorted(self.terms, terms)
+        for term, position, weight in zip(terms, positions, idf):
+            if position >= len(self.terms) or self.terms[position] != term:
+                continue
+            start, end = self.offsets[position], self.offsets[position + 1]
+            chunks = self.postings[start:end]
+            tf = self.frequencies[start:end].astype(np.float32)
+            scores[chunks] += weight * tf * (BM25_K1 + 1) / (tf + norm[chunks])
+            matched[chunks] += 1
+        return scores, matched
+
+def search_lexical(indexes: List[LexicalIndex], query: str, limit: int) -> List[Tuple[int, str, float, float]]:
+    """Rank the chunks of several chapter indexes against a query with BM25
+    
+    Returns up to `limit` hits as (index position, chunk id, score, share of
+    query terms matched), best first.
+    """
+    terms = sorted(set(lexical_terms(query)))
+    num_chunks = sum(index.num_chunks for index in indexes)
+    if not terms or not num_chunks:
+        return []
+    avg_length = sum(int(index.lengths.sum()) for index in indexes) / num_chunks
+    df = sum(index.document_frequencies(terms) for index in indexes)
+    idf = np.log(1 + (num_chunks - df + 0.5) / (df + 0.5)).astype(np.float32)
+    
+    hits = []
+    for position, index in enumerate(indexes):
+        scores, matched = index.score(terms, idf, avg_length)
+        top = np.flatnonzero(scores)
+        if len(top) > limit:
+            top = top[np.argpartition(-scores[top], limit - 1)[:limit]]
+        hits.extend(
+            (position, str(index.ids[chunk]), float(scores[chunk]), int(matched[chunk]) / len(terms))
+            for chunk in top
+        )
+    hits.sort(key=lambda hit: -hit[2])
+    return hits[:limit]
+
+def is_decisive(hits: List[Tuple[int, str, float, float]], ratio: float, min_coverage: float = 0.5) -> bool:
+    """Whether the best lexical hit stands out enough to answer without vector search
+    
+    The best hit has to score at least `ratio` times the runner-up and match
+    at least `min_coverage` of the query terms. A ratio of 0 disables this.
+    """
+    if not ratio or not hits or hits[0][3] < min_coverage:
+        return False
+    runner_up = hits[1][2] if len(hits) > 1 else 0.0
+    return hits[0][2] >= ratio * runner_up
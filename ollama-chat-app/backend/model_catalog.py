@@ -0,0 +1,150 @@
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from ollama_client import OllamaClient
+
+VISION_KEYWORDS = ["vision", "llava", "bakllava"]
+VISION_FAMILIES = {"clip", "mllama"}
+# Seconds between refreshes triggered by unknown model names
+MIN_REFRESH_INTERVAL = 5.0
+
+class ModelCatalog:
+    """Cached list of the models Ollama serves, with their capabilities
+    
+    The model list is refreshed from /api/tags at most every `ttl` seconds.
+    Once it is stale, callers still get the cached list while a background
+    thread refreshes it, so a busy Ollama never stalls /api/models.
+    Capabilities come from /api/show and are cached per model digest, so
+    each model is only inspected once.
+    """
+    
+    def __init__(self, client: OllamaClient, ttl: float = 60.0, refresh_timeout: float = 5.0):
+        self.client = client
+        self.ttl = ttl
+        self.refresh_timeout = refresh_timeout
+        self._models: List[Dict] = []
+        self._capabilities: Dict[Tuple[str, str], List[str]] = {}
+        self._refreshed_at: Optional[float] = None
+        self._refreshing: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.stale_serves = 0
+    
+    def get_models(self) -> List[Dict]:
+        """Get the available models, refreshing the list when it has expired"""
+        with self._lock:
+            refreshed_at = self._refreshed_at
+            if refreshed_at is not None and time.monotonic() - refreshed_at < self.ttl:
+                return list(self._models)
+            if refreshed_at is not None:
+                self.stale_serves += 1
+        thread = self._start_refresh()
+        if refreshed_at is None:
+            # Nothing cached yet: wait a little for the first list
+            thread.join(self.refresh_timeout)
+        with self._lock:
+            return list(self._models)
+    
+    def get_model(self, name: str, refresh: bool = True) -> Optional[Dict]:
+        """Get a model by name, accepting names without the ":latest" tag
+        
+        An unknown name triggers a refresh in case the model was just pulled,
+        at most once every few seconds.
+        """
+        model = self._find(name)
+        if model is None and refresh and self._age() > MIN_REFRESH_INTERVAL:
+            self._start_refresh().join(self.refresh_timeout)
+            model = self._find(name)
+        return model
+    
+    def is_known(self) -> bool:
+        """Whether a model list has been fetched at least once"""
+        with self._lock:
+            return self._refreshed_at is not None
+    
+    def _age(self) -> float:
+        """Seconds since the last successful refresh"""
+        with self._lock:
+            if self._refreshed_at is None:
+                return float("inf")
+            return time.monotonic() - self._refreshed_at
+    
+    def _find(self, name: str) -> Optional[Dict]:
+        with self._lock:
+            for model in self._models:
+                if model["name"] in (name, f"{name}:latest"):
+                    return model
+        return None
+    
+    def _start_refresh(self) -> threading.Thread:
+        """Start a background refresh unless one is already running"""
+        with self._lock:
+            if self._refreshing is None or not self._refreshing.is_alive():
+                self._refreshing = threading.Thread(target=self.refresh, name="model-catalog", daemon=True)
+                self._refreshing.start()
+            return self._refreshing
+    
+    def refresh(self):
+        """Fetch the model list and the capabilities of new models"""
+        tags = self.client.list_models()
+        if not tags:
+            # Keep serving the last list while Ollama is unreachable
+            with self._lock:
+                self.refresh_errors += 1
+            return
+        
+        models = []
+        for tag in tags:
+            capabilities = self._get_capabilities(tag["name"], tag.get("digest", ""))
+            models.append({
+                "name": tag["name"],
+                "supportsVision": "vision" in capabilities,
+                "capabilities": capabilities
+            })
+        
+        with self._lock:
+            self._models = models
+            self._refreshed_at = time.monotonic()
+            self.refreshes += 1
+    
+    def _get_capabilities(self, name: str, digest: str) -> List[str]:
+        """Get a model's capabilities from /api/show, cached per digest"""
+        key = (name, digest)
+        with self._lock:
+            if key in self._capabilities:
+                return self._capabilities[key]
+        
+        capabilities = None
+        try:
+            response = self.client.show_model(name, timeout=self.refresh_timeout)
+            if response is not None and response.status_code == 200:
+                info = response.json()
+                capabilities = info.get("capabilities")
+                if capabilities is None:
+                    # Older Ollama versions report the model families instead
+                    families = set(info.get("details", {}).get("families") or [])
+                    capabilities = ["completion"] + (["vision"] if families & VISION_FAMILIES else [])
+        except Exception as e:
+            print(f"Error fetching capabilities of {name}: {e}")
+        if capabilities is None:
+            # Fall back to guessing from the name, without caching the guess
+            lowered = name.lower()
+            return ["completion"] + (["vision"] if any(k in lowered for k in VISION_KEYWORDS) else [])
+        
+        with self._lock:
+            self._capabilities[key] = capabilities
+        return capabilities
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            age = None if self._refreshed_at is None else round(time.monotonic() - self._refreshed_at, 1)
+            return {
+                "models": len(self._models),
+                "age": age,
+                "ttl": self.ttl,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+                "stale_serves": self.stale_serves,
+                "capabilities_cached": len(self._capabilities)
+            }
@@ -0,0 +1,387 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from langchain_community.embeddings import OllamaEmbeddings
+from langchain_community.llms import Ollama
+from langchain_community.llms.ollama import OllamaEndpointNotFoundError
+import config
+
+class OllamaHost:
+    """Routing state of one Ollama host"""
+    
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.loaded_models: set = set()
+        # Models pulled on the host, as last listed by /api/tags
+        self.pulled_models: set = set()
+    
+    def stats(self) -> Dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "loaded_models": sorted(self.loaded_models)
+        }
+
+def _base_model(name: str) -> str:
+    """Model name without the default tag, so "llama3.1" matches "llama3.1:latest" """
+    return name[:-len(":latest")] if name.endswith(":latest") else name
+
+class OllamaClient:
+    """Shared HTTP client for all Ollama traffic
+    
+    Requests go through one requests.Session whose connection pool keeps
+    connections to every Ollama host alive between calls. Each request is
+    routed to a host by the configured policy:
+    
+    - "least_outstanding" picks the host with the fewest requests in flight
+    - "model_affinity" prefers hosts that already have the model loaded,
+      then the fewest requests in flight
+    
+    A host that fails to connect is marked unhealthy and the request moves on
+    to the next host. Unhealthy hosts are skipped until a background health
+    check (GET /api/ps, which also reports the loaded models) reaches them again.
+    """
+    
+    def __init__(self, base_urls: List[str], timeout: float = 300.0, connect_timeout: float = 5.0,
+                 retries: int = 2, pool_size: int = 32, policy: str = "least_outstanding",
+                 health_interval: float = 15.0):
+        self.hosts = [OllamaHost(url) for url in base_urls]
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.pool_size = pool_size
+        self.policy = policy
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        
+        # Only connection errors are retried: a POST that reached Ollama may
+        # already be generating, so it is not sent again
+        retry = Retry(total=retries, connect=retries, read=0, status=0, backoff_factor=0.2)
+        adapter = HTTPAdapter(pool_connections=len(self.hosts), pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        
+        if len(self.hosts) > 1 and health_interval > 0:
+            threading.Thread(target=self._health_loop, name="ollama-health", daemon=True).start()
+    
+    @property
+    def base_url(self) -> str:
+        """URL of the first healthy host"""
+        return next((host.url for host in self.hosts if host.healthy), self.hosts[0].url)
+    
+    def acquire_host(self, model: Optional[str] = None, exclude: tuple = ()) -> Optional[OllamaHost]:
+        """Pick a host for a request and count it as outstanding until release_host"""
+        with self._lock:
+            candidates = [host for host in self.hosts if host not in exclude]
+            if not candidates:
+                return None
+            # With every host down, still try them rather than failing outright
+            candidates = [host for host in candidates if host.healthy] or candidates
+            if self.policy == "model_affinity" and model:
+                wanted = _base_model(model)
+                candidates = [host for host in candidates if wanted in host.loaded_models] or candidates
+            host = min(candidates, key=lambda h: h.outstanding)
+            host.outstanding += 1
+            host.requests += 1
+            return host
+    
+    def release_host(self, host: OllamaHost, model: Optional[str] = None, failed: bool = False):
+        """Finish a request started with acquire_host"""
+        with self._lock:
+            host.outstanding -= 1
+            if failed:
+                host.failures += 1
+                host.healthy = False
+            else:
+                host.healthy = True
+                if model:
+                    # Ollama keeps a model loaded after serving it
+                    host.loaded_models.add(_base_model(model))
+    
+    def _send(self, method: str, path: str, model: Optional[str], timeout: Optional[float],
+              **kwargs) -> tuple:
+        """Send a request to the first reachable host, returning (host, response)"""
+        tried = []
+        last_error = None
+        while True:
+            host = self.acquire_host(model, exclude=tuple(tried))
+            if host is None:
+                if last_error is None:
+                    raise requests.exceptions.ConnectionError("No Ollama host is configured")
+                raise last_error
+            tried.append(host)
+            try:
+                response = self.session.request(
+                    method,
+                    f"{host.url}{path}",
+                    timeout=(self.connect_timeout, timeout or self.timeout),
+                    **kwargs
+                )
+                return host, response
+            except Exception as e:
+                # Release the host however the request failed, and only try another one if it was unreachable
+                self.release_host(host, failed=True)
+                if not isinstance(e, requests.exceptions.ConnectionError):
+                    raise
+                print(f"Ollama host {host.url} unreachable: {e}")
+                last_error = e
+    
+    def request(self, method: str, path: str, model: Optional[str] = None,
+                timeout: Optional[float] = None, **kwargs) -> requests.Response:
+        """Send a request to a host chosen by the routing policy"""
+        host, response = self._send(method, path, model, timeout, **kwargs)
+        self.release_host(host, model if response.ok else None)
+        return response
+    
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+    
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+    
+    def stream_lines(self, path: str, model: Optional[str] = None,
+                     check: Optional[Callable[[requests.Response], None]] = None,
+                     timeout: Optional[float] = None, **kwargs) -> Iterator[str]:
+        """POST a streaming request and yield its response lines
+        
+        The host counts the request as outstanding until the stream is
+        consumed or closed. `check` can raise on an unexpected response.
+        """
+        host, response = self._send("POST", path, model, timeout, stream=True, **kwargs)
+        failed = False
+        try:
+            response.encoding = "utf-8"
+            if check:
+                check(response)
+            yield from response.iter_lines(decode_unicode=True)
+        except requests.exceptions.RequestException:
+            # The body timed out or the connection dropped mid-stream
+            failed = True
+            raise
+        finally:
+            response.close()
+            self.release_host(host, model if response.ok and not failed else None, failed=failed)
+    
+    def list_models(self) -> List[Dict]:
+        """Get the models of all reachable hosts, each listed once"""
+        models = {}
+        for host in self.hosts:
+            try:
+                response = self.session.get(f"{host.url}/api/tags", timeout=(self.connect_timeout, 10.0))
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                print(f"Error fetching models from {host.url}: {e}")
+                continue
+            pulled = response.json().get("models", [])
+            with self._lock:
+                host.pulled_models = {model["name"] for model in pulled}
+            for model in pulled:
+                models.setdefault(model["name"], model)
+        return list(models.values())
+    
+    def show_model(self, model: str, timeout: Optional[float] = None) -> Optional[requests.Response]:
+        """POST /api/show for a model, asking the hosts that have it pulled first
+        
+        A host without the model answers 404, so the next host is tried until
+        one answers otherwise. Returns None if no host could be reached.
+        """
+        with self._lock:
+            hosts = sorted(self.hosts, key=lambda host: model not in host.pulled_models)
+        response = None
+        for host in hosts:
+            try:
+                response = self.session.post(f"{host.url}/api/show", json={"model": model},
+                                             timeout=(self.connect_timeout, timeout or self.timeout))
+            except requests.exceptions.RequestException as e:
+                print(f"Error fetching details of {model} from {host.url}: {e}")
+                continue
+            if response.status_code != 404:
+                return response
+        return response
+    
+    def preload(self, model: str, keep_alive: str = "30m", embedding: bool = False) -> List[str]:
+        """Load a model on every healthy host and keep it loaded, returning the hosts that loaded it"""
+        path, payload = "/api/generate", {"model": model, "keep_alive": keep_alive}
+        if embedding:
+            path, payload = "/api/embeddings", {"model": model, "prompt": "", "keep_alive": keep_alive}
+        loaded = []
+        for host in self.hosts:
+            if not host.healthy:
+                continue
+            try:
+                response = self.session.post(f"{host.url}{path}", json=payload, timeout=(self.connect_timeout, self.timeout))
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                print(f"Error preloading {model} on {host.url}: {e}")
+                continue
+            with self._lock:
+                host.loaded_models.add(_base_model(model))
+            loaded.append(host.url)
+        return loaded
+    
+    def check_health(self):
+        """Refresh the health and loaded models of every host"""
+        for host in self.hosts:
+            try:
+                response = self.session.get(f"{host.url}/api/ps", timeout=(self.connect_timeout, 5.0))
+                response.raise_for_status()
+                loaded = {_base_model(model["name"]) for model in response.json().get("models", [])}
+            except (requests.exceptions.RequestException, ValueError):
+                with self._lock:
+                    if host.healthy:
+                        print(f"Ollama host {host.url} failed its health check")
+                    host.healthy = False
+                continue
+            with self._lock:
+                host.healthy = True
+                host.loaded_models = loaded
+    
+    def _health_loop(self):
+        while True:
+            time.sleep(self.health_interval)
+            self.check_health()
+    
+    def create_async_client(self, max_connections: int = 32) -> httpx.AsyncClient:
+        """Create a pooled async client with the same timeouts, for use within one event loop
+        
+        Requests use absolute URLs of hosts picked with acquire_host.
+        """
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=httpx.AsyncHTTPTransport(retries=self.retries)
+        )
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "hosts": [host.stats() for host in self.hosts]
+            }
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> OllamaClient:
+    """Get the process-wide Ollama client, creating it on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OllamaClient(
+                config.OLLAMA_BASE_URLS,
+                timeout=config.OLLAMA_TIMEOUT,
+                connect_timeout=config.OLLAMA_CONNECT_TIMEOUT,
+                retries=config.OLLAMA_RETRIES,
+                pool_size=config.OLLAMA_POOL_SIZE,
+                policy=config.OLLAMA_ROUTING,
+                health_interval=config.OLLAMA_HEALTH_INTERVAL
+            )
+        return _client
+
+class PooledOllama(Ollama):
+    """Ollama LLM that sends its requests through the shared client"""
+    
+    def _create_stream(self, api_url: str, payload: Any, stop: Optional[List[str]] = None,
+                       **kwargs: Any) -> Iterator[str]:
+        if self.stop is not None and stop is not None:
+            raise ValueError("`stop` found in both the input and default params.")
+        elif self.stop is not None:
+            stop = self.stop
+        
+        params = self._default_params
+        for key in self._default_params:
+            if key in kwargs:
+                params[key] = kwargs[key]
+        if "options" in kwargs:
+            params["options"] = kwargs["options"]
+        else:
+            params["options"] = {
+                **params["options"],
+                "stop": stop,
+                **{k: v for k, v in kwargs.items() if k not in self._default_params},
+            }
+        
+        if payload.get("messages"):
+            request_payload = {"messages": payload.get("messages", []), **params}
+        else:
+            request_payload = {
+                "prompt": payload.get("prompt"),
+                "images": payload.get("images", []),
+                **params,
+            }
+        
+        return get_client().stream_lines(
+            api_url[len(self.base_url):],
+            model=self.model,
+            check=self._check_response,
+            headers=self.headers if isinstance(self.headers, dict) else None,
+            auth=self.auth,
+            json=request_payload,
+            timeout=self.timeout
+        )
+    
+    def _check_response(self, response: requests.Response):
+        if response.status_code == 404:
+            raise OllamaEndpointNotFoundError(
+                "Ollama call failed with status code 404. "
+                f"Maybe your model is not found and you should pull the model with `ollama pull {self.model}`."
+            )
+        if response.status_code != 200:
+            raise ValueError(
+                f"Ollama call failed with status code {response.status_code}. Details: {response.text}"
+            )
+
+class PooledOllamaEmbeddings(OllamaEmbeddings):
+    """Ollama embeddings that send their requests through the shared client
+    
+    Document batches fan out over all hosts, OLLAMA_EMBED_PARALLEL requests
+    per host at a time.
+    """
+    
+    def _process_emb_response(self, input: str) -> List[float]:
+        try:
+            response = get_client().post(
+                "/api/embeddings",
+                model=self.model,
+                headers=self.headers,
+                json={"model": self.model, "prompt": input, **self._default_params}
+            )
+        except requests.exceptions.RequestException as e:
+            raise ValueError(f"Error raised by inference endpoint: {e}")
+        
+        if response.status_code != 200:
+            raise ValueError(
+                f"Error raised by inference API HTTP code: {response.status_code}, {response.text}"
+            )
+        try:
+            return response.json()["embedding"]
+        except requests.exceptions.JSONDecodeError as e:
+            raise ValueError(f"Error raised by inference API: {e}.\nResponse: {response.text}")
+    
+    def _embed(self, input: List[str]) -> List[List[float]]:
+        parallel = len(get_client().hosts) * config.OLLAMA_EMBED_PARALLEL
+        if parallel <= 1 or len(input) <= 1:
+            return [self._process_emb_response(text) for text in input]
+        with ThreadPoolExecutor(max_workers=min(parallel, len(input))) as pool:
+            return list(pool.map(self._process_emb_response, input))
+
+def create_llm(model: str) -> PooledOllama:
+    """Create an Ollama LLM that uses the shared client"""
+    return PooledOllama(base_url=get_client().base_url, model=model)
+
+def create_embeddings(model: str) -> PooledOllamaEmbeddings:
+    """Create Ollama embeddings that use the shared client"""
+    return PooledOllamaEmbeddings(base_url=get_client().base_url, model=model)
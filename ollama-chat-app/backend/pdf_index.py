@@ -0,0 +1,50 @@
+import hashlib
+import json
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Optional
+
+def _normalize_path(path: str) -> str:
+    """Compare paths written on Windows and POSIX alike"""
+    return path.replace("\\", "/").lstrip("/")
+
+class PDFIndex:
+    """Snapshot of pdf_index.json with lookup maps built once
+    
+    A snapshot is never modified after it is built; reloading builds a new
+    one and swaps it in, so readers holding the old snapshot are unaffected.
+    """
+    
+    def __init__(self, textbooks: Dict[str, Dict], body: bytes = b"", mtime: Optional[float] = None):
+        self.textbooks = textbooks
+        self.mtime = mtime
+        # Serialized response for /api/pdf/index and its validator
+        self.body = body or json.dumps(textbooks).encode("utf-8")
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self.available_pdfs: Dict[str, Dict] = {}
+        self.chapters_by_book: Dict[str, List[Dict]] = {}
+        self.hash_by_path: Dict[str, str] = {}
+        for book_title, textbook in textbooks.items():
+            self.chapters_by_book[book_title] = list(textbook["chapters"])
+            for chapter in textbook["chapters"]:
+                self.available_pdfs[chapter["hash"]] = chapter
+                preview_image = chapter.get("preview_image", "")
+                if preview_image:
+                    # The client asks by the preview image path with a .pdf suffix
+                    self.hash_by_path[_normalize_path(preview_image.replace('.jpg', '.pdf'))] = chapter["hash"]
+                    if chapter.get("filename"):
+                        pdf_path = str(PurePosixPath(_normalize_path(preview_image)).with_name(chapter["filename"]))
+                        self.hash_by_path[pdf_path] = chapter["hash"]
+    
+    @classmethod
+    def load(cls, index_file: Path) -> "PDFIndex":
+        """Read an index file, returning an empty index when it does not exist"""
+        try:
+            mtime = index_file.stat().st_mtime
+        except OSError:
+            return cls({})
+        with open(index_file, 'rb') as f:
+            body = f.read()
+        return cls(json.loads(body.decode("utf-8")), body=body, mtime=mtime)
+    
+    def get_pdf_hash(self, filename: str) -> Optional[str]:
+        return self.hash_by_path.get(_normalize_path(filename))
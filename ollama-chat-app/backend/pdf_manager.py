@@ -1,30 +1,186 @@
 import os
 import json
 import hashlib
-from typing import List, Dict, Optional
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import List, Dict, Optional, Tuple
 from pathlib import Path
-from langchain_community.embeddings import OllamaEmbeddings
+from ollama_client import create_embeddings
 from langchain_community.vectorstores import Chroma
+import config
+from embedding_cache import CachedEmbeddings
+from store_cache import StoreCache, close_store
+from pdf_index import PDFIndex
+from lexical_index import LexicalIndex, lexical_index_path
+from quantized_store import QUANTIZED_DIR, QuantizedStore, read_store_format
+from exact_search import ExactSearchIndex
+from embedding_record import read_embedding_record, same_model
+
+# Directory under vector_stores holding the consolidated collections
+CONSOLIDATED_DIR = "consolidated"
+# File under vector_stores counting how often each chapter was selected
+USAGE_FILE = "usage.json"
+USAGE_SAVE_INTERVAL = 30.0
+
+def store_version(store_dir: Path, collection_name: Optional[str]) -> Optional[str]:
+    """Identify the on-disk version of a store, which changes when the store is rebuilt
+    
+    A rebuilt Chroma collection is deleted and recreated under a new id, and
+    a rewritten quantized copy (collection_name None) is swapped in as a new
+    directory. The id is read straight from Chroma's SQLite file, without
+    opening a client.
+    """
+    if collection_name is None:
+        try:
+            return str((store_dir / "chunks.json").stat().st_mtime_ns)
+        except OSError:
+            return None
+    db_file = store_dir / "chroma.sqlite3"
+    if not db_file.exists():
+        return None
+    try:
+        db = sqlite3.connect(f"{db_file.resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            row = db.execute("SELECT id FROM collections WHERE name = ?", (collection_name,)).fetchone()
+        finally:
+            db.close()
+    except sqlite3.Error as e:
+        print(f"Error reading vector store version: {e}")
+        return None
+    return str(row[0]) if row else None
+
+def consolidated_collection_name(layout: str, book_title: str) -> str:
+    """Get the consolidated collection a book's chunks live in"""
+    if layout == "global":
+        return "library"
+    # Chroma collection names are restricted to ASCII, so hash the book title
+    return "book_" + hashlib.md5(book_title.encode("utf-8")).hexdigest()[:16]
 
 class PDFManager:
-    def __init__(self, resources_dir: str = "../resources"):
+    def __init__(self, resources_dir: str = "../resources", index_layout: str = config.VECTOR_INDEX_LAYOUT):
         self.resources_dir = Path(resources_dir)
-        self.embeddings = OllamaEmbeddings(base_url='http://localhost:11434', model="llama3.1")
-        self.vector_stores: Dict[str, Chroma] = {}
-        self.textbooks: Dict[str, Dict] = {}
-        self.available_pdfs: Dict[str, Dict] = {}
-        self._load_pdf_index()
-        
-    def _load_pdf_index(self):
-        """Load the PDF index and available PDFs"""
-        index_file = self.resources_dir / "pdf_index.json"
-        if index_file.exists():
-            with open(index_file, 'r', encoding='utf-8') as f:
-                self.textbooks = json.load(f)
-                # Create a flat list of all PDFs for easy access
-                for textbook in self.textbooks.values():
-                    for chapter in textbook["chapters"]:
-                        self.available_pdfs[chapter["hash"]] = chapter
+        self.index_layout = index_layout
+        self.embeddings = CachedEmbeddings(
+            create_embeddings(config.EMBEDDING_MODEL),
+            model_name=config.EMBEDDING_MODEL,
+            max_entries=config.EMBEDDING_CACHE_SIZE,
+            cache_path=config.EMBEDDING_CACHE_PATH
+        )
+        # Opened stores, keyed by PDF hash or consolidated collection name
+        self.store_cache = StoreCache(
+            max_stores=config.STORE_CACHE_MAX_STORES,
+            max_bytes=config.STORE_CACHE_MAX_MB * 1024 * 1024,
+            on_evict=self._on_store_evicted
+        )
+        # Stores embedded with another model than EMBEDDING_MODEL, with that model
+        self.embedding_mismatches: Dict[str, str] = {}
+        self.embedding_dimensions: Dict[str, Optional[int]] = {}
+        # On-disk version of every open store with where to read it again, see store_version
+        self._store_versions: Dict[str, Tuple[Tuple[Path, Optional[str]], Optional[str]]] = {}
+        # Bumped when a reload may have replaced stores, so sessions look their selection up again
+        self.stores_generation = 0
+        # Search targets memoized per chapter selection, with the store cache keys they use
+        self._search_targets: "OrderedDict[Tuple[str, ...], Tuple[List[str], List[Tuple[Chroma, Optional[Dict]]]]]" = OrderedDict()
+        # Guards the memo, never held while opening stores since evictions take it from inside the store cache
+        self._targets_lock = threading.Lock()
+        # Bumped on every eviction, so targets built across one are not memoized
+        self._targets_generation = 0
+        self.max_cached_selections = 256
+        # Lexical indexes loaded per chapter, None for chapters without one
+        self._lexical_indexes: "OrderedDict[str, Optional[LexicalIndex]]" = OrderedDict()
+        self._lexical_lock = threading.Lock()
+        # In-memory exact search copies per chapter selection with the store cache keys they copy,
+        # None for selections too large or quantized
+        self._exact_indexes: "OrderedDict[Tuple[str, ...], Tuple[List[str], Optional[ExactSearchIndex]]]" = OrderedDict()
+        self._exact_lock = threading.Lock()
+        # Bumped on every reload, and counted per store cache key on every eviction,
+        # so copies built across either are not memoized
+        self._exact_generation = 0
+        self._exact_evictions: Counter = Counter()
+        self.exact_index_builds = 0
+        # The index is swapped as a whole on reload, so readers never see a partial one
+        self.index_file = self.resources_dir / "pdf_index.json"
+        self.index = PDFIndex.load(self.index_file)
+        self.index_check_interval = config.PDF_INDEX_CHECK_INTERVAL
+        self._index_checked_at = time.monotonic()
+        self._reload_lock = threading.Lock()
+        self.index_reloads = 0
+        # How often each chapter was selected, so warm-up can open the popular ones
+        self._usage_file = self.resources_dir / "vector_stores" / USAGE_FILE
+        self._usage: Counter = self._load_usage()
+        self._usage_saved_at = time.monotonic()
+        self._usage_lock = threading.Lock()
+    
+    @property
+    def textbooks(self) -> Dict[str, Dict]:
+        return self.get_index().textbooks
+    
+    @property
+    def available_pdfs(self) -> Dict[str, Dict]:
+        return self.get_index().available_pdfs
+    
+    def get_index(self) -> PDFIndex:
+        """Get the current PDF index, reloading it first if pdf_index.json changed"""
+        if self.index_check_interval and time.monotonic() - self._index_checked_at >= self.index_check_interval:
+            self._index_checked_at = time.monotonic()
+            self.reload_index(force=False)
+        return self.index
+    
+    def reload_index(self, force: bool = True) -> bool:
+        """Reload pdf_index.json, unless unchanged and not forced, returning whether it was swapped
+        
+        Readers keep using the current index while the new one is built, and
+        a reload already in progress is not repeated.
+        """
+        if not self._reload_lock.acquire(blocking=force):
+            return False
+        try:
+            try:
+                mtime = self.index_file.stat().st_mtime
+            except OSError:
+                mtime = None
+            if not force and mtime == self.index.mtime:
+                return False
+            try:
+                index = PDFIndex.load(self.index_file)
+            except (OSError, ValueError) as e:
+                # The preprocessor may still be writing; keep the current index
+                print(f"Error reloading PDF index: {e}")
+                return False
+            self.index = index
+            # A rebuilt store's open handle points at a deleted collection, so
+            # close it even when pinned; it is reopened on its next lookup
+            rebuilt = self._rebuilt_stores()
+            if rebuilt:
+                print(f"Closing {len(rebuilt)} vector stores rebuilt since they were opened")
+                self.store_cache.discard(rebuilt)
+            with self._targets_lock:
+                self._search_targets.clear()
+                self._targets_generation += 1
+            with self._lexical_lock:
+                self._lexical_indexes.clear()
+            with self._exact_lock:
+                self._exact_indexes.clear()
+                self._exact_generation += 1
+            # Stores may have been re-embedded along with the new index
+            self.embedding_mismatches.clear()
+            self.stores_generation += 1
+            self.index_reloads += 1
+            print(f"Reloaded PDF index: {len(index.available_pdfs)} chapters")
+            return True
+        finally:
+            self._reload_lock.release()
+    
+    def index_stats(self) -> Dict:
+        index = self.index
+        return {
+            "chapters": len(index.available_pdfs),
+            "books": len(index.chapters_by_book),
+            "etag": index.etag,
+            "reloads": self.index_reloads
+        }
     
     def get_available_pdfs(self) -> List[Dict]:
         """Get list of all available PDFs"""
@@ -35,15 +191,320 @@ class PDFManager:
         return self.available_pdfs.get(pdf_hash)
     
     def get_vector_store(self, pdf_hash: str) -> Optional[Chroma]:
-        """Get the vector store for a specific PDF"""
-        if pdf_hash not in self.vector_stores:
+        """Get the vector store for a specific PDF
+        
+        With a quantized VECTOR_STORE_FORMAT the PDF's quantized copy is
+        opened instead of Chroma when the preprocessor has written one.
+        """
+        def open_store() -> Optional[Chroma]:
             store_dir = self.resources_dir / "vector_stores" / pdf_hash
-            if store_dir.exists():
-                self.vector_stores[pdf_hash] = Chroma(
+            if not store_dir.exists() or pdf_hash in self.embedding_mismatches:
+                return None
+            quantized_dir = store_dir / QUANTIZED_DIR
+            if config.VECTOR_STORE_FORMAT != "chroma" and read_store_format(quantized_dir) == config.VECTOR_STORE_FORMAT:
+                store = QuantizedStore(
+                    quantized_dir,
+                    embeddings=self.embeddings,
+                    rerank=config.QUANTIZED_RERANK,
+                    nprobe=config.QUANTIZED_NPROBE
+                )
+            else:
+                store = Chroma(
                     persist_directory=str(store_dir),
                     embedding_function=self.embeddings
                 )
-        return self.vector_stores.get(pdf_hash)
+            if not self._check_embedding(pdf_hash, store):
+                return None
+            self._record_version(pdf_hash, quantized_dir if isinstance(store, QuantizedStore) else store_dir,
+                                 None if isinstance(store, QuantizedStore) else store._collection.name)
+            return store
+        return self.store_cache.get(pdf_hash, open_store)
+    
+    def get_consolidated_store(self, collection_name: str) -> Optional[Chroma]:
+        """Get a consolidated collection holding the chunks of many PDFs"""
+        def open_store() -> Optional[Chroma]:
+            store_dir = self.resources_dir / "vector_stores" / CONSOLIDATED_DIR
+            if not store_dir.exists() or collection_name in self.embedding_mismatches:
+                return None
+            store = Chroma(
+                collection_name=collection_name,
+                persist_directory=str(store_dir),
+                embedding_function=self.embeddings
+            )
+            if not self._check_embedding(collection_name, store):
+                return None
+            self._record_version(collection_name, store_dir, collection_name)
+            return store
+        return self.store_cache.get(collection_name, open_store)
+    
+    def _record_version(self, key: str, store_dir: Path, collection_name: Optional[str]):
+        source = (store_dir, collection_name)
+        self._store_versions[key] = (source, store_version(*source))
+    
+    def _rebuilt_stores(self) -> List[str]:
+        """Get the open stores whose files were rebuilt since they were opened"""
+        return [
+            key for key, (source, version) in list(self._store_versions.items())
+            if store_version(*source) != version
+        ]
+    
+    def _check_embedding(self, key: str, store: Chroma) -> bool:
+        """Check that a store was embedded with EMBEDDING_MODEL, closing it if not
+        
+        Questions embedded with one model cannot be compared with chunks
+        embedded with another, and differing dimensions fail outright, so such
+        stores are left out of retrieval instead.
+        """
+        model, dimension = read_embedding_record(store._collection)
+        if same_model(model, self.embeddings.model_name):
+            self.embedding_dimensions[key] = dimension
+            return True
+        print(f"Vector store {key} was embedded with {model}, not {self.embeddings.model_name}; "
+              f"it is skipped until re-embedded with preprocess_pdfs.py --reembed")
+        self.embedding_mismatches[key] = model
+        close_store(store)
+        return False
+    
+    def embedding_stats(self) -> Dict:
+        return {
+            "model": self.embeddings.model_name,
+            "dimensions": sorted({dimension for dimension in self.embedding_dimensions.values() if dimension}),
+            "mismatched_stores": dict(self.embedding_mismatches)
+        }
+    
+    def _store_keys(self, pdf_hashes: List[str]) -> List[str]:
+        """Get the store cache keys that may hold the chunks of a chapter selection"""
+        keys = set(pdf_hashes)
+        if self.index_layout != "per_pdf":
+            # Chapters missing from the consolidated index fall back to their own store
+            for pdf_hash in pdf_hashes:
+                metadata = self.get_pdf_metadata(pdf_hash)
+                if metadata:
+                    keys.add(consolidated_collection_name(self.index_layout, metadata["book_title"]))
+        return list(keys)
+    
+    def pin_selection(self, pdf_hashes: List[str]):
+        """Keep the stores of a chapter selection open while a conversation uses them"""
+        self.store_cache.pin(self._store_keys(pdf_hashes))
+    
+    def unpin_selection(self, pdf_hashes: List[str]):
+        self.store_cache.unpin(self._store_keys(pdf_hashes))
+    
+    def _on_store_evicted(self, key: str):
+        self._store_versions.pop(key, None)
+        # Memoized targets may reference the closed store
+        with self._targets_lock:
+            self._search_targets.clear()
+            self._targets_generation += 1
+        # The store may be reopened re-embedded, so drop the copies of it
+        with self._exact_lock:
+            for selection, (keys, _) in list(self._exact_indexes.items()):
+                if key in keys:
+                    del self._exact_indexes[selection]
+            self._exact_evictions[key] += 1
+    
+    def get_search_targets(self, pdf_hashes: List[str]) -> List[Tuple[Chroma, Optional[Dict]]]:
+        """Get the stores to search for a chapter selection, each with an optional metadata filter
+        
+        With a consolidated layout the selected chapters of a collection are
+        searched with a single filtered query instead of one store per chapter.
+        PDFs missing from the consolidated index fall back to their own store.
+        The result is memoized per selection. A build during which a store was
+        evicted may hold that closed store, so it is built once more and only
+        memoized when no eviction got in between.
+        """
+        selection = tuple(pdf_hashes)
+        with self._targets_lock:
+            memoized = self._search_targets.get(selection)
+            if memoized is not None:
+                self._search_targets.move_to_end(selection)
+        if memoized is not None:
+            keys, targets = memoized
+            self.store_cache.touch(keys)
+            return targets
+        
+        for _ in range(2):
+            with self._targets_lock:
+                generation = self._targets_generation
+            keys, targets = self._build_search_targets(pdf_hashes)
+            with self._targets_lock:
+                if generation != self._targets_generation:
+                    continue
+                self._search_targets[selection] = (keys, targets)
+                while len(self._search_targets) > self.max_cached_selections:
+                    self._search_targets.popitem(last=False)
+            break
+        return targets
+    
+    def _build_search_targets(self, pdf_hashes: List[str]) -> Tuple[List[str], List[Tuple[Chroma, Optional[Dict]]]]:
+        """Open the stores for a chapter selection and group consolidated chapters
+        
+        Returns the store cache keys of the opened stores along with the targets.
+        """
+        keys = []
+        targets = []
+        grouped: Dict[str, List[str]] = {}
+        for pdf_hash in pdf_hashes:
+            key, store = self._locate_store(pdf_hash)
+            if store is None:
+                continue
+            if key != pdf_hash:
+                grouped.setdefault(key, []).append(pdf_hash)
+                continue
+            keys.append(pdf_hash)
+            targets.append((store, None))
+        
+        for collection_name, hashes in grouped.items():
+            keys.append(collection_name)
+            targets.append((
+                self.get_consolidated_store(collection_name),
+                {"pdf_hash": {"$in": hashes}}
+            ))
+        return keys, targets
+    
+    def _locate_store(self, pdf_hash: str) -> Tuple[str, Optional[Chroma]]:
+        """Get the store holding a PDF's chunks with its store cache key
+        
+        With a consolidated layout this is the PDF's collection, falling back
+        to its own store when it is missing from the consolidated index.
+        """
+        metadata = self.get_pdf_metadata(pdf_hash)
+        if self.index_layout != "per_pdf" and metadata:
+            collection_name = consolidated_collection_name(self.index_layout, metadata["book_title"])
+            store = self.get_consolidated_store(collection_name)
+            if store:
+                return collection_name, store
+        return pdf_hash, self.get_vector_store(pdf_hash)
+    
+    def get_lexical_targets(self, pdf_hashes: List[str]) -> List[Tuple[LexicalIndex, Chroma]]:
+        """Get the lexical indexes of a chapter selection, each with the store holding its chunks
+        
+        Chapters preprocessed before lexical indexes existed are left out and
+        only searched by vector.
+        """
+        targets = []
+        for pdf_hash in pdf_hashes:
+            with self._lexical_lock:
+                cached = pdf_hash in self._lexical_indexes
+                if cached:
+                    self._lexical_indexes.move_to_end(pdf_hash)
+                    index = self._lexical_indexes[pdf_hash]
+            if not cached:
+                # Loaded outside the lock; a concurrent load of the same chapter just wins the memo
+                index = LexicalIndex.load(pdf_hash, lexical_index_path(self.resources_dir, pdf_hash))
+                with self._lexical_lock:
+                    self._lexical_indexes[pdf_hash] = index
+                    while len(self._lexical_indexes) > self.max_cached_selections:
+                        self._lexical_indexes.popitem(last=False)
+            if index is None:
+                continue
+            _, store = self._locate_store(pdf_hash)
+            if store is not None:
+                targets.append((index, store))
+        return targets
+    
+    def get_exact_index(self, pdf_hashes: List[str]) -> Optional[ExactSearchIndex]:
+        """Get an in-memory exact search copy of a chapter selection
+        
+        Returns None when exact search is turned off, the selection has more
+        than EXACT_SEARCH_MAX_CHUNKS chunks or EXACT_SEARCH_MAX_MB, or any of
+        its stores is quantized, in which case its stores are searched. Copies
+        are kept for the most recently used selections, within
+        EXACT_SEARCH_CACHE_SIZE and EXACT_SEARCH_MAX_MB, until one of their
+        stores is evicted or the index is reloaded.
+        """
+        if not config.EXACT_SEARCH_MAX_CHUNKS or not pdf_hashes:
+            return None
+        selection = tuple(pdf_hashes)
+        keys = self._store_keys(pdf_hashes)
+        with self._exact_lock:
+            memoized = self._exact_indexes.get(selection)
+            if memoized is not None:
+                self._exact_indexes.move_to_end(selection)
+                return memoized[1]
+            state = (self._exact_generation, [self._exact_evictions[key] for key in keys])
+        
+        # Built outside the lock, since opening stores may evict others and evictions take it
+        index = self._build_exact_index(pdf_hashes)
+        with self._exact_lock:
+            if state == (self._exact_generation, [self._exact_evictions[key] for key in keys]):
+                self._exact_indexes[selection] = (keys, index)
+                max_bytes = config.EXACT_SEARCH_MAX_MB * 1024 * 1024
+                while len(self._exact_indexes) > config.EXACT_SEARCH_CACHE_SIZE or (
+                        max_bytes and self._exact_bytes() > max_bytes):
+                    self._exact_indexes.popitem(last=False)
+        return index
+    
+    def _exact_bytes(self) -> int:
+        """Memory taken by the memoized exact search copies, called with _exact_lock held"""
+        return sum(index.nbytes for _, index in self._exact_indexes.values() if index is not None)
+    
+    def _build_exact_index(self, pdf_hashes: List[str]) -> Optional[ExactSearchIndex]:
+        targets = self.get_search_targets(pdf_hashes)
+        if any(isinstance(store, QuantizedStore) for store, _ in targets):
+            # Quantized stores already search their compact codes; a float32 copy would undo that
+            return None
+        try:
+            num_chunks = sum(
+                len(store._collection.get(where=where, include=[])["ids"]) if where else store._collection.count()
+                for store, where in targets
+            )
+            if num_chunks > config.EXACT_SEARCH_MAX_CHUNKS:
+                return None
+            index = ExactSearchIndex(targets)
+            self.exact_index_builds += 1
+            max_bytes = config.EXACT_SEARCH_MAX_MB * 1024 * 1024
+            if max_bytes and index.nbytes > max_bytes:
+                print(f"Exact search copy of {num_chunks} chunks takes {index.nbytes / 2**20:.1f} MB, "
+                      f"over EXACT_SEARCH_MAX_MB; searching its stores instead")
+                return None
+            return index
+        except Exception as e:
+            print(f"Error building exact search index: {e}")
+            return None
+    
+    def exact_index_stats(self) -> Dict:
+        with self._exact_lock:
+            memoized = list(self._exact_indexes.values())
+        indexes = [index for _, index in memoized if index is not None]
+        return {
+            "max_chunks": config.EXACT_SEARCH_MAX_CHUNKS,
+            "max_bytes": config.EXACT_SEARCH_MAX_MB * 1024 * 1024,
+            "selections": len(memoized),
+            "indexes": len(indexes),
+            "chunks": sum(index.num_chunks for index in indexes),
+            "bytes": sum(index.nbytes for index in indexes),
+            "builds": self.exact_index_builds
+        }
+    
+    def _load_usage(self) -> Counter:
+        try:
+            with open(self._usage_file, 'r', encoding='utf-8') as f:
+                return Counter(json.load(f))
+        except (OSError, ValueError):
+            return Counter()
+    
+    def record_usage(self, pdf_hashes: List[str]):
+        """Count a chapter selection, saving the counts at most every USAGE_SAVE_INTERVAL seconds"""
+        with self._usage_lock:
+            self._usage.update(pdf_hashes)
+            if time.monotonic() - self._usage_saved_at < USAGE_SAVE_INTERVAL:
+                return
+            self._usage_saved_at = time.monotonic()
+            usage = dict(self._usage)
+        try:
+            tmp_file = self._usage_file.with_suffix(".tmp")
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(usage, f)
+            os.replace(tmp_file, self._usage_file)
+        except OSError as e:
+            print(f"Error saving chapter usage: {e}")
+    
+    def most_used_pdfs(self, limit: int) -> List[str]:
+        """Get the most selected indexed chapters, most used first"""
+        with self._usage_lock:
+            ranked = [pdf_hash for pdf_hash, _ in self._usage.most_common() if pdf_hash in self.available_pdfs]
+        return ranked[:limit]
     
     def get_preview_image_path(self, pdf_hash: str) -> Optional[str]:
         """Get the preview image path for a PDF"""
@@ -53,9 +514,5 @@ class PDFManager:
         return None
     
     def get_pdf_hash(self, filename: str) -> Optional[str]:
-        """Get the hash of a PDF file"""
-        # Find the PDF in available_pdfs by matching the filename
-        for pdf_hash, metadata in self.available_pdfs.items():
-            if metadata.get("preview_image", "").replace('.jpg', '.pdf') == filename:
-                return pdf_hash
-        return None 
\ No newline at end of file
+        """Get the hash of a PDF file by its path under the resources directory"""
+        return self.get_index().get_pdf_hash(filename)
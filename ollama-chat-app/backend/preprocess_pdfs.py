@@ -2,28 +2,81 @@ import os
 import json
 import hashlib
 import argparse
-from typing import Dict, List
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import BinaryIO, Dict, Iterator, List, Optional, Set, Tuple
 from pathlib import Path
+import chromadb
 from PyPDF2 import PdfReader
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import OllamaEmbeddings
+from ollama_client import create_embeddings
 from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+import config
+from embedding_cache import CachedEmbeddings
+from pdf_manager import CONSOLIDATED_DIR, consolidated_collection_name
+from lexical_index import LEXICAL_DIR, LexicalIndex, lexical_index_path
+from quantized_store import QUANTIZED_DIR, QUANTIZED_FORMATS, read_store_format, write_quantized_store
+from chunking import CHUNKER_DEFAULTS, Chunker
+from embedding_record import embedding_record, read_embedding_record, same_model, write_embedding_record
+
+# Bytes read at a time when hashing a PDF
+HASH_CHUNK_SIZE = 1024 * 1024
+# Manifest of indexed PDFs kept next to the vector stores
+MANIFEST_FILE = "manifest.json"
+# Per-PDF vector store directories are named after the PDF's MD5 hash
+PDF_HASH_PATTERN = re.compile(r"[0-9a-f]{32}")
 
 class PDFPreprocessor:
-    def __init__(self, resources_dir: str = "../resources"):
+    def __init__(self, resources_dir: str = "../resources", index_layout: str = config.VECTOR_INDEX_LAYOUT,
+                 store_format: str = config.VECTOR_STORE_FORMAT, keep_float32: bool = False,
+                 embedding_model: str = config.EMBEDDING_MODEL, chunker: str = config.CHUNKER):
         self.resources_dir = Path(resources_dir)
-        self.embeddings = OllamaEmbeddings(base_url='http://localhost:11434', model="llama3.1")
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
+        self.index_layout = index_layout
+        # Per-PDF stores also get a quantized copy in this format unless it is "chroma"
+        self.store_format = store_format
+        self.keep_float32 = keep_float32
+        self.embeddings = CachedEmbeddings(
+            create_embeddings(embedding_model),
+            model_name=embedding_model,
+            max_entries=config.EMBEDDING_CACHE_SIZE,
+            cache_path=config.EMBEDDING_CACHE_PATH
         )
+        self.chunker = Chunker(chunker, config.CHUNK_SIZE, config.CHUNK_OVERLAP)
+        # Hashes already computed, keyed by path, size and mtime so each version of a file is hashed once
+        self._pdf_hashes: Dict[Tuple[str, int, int], str] = {}
         
-    def _get_pdf_hash(self, file_path: str) -> str:
-        """Generate a unique hash for a PDF file"""
-        with open(file_path, 'rb') as f:
-            return hashlib.md5(f.read()).hexdigest()
+    def _hash_key(self, file_path: str) -> Tuple[str, int, int]:
+        stat = os.stat(file_path)
+        return str(Path(file_path).resolve()), stat.st_size, stat.st_mtime_ns
+    
+    def _known_pdf_hash(self, file_path: str) -> Optional[str]:
+        """Get the hash of a PDF if this run already computed it"""
+        return self._pdf_hashes.get(self._hash_key(file_path))
+    
+    def _get_pdf_hash(self, file_path: str, pdf_file: Optional[BinaryIO] = None) -> str:
+        """Generate a unique hash for a PDF file
+        
+        An already open file is hashed from its start and rewound, so the
+        file is not opened a second time.
+        """
+        key = self._hash_key(file_path)
+        if key in self._pdf_hashes:
+            return self._pdf_hashes[key]
+        # Hash in fixed-size chunks so large scans are never held in memory
+        md5 = hashlib.md5()
+        with (nullcontext(pdf_file) if pdf_file is not None else open(file_path, 'rb')) as f:
+            f.seek(0)
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                md5.update(chunk)
+            f.seek(0)
+        self._pdf_hashes[key] = md5.hexdigest()
+        return self._pdf_hashes[key]
     
     def _get_image_path(self, pdf_path: Path) -> str:
         """Get the path to the chapter image or book cover"""
@@ -46,10 +99,14 @@ class PDFPreprocessor:
             return str(cover_image.relative_to(self.resources_dir))
         return None
     
-    def _extract_metadata(self, pdf_path: str) -> Dict:
+    def _extract_metadata(self, pdf_path: str, reader: Optional[PdfReader] = None,
+                          pdf_hash: Optional[str] = None) -> Dict:
         """Extract metadata from PDF"""
         pdf_path = Path(pdf_path)
-        reader = PdfReader(str(pdf_path))
+        if reader is None:
+            with open(pdf_path, 'rb') as pdf_file:
+                pdf_hash = pdf_hash or self._get_pdf_hash(str(pdf_path), pdf_file)
+                return self._extract_metadata(str(pdf_path), PdfReader(pdf_file), pdf_hash)
         metadata = reader.metadata
         
         # Get the image path
@@ -64,7 +121,7 @@ class PDFPreprocessor:
             pass
         
         return {
-            "hash": self._get_pdf_hash(str(pdf_path)),
+            "hash": pdf_hash or self._get_pdf_hash(str(pdf_path)),
             "filename": pdf_path.name,
             "title": metadata.get("/Title", pdf_path.stem),
             "author": metadata.get("/Author", "Unknown"),
@@ -79,23 +136,246 @@ class PDFPreprocessor:
             "order": chapter_num
         }
     
-    def _create_vector_store(self, pdf_path: str, pdf_hash: str):
+    def _iter_pages(self, pdf_path: str, reader: PdfReader) -> Iterator[Document]:
+        """Yield the text of each page as a document, one page at a time"""
+        for page_num, page in enumerate(reader.pages):
+            # Text extraction can yield lone surrogates, which cannot be stored
+            text = (page.extract_text() or "").encode("utf-8", "replace").decode("utf-8")
+            yield Document(page_content=text, metadata={"source": pdf_path, "page": page_num})
+    
+    def _load_splits(self, pdf_path: str, metadata: Dict, reader: PdfReader) -> List[Document]:
+        """Split a parsed PDF into chunks tagged with its chapter"""
+        # Pages are chunked as they are extracted; chunks may still span page breaks
+        splits = self.chunker.split_pages(self._iter_pages(pdf_path, reader))
+        
+        # Tag every chunk with its chapter so consolidated stores can filter on it
+        for split in splits:
+            split.metadata.update({
+                "pdf_hash": metadata["hash"],
+                "book_title": metadata["book_title"],
+                "chapter": metadata["chapter"]
+            })
+        return splits
+    
+    def _create_vector_store(self, pdf_path: str, metadata: Dict, reader: PdfReader):
         """Create and save vector store for a PDF"""
-        store_dir = self.resources_dir / "vector_stores" / pdf_hash
+        splits = self._load_splits(pdf_path, metadata, reader)
+        vectors = self.embeddings.embed_documents([split.page_content for split in splits])
+        self._write_vector_store(splits, vectors, metadata)
+    
+    def _get_consolidated_store(self, book_title: str) -> Chroma:
+        """Open the consolidated collection a book's chunks belong to"""
+        store_dir = self.resources_dir / "vector_stores" / CONSOLIDATED_DIR
         store_dir.mkdir(parents=True, exist_ok=True)
+        return Chroma(
+            collection_name=consolidated_collection_name(self.index_layout, book_title),
+            persist_directory=str(store_dir),
+            embedding_function=self.embeddings
+        )
+    
+    def _write_vector_store(self, splits: List[Document], vectors: List[List[float]], metadata: Dict,
+                            batch_size: int = 1000):
+        """Replace a PDF's chunks in its vector store with precomputed embeddings"""
+        if self.index_layout != "per_pdf":
+            vectorstore = self._get_consolidated_store(metadata["book_title"])
+            self._check_collection_model(vectorstore)
+            vectorstore._collection.delete(where={"pdf_hash": metadata["hash"]})
+        else:
+            store_dir = self.resources_dir / "vector_stores" / metadata["hash"]
+            store_dir.mkdir(parents=True, exist_ok=True)
+            # Start from an empty collection so rebuilding does not duplicate chunks
+            Chroma(persist_directory=str(store_dir), embedding_function=self.embeddings).delete_collection()
+            vectorstore = Chroma(persist_directory=str(store_dir), embedding_function=self.embeddings)
         
-        # Load and process PDF
-        loader = PyPDFLoader(pdf_path)
-        pages = loader.load()
-        splits = self.text_splitter.split_documents(pages)
+        ids = [str(uuid.uuid4()) for _ in splits]
+        for start in range(0, len(splits), batch_size):
+            batch = splits[start:start + batch_size]
+            vectorstore._collection.add(
+                ids=ids[start:start + batch_size],
+                embeddings=vectors[start:start + batch_size],
+                documents=[split.page_content for split in batch],
+                metadatas=[split.metadata for split in batch]
+            )
+        if vectors:
+            write_embedding_record(vectorstore._collection, self.embeddings.model_name, len(vectors[0]))
+        self._write_lexical_index(metadata["hash"], ids, [split.page_content for split in splits])
+        if self.index_layout == "per_pdf" and self.store_format in QUANTIZED_FORMATS:
+            write_quantized_store(
+                store_dir / QUANTIZED_DIR, ids, vectors,
+                [split.page_content for split in splits], [split.metadata for split in splits],
+                fmt=self.store_format, keep_float32=self.keep_float32,
+                embedding=embedding_record(self.embeddings.model_name, len(vectors[0])) if vectors else None
+            )
+        elif self.index_layout == "per_pdf":
+            # A copy left from an earlier run no longer matches the new vectors
+            shutil.rmtree(store_dir / QUANTIZED_DIR, ignore_errors=True)
+    
+    def _check_collection_model(self, vectorstore: Chroma):
+        """Refuse to add chunks to a consolidated collection embedded with another model"""
+        model, _ = read_embedding_record(vectorstore._collection)
+        if vectorstore._collection.count() and not same_model(model, self.embeddings.model_name):
+            raise ValueError(
+                f"Collection {vectorstore._collection.name} was embedded with {model}, not "
+                f"{self.embeddings.model_name}; re-embed it with --reembed first"
+            )
+    
+    def quantize_stores(self, textbooks: Dict, only_missing: bool = False):
+        """Write quantized copies of the existing per-PDF stores, without re-embedding"""
+        if self.index_layout != "per_pdf" or self.store_format not in QUANTIZED_FORMATS:
+            raise ValueError("Quantized copies are written for per_pdf stores in float16 or int8 format")
+        for textbook in textbooks.values():
+            for chapter in textbook["chapters"]:
+                store_dir = self.resources_dir / "vector_stores" / chapter["hash"]
+                if not store_dir.exists():
+                    print(f"No vector store for {chapter['filename']} ({chapter['hash']}), skipping")
+                    continue
+                if only_missing and read_store_format(store_dir / QUANTIZED_DIR) == self.store_format:
+                    continue
+                store = Chroma(persist_directory=str(store_dir), embedding_function=self.embeddings)
+                records = store._collection.get(include=["embeddings", "documents", "metadatas"])
+                if not len(records["ids"]):
+                    continue
+                model, dimension = read_embedding_record(store._collection)
+                write_quantized_store(
+                    store_dir / QUANTIZED_DIR, records["ids"], records["embeddings"],
+                    records["documents"], records["metadatas"],
+                    fmt=self.store_format, keep_float32=self.keep_float32,
+                    embedding=embedding_record(model, dimension or len(records["embeddings"][0]))
+                )
+                print(f"Quantized {len(records['ids'])} chunks of {chapter['filename']} ({chapter['hash']}) to {self.store_format}")
+    
+    def _write_lexical_index(self, pdf_hash: str, ids: List[str], texts: List[str]):
+        """Save the BM25 index of a PDF's chunks next to its vector store"""
+        LexicalIndex.build(pdf_hash, ids, texts).save(lexical_index_path(self.resources_dir, pdf_hash))
+    
+    def build_lexical_indexes(self, textbooks: Dict, only_missing: bool = False):
+        """Build lexical indexes from the chunks already in the vector stores, without re-embedding"""
+        for textbook in textbooks.values():
+            for chapter in textbook["chapters"]:
+                pdf_hash = chapter["hash"]
+                if only_missing and lexical_index_path(self.resources_dir, pdf_hash).exists():
+                    continue
+                if self.index_layout != "per_pdf":
+                    store = self._get_consolidated_store(chapter["book_title"])
+                    records = store._collection.get(where={"pdf_hash": pdf_hash}, include=["documents"])
+                else:
+                    store_dir = self.resources_dir / "vector_stores" / pdf_hash
+                    if not store_dir.exists():
+                        print(f"No vector store for {chapter['filename']} ({pdf_hash}), skipping")
+                        continue
+                    store = Chroma(persist_directory=str(store_dir), embedding_function=self.embeddings)
+                    records = store._collection.get(include=["documents"])
+                if not records["ids"]:
+                    print(f"No chunks indexed for {chapter['filename']} ({pdf_hash}), skipping")
+                    continue
+                self._write_lexical_index(pdf_hash, records["ids"], records["documents"])
+                print(f"Built lexical index of {len(records['ids'])} chunks for {chapter['filename']} ({pdf_hash})")
+    
+    def migrate_to_consolidated(self, textbooks: Dict, batch_size: int = 500):
+        """Copy existing per-PDF stores into consolidated collections without re-embedding"""
+        if self.index_layout == "per_pdf":
+            raise ValueError("Set a consolidated index layout (per_book or global) to migrate")
         
-        # Create vector store
-        vectorstore = Chroma.from_documents(
-            documents=splits,
-            embedding=self.embeddings,
-            persist_directory=str(store_dir)
-        )
-        vectorstore.persist()
+        for textbook in textbooks.values():
+            for chapter in textbook["chapters"]:
+                pdf_hash = chapter["hash"]
+                store_dir = self.resources_dir / "vector_stores" / pdf_hash
+                if not store_dir.exists():
+                    print(f"No vector store for {chapter['filename']} ({pdf_hash}), skipping")
+                    continue
+                
+                source = Chroma(persist_directory=str(store_dir), embedding_function=self.embeddings)
+                records = source._collection.get(include=["embeddings", "documents", "metadatas"])
+                if not len(records["ids"]):
+                    continue
+                model, dimension = read_embedding_record(source._collection)
+                if not same_model(model, self.embeddings.model_name):
+                    print(f"Vector store of {chapter['filename']} ({pdf_hash}) was embedded with {model}, skipping")
+                    continue
+                target = self._get_consolidated_store(chapter["book_title"])
+                self._check_collection_model(target)
+                target._collection.delete(where={"pdf_hash": pdf_hash})
+                
+                metadatas = [
+                    {
+                        **(record_metadata or {}),
+                        "pdf_hash": pdf_hash,
+                        "book_title": chapter["book_title"],
+                        "chapter": chapter["chapter"]
+                    }
+                    for record_metadata in records["metadatas"]
+                ]
+                for start in range(0, len(records["ids"]), batch_size):
+                    end = start + batch_size
+                    target._collection.upsert(
+                        ids=records["ids"][start:end],
+                        embeddings=records["embeddings"][start:end],
+                        documents=records["documents"][start:end],
+                        metadatas=metadatas[start:end]
+                    )
+                write_embedding_record(target._collection, model, dimension or len(records["embeddings"][0]))
+                self._write_lexical_index(pdf_hash, records["ids"], records["documents"])
+                print(f"Migrated {len(records['ids'])} chunks from {chapter['filename']} ({pdf_hash})")
+    
+    def reembed_stores(self, textbooks: Dict):
+        """Re-embed the chunks of the existing vector stores with the configured embedding model
+        
+        Chunk text and metadata are read back from the stores, so PDFs are not
+        parsed again. Stores already embedded with the model are skipped. A
+        consolidated collection is embedded whole before it is dropped and
+        rewritten, since one collection cannot hold vectors of two dimensions.
+        The manifest is updated so incremental runs keep the new stores.
+        """
+        model = self.embeddings.model_name
+        stores: Dict[str, List[Dict]] = {}
+        for textbook in textbooks.values():
+            for chapter in textbook["chapters"]:
+                key = chapter["hash"] if self.index_layout == "per_pdf" \
+                    else consolidated_collection_name(self.index_layout, chapter["book_title"])
+                stores.setdefault(key, []).append(chapter)
+        
+        reembedded = set()
+        for key, chapters in stores.items():
+            if self.index_layout == "per_pdf":
+                store_dir = self.resources_dir / "vector_stores" / key
+                if not store_dir.exists():
+                    print(f"No vector store for {chapters[0]['filename']} ({key}), skipping")
+                    continue
+                store = Chroma(persist_directory=str(store_dir), embedding_function=self.embeddings)
+            else:
+                store = self._get_consolidated_store(chapters[0]["book_title"])
+            old_model, _ = read_embedding_record(store._collection)
+            if not store._collection.count() or same_model(old_model, model):
+                continue
+            
+            start_time = time.perf_counter()
+            chunks = []
+            for chapter in chapters:
+                where = {"pdf_hash": chapter["hash"]} if self.index_layout != "per_pdf" else None
+                records = store._collection.get(where=where, include=["documents", "metadatas"])
+                splits = [
+                    Document(page_content=text, metadata=metadata or {})
+                    for text, metadata in zip(records["documents"], records["metadatas"])
+                ]
+                vectors = self.embeddings.embed_documents([split.page_content for split in splits])
+                chunks.append((chapter, splits, vectors))
+            if self.index_layout != "per_pdf":
+                store.delete_collection()
+            for chapter, splits, vectors in chunks:
+                if splits:
+                    self._write_vector_store(splits, vectors, chapter)
+                    reembedded.add(chapter["hash"])
+            num_chunks = sum(len(splits) for _, splits, _ in chunks)
+            print(f"Re-embedded {num_chunks} chunks of {key} from {old_model} to {model} "
+                  f"in {time.perf_counter() - start_time:.1f}s")
+        
+        manifest = self._load_manifest()
+        if reembedded and manifest:
+            for entry in manifest.values():
+                if entry["hash"] in reembedded:
+                    entry["embedding_model"] = model
+            _write_json_atomic(self.resources_dir / "vector_stores" / MANIFEST_FILE, manifest)
+        print(f"Re-embedded {len(reembedded)} chapters with {model}")
     
     def process_pdf(self, pdf_path: str, update_only: bool = False):
         """Process a single PDF file"""
@@ -105,13 +385,16 @@ class PDFPreprocessor:
             return
         
         try:
-            # Extract metadata
-            metadata = self._extract_metadata(str(pdf_path))
-            pdf_hash = metadata["hash"]
-            
-            # Create vector store only if not in update mode
-            if not update_only:
-                self._create_vector_store(str(pdf_path), pdf_hash)
+            # Parse the PDF once for both metadata and page text, reading
+            # pages from the open file rather than a copy in memory
+            with open(pdf_path, 'rb') as pdf_file:
+                pdf_hash = self._get_pdf_hash(str(pdf_path), pdf_file)
+                reader = PdfReader(pdf_file)
+                metadata = self._extract_metadata(str(pdf_path), reader, pdf_hash)
+                
+                # Create vector store only if not in update mode
+                if not update_only:
+                    self._create_vector_store(str(pdf_path), metadata, reader)
             
             print(f"Successfully processed: {pdf_path}")
             return metadata
@@ -120,6 +403,18 @@ class PDFPreprocessor:
             print(f"Error processing {pdf_path}: {str(e)}")
             return None
     
+    def _add_to_textbooks(self, textbooks: Dict, pdf_file: Path, metadata: Dict):
+        """Add a processed PDF to its textbook entry in the index"""
+        book_title = metadata["book_title"]
+        if book_title not in textbooks:
+            book_dir = pdf_file.parent
+            textbooks[book_title] = {
+                "title": book_title,
+                "cover_image": self._get_cover_path(book_dir),
+                "chapters": []
+            }
+        textbooks[book_title]["chapters"].append(metadata)
+    
     def process_directory(self, pdf_dir: str, update_only: bool = False):
         """Process all PDFs in a directory"""
         pdf_dir = Path(pdf_dir)
@@ -136,15 +431,7 @@ class PDFPreprocessor:
         for pdf_file in pdf_dir.glob("**/*.pdf"):
             metadata = self.process_pdf(str(pdf_file), update_only)
             if metadata:
-                book_title = metadata["book_title"]
-                if book_title not in textbooks:
-                    book_dir = pdf_file.parent
-                    textbooks[book_title] = {
-                        "title": book_title,
-                        "cover_image": self._get_cover_path(book_dir),
-                        "chapters": []
-                    }
-                textbooks[book_title]["chapters"].append(metadata)
+                self._add_to_textbooks(textbooks, pdf_file, metadata)
         
         # Sort chapters by order
         for book in textbooks.values():
@@ -152,30 +439,321 @@ class PDFPreprocessor:
         
         return textbooks
     
+    def process_directory_parallel(self, pdf_dir: str, workers: int = 4, batch_size: int = 32):
+        """Process all PDFs in a directory with parallel parsing and concurrent embedding
+        
+        PDFs are parsed and split in a process pool while chunk batches are
+        embedded concurrently in a thread pool. At most `workers` PDFs are
+        parsed ahead and at most 2 * `workers` batches wait for embedding, so
+        memory stays flat however large the library is.
+        """
+        pdf_dir = Path(pdf_dir)
+        if not pdf_dir.exists():
+            print(f"Directory not found: {pdf_dir}")
+            return
+        
+        textbooks = {}
+        for pdf_file, metadata in self._process_files_parallel(sorted(pdf_dir.glob("**/*.pdf")), workers, batch_size):
+            self._add_to_textbooks(textbooks, pdf_file, metadata)
+        
+        for book in textbooks.values():
+            book["chapters"].sort(key=lambda x: x["order"])
+        return textbooks
+    
+    def _process_files_parallel(self, pdf_files: List[Path], workers: int, batch_size: int) -> List[Tuple[Path, Dict]]:
+        """Build the vector stores of the given PDFs, returning the ones processed successfully"""
+        (self.resources_dir / "vector_stores").mkdir(exist_ok=True)
+        
+        start_time = time.perf_counter()
+        total_chunks = 0
+        processed = []
+        pdf_files = iter(pdf_files)
+        pending_batches = threading.BoundedSemaphore(2 * workers)
+        
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_parse_worker,
+            initargs=(str(self.resources_dir), self.index_layout, self.chunker.kind)
+        ) as parse_pool, ThreadPoolExecutor(max_workers=workers) as embed_pool:
+            parsing = deque()
+            embedding = deque()  # (pdf_file, metadata, splits, batch futures)
+            
+            def submit_parse():
+                pdf_file = next(pdf_files, None)
+                if pdf_file is not None:
+                    parsing.append((pdf_file, parse_pool.submit(_parse_pdf, str(pdf_file), self._known_pdf_hash(str(pdf_file)))))
+            
+            def submit_embedding(texts: List[str]) -> Future:
+                pending_batches.acquire()
+                future = embed_pool.submit(self.embeddings.embed_documents, texts)
+                future.add_done_callback(lambda _: pending_batches.release())
+                return future
+            
+            def write_finished(wait_all: bool = False):
+                nonlocal total_chunks
+                while embedding and (wait_all or len(embedding) > workers
+                                     or all(f.done() for f in embedding[0][3])):
+                    pdf_file, metadata, splits, futures = embedding.popleft()
+                    try:
+                        vectors = [vector for future in futures for vector in future.result()]
+                        self._write_vector_store(splits, vectors, metadata)
+                    except Exception as e:
+                        print(f"Error processing {pdf_file}: {str(e)}")
+                        continue
+                    total_chunks += len(splits)
+                    processed.append((pdf_file, metadata))
+                    print(f"Successfully processed: {pdf_file} ({len(splits)} chunks)")
+            
+            for _ in range(workers):
+                submit_parse()
+            
+            while parsing:
+                pdf_file, parse_future = parsing.popleft()
+                submit_parse()
+                try:
+                    metadata, splits = parse_future.result()
+                except Exception as e:
+                    print(f"Error processing {pdf_file}: {str(e)}")
+                    continue
+                
+                texts = [split.page_content for split in splits]
+                futures = [
+                    submit_embedding(texts[start:start + batch_size])
+                    for start in range(0, len(texts), batch_size)
+                ]
+                embedding.append((pdf_file, metadata, splits, futures))
+                write_finished()
+            
+            write_finished(wait_all=True)
+        
+        elapsed = time.perf_counter() - start_time
+        rate = total_chunks / elapsed if elapsed > 0 else 0.0
+        print(f"Embedded {total_chunks} chunks in {elapsed:.1f}s ({rate:.1f} chunks/sec)")
+        return processed
+    
+    def _index_settings(self) -> Dict:
+        """Settings that, when changed, invalidate a PDF's vector store"""
+        return {
+            **self.chunker.settings(),
+            "embedding_model": self.embeddings.model_name,
+            "index_layout": self.index_layout
+        }
+    
+    def _load_manifest(self) -> Dict:
+        """Load the manifest of indexed PDFs, keyed by path relative to the resources directory"""
+        manifest_file = self.resources_dir / "vector_stores" / MANIFEST_FILE
+        if not manifest_file.exists():
+            return {}
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _is_indexed(self, entry: Optional[Dict], pdf_file: Path, stat: os.stat_result) -> bool:
+        """Check whether a manifest entry still describes the PDF and its vector store"""
+        if not entry:
+            return False
+        settings = self._index_settings()
+        # Entries written before the chunker was configurable were chunked by characters
+        recorded = {**entry, "chunker": entry.get("chunker", "characters")}
+        if {key: recorded.get(key) for key in settings} != settings:
+            return False
+        if self.index_layout == "per_pdf" and not (self.resources_dir / "vector_stores" / entry["hash"]).exists():
+            return False
+        if entry["size"] != stat.st_size:
+            return False
+        if entry["mtime"] != stat.st_mtime:
+            # Touched but possibly unchanged, so compare contents
+            if self._get_pdf_hash(str(pdf_file)) != entry["hash"]:
+                return False
+            entry["mtime"] = stat.st_mtime
+        return True
+    
+    def process_directory_incremental(self, pdf_dir: str, workers: int = 1, batch_size: int = 32):
+        """Process only the PDFs that changed since the last run
+        
+        A manifest under vector_stores records the hash, mtime, size and index
+        settings of every indexed PDF. Unchanged PDFs keep their store and
+        metadata, changed or new ones are rebuilt, and stores no longer
+        referenced by any PDF are removed. A PDF that fails to rebuild keeps
+        its previous store and manifest entry.
+        """
+        pdf_dir = Path(pdf_dir)
+        if not pdf_dir.exists():
+            print(f"Directory not found: {pdf_dir}")
+            return
+        (self.resources_dir / "vector_stores").mkdir(exist_ok=True)
+        
+        old_manifest = self._load_manifest()
+        manifest = {}
+        changed = []
+        for pdf_file in sorted(pdf_dir.glob("**/*.pdf")):
+            key = pdf_file.relative_to(self.resources_dir).as_posix()
+            entry = old_manifest.get(key)
+            if self._is_indexed(entry, pdf_file, pdf_file.stat()):
+                manifest[key] = entry
+            else:
+                changed.append(pdf_file)
+        print(f"{len(manifest)} PDFs unchanged, {len(changed)} to index")
+        
+        if workers > 1 and changed:
+            processed = self._process_files_parallel(changed, workers, batch_size)
+        else:
+            processed = [(pdf_file, self.process_pdf(str(pdf_file))) for pdf_file in changed]
+        for pdf_file, metadata in processed:
+            if not metadata:
+                continue
+            stat = pdf_file.stat()
+            manifest[pdf_file.relative_to(self.resources_dir).as_posix()] = {
+                "hash": metadata["hash"],
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                **self._index_settings(),
+                "metadata": metadata
+            }
+        for pdf_file in changed:
+            key = pdf_file.relative_to(self.resources_dir).as_posix()
+            if key not in manifest and key in old_manifest:
+                # Keep serving the previous store; the PDF is retried on the next run
+                print(f"Keeping the previous vector store of {pdf_file} after it failed to process")
+                manifest[key] = old_manifest[key]
+        
+        self._remove_orphaned_stores({entry["hash"] for entry in manifest.values()})
+        _write_json_atomic(self.resources_dir / "vector_stores" / MANIFEST_FILE, manifest)
+        
+        textbooks = {}
+        for key, entry in manifest.items():
+            self._add_to_textbooks(textbooks, self.resources_dir / key, entry["metadata"])
+        for book in textbooks.values():
+            book["chapters"].sort(key=lambda x: x["order"])
+        # Chapters indexed before lexical indexes or quantized copies existed get them from their stored chunks
+        self.build_lexical_indexes(textbooks, only_missing=True)
+        if self.index_layout == "per_pdf" and self.store_format in QUANTIZED_FORMATS:
+            self.quantize_stores(textbooks, only_missing=True)
+        return textbooks
+    
+    def _remove_orphaned_stores(self, referenced_hashes: Set[str]):
+        """Delete vector stores of PDFs that are no longer indexed"""
+        stores_dir = self.resources_dir / "vector_stores"
+        for store_dir in stores_dir.iterdir():
+            if store_dir.is_dir() and PDF_HASH_PATTERN.fullmatch(store_dir.name) \
+                    and store_dir.name not in referenced_hashes:
+                print(f"Removing orphaned vector store: {store_dir.name}")
+                shutil.rmtree(store_dir)
+        
+        lexical_dir = stores_dir / LEXICAL_DIR
+        if lexical_dir.exists():
+            for index_file in lexical_dir.glob("*.npz"):
+                if index_file.stem not in referenced_hashes:
+                    print(f"Removing orphaned lexical index: {index_file.stem}")
+                    index_file.unlink()
+        
+        consolidated_dir = stores_dir / CONSOLIDATED_DIR
+        if consolidated_dir.exists() and referenced_hashes:
+            client = chromadb.PersistentClient(path=str(consolidated_dir))
+            for collection in client.list_collections():
+                collection.delete(where={"pdf_hash": {"$nin": sorted(referenced_hashes)}})
+    
     def generate_index(self, textbooks: Dict):
         """Generate an index of all processed PDFs"""
-        # Save index
+        # Save index atomically so the backend never reads a partial file
         index_file = self.resources_dir / "pdf_index.json"
-        with open(index_file, 'w', encoding='utf-8') as f:
-            json.dump(textbooks, f, indent=2, ensure_ascii=False)
+        _write_json_atomic(index_file, textbooks)
+
+def _write_json_atomic(path: Path, data):
+    """Write JSON to a temporary file and move it into place"""
+    tmp_file = path.with_name(path.name + ".tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, path)
+
+# Preprocessor owned by each parse worker process
+_worker_preprocessor = None
+
+def _init_parse_worker(resources_dir: str, index_layout: str, chunker: str):
+    global _worker_preprocessor
+    _worker_preprocessor = PDFPreprocessor(resources_dir, index_layout=index_layout, chunker=chunker)
+
+def _parse_pdf(pdf_path: str, pdf_hash: Optional[str] = None):
+    """Extract metadata and chunks for a PDF in a parse worker"""
+    with open(pdf_path, 'rb') as pdf_file:
+        pdf_hash = pdf_hash or _worker_preprocessor._get_pdf_hash(pdf_path, pdf_file)
+        reader = PdfReader(pdf_file)
+        metadata = _worker_preprocessor._extract_metadata(pdf_path, reader, pdf_hash)
+        return metadata, _worker_preprocessor._load_splits(pdf_path, metadata, reader)
 
 def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Process PDFs and generate metadata/vector stores')
     parser.add_argument('--update-only', action='store_true', help='Update metadata without rebuilding vector stores')
+    parser.add_argument('--index-layout', choices=['per_pdf', 'per_book', 'global'], default=config.VECTOR_INDEX_LAYOUT,
+                        help='Write one store per PDF, or consolidated collections per book or for the whole library')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only rebuild vector stores of new or changed PDFs and remove orphaned stores')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Parse PDFs in this many processes and embed this many batches concurrently')
+    parser.add_argument('--batch-size', type=int, default=32, help='Chunks per embedding request batch')
+    parser.add_argument('--migrate-consolidated', action='store_true',
+                        help='Import the existing per-PDF stores into consolidated collections without re-embedding')
+    parser.add_argument('--build-lexical', action='store_true',
+                        help='Build the lexical search indexes from the existing vector stores without re-embedding')
+    parser.add_argument('--quantize', choices=['chroma', 'float16', 'int8'], default=config.VECTOR_STORE_FORMAT,
+                        help='Also write a quantized copy of each per-PDF store in this format')
+    parser.add_argument('--keep-float32', action='store_true',
+                        help='Keep float32 vectors next to the quantized copy for exact re-ranking')
+    parser.add_argument('--quantize-existing', action='store_true',
+                        help='Write quantized copies of the existing per-PDF stores without re-embedding')
+    parser.add_argument('--embedding-model', default=config.EMBEDDING_MODEL,
+                        help='Embedding model the vector stores are built with')
+    parser.add_argument('--chunker', choices=sorted(CHUNKER_DEFAULTS), default=config.CHUNKER,
+                        help='Pack sentences into token-sized chunks, or split each page into character-sized ones')
+    parser.add_argument('--reembed', action='store_true',
+                        help='Re-embed the chunks of the existing vector stores with the embedding model without re-parsing PDFs')
     args = parser.parse_args()
     
     # Get the absolute path to the resources directory
     current_dir = Path(__file__).parent
     resources_dir = current_dir.parent / "resources"
     
-    preprocessor = PDFPreprocessor(str(resources_dir))
+    preprocessor = PDFPreprocessor(
+        str(resources_dir),
+        index_layout=args.index_layout,
+        store_format=args.quantize,
+        keep_float32=args.keep_float32,
+        embedding_model=args.embedding_model,
+        chunker=args.chunker
+    )
+    
+    if args.migrate_consolidated or args.build_lexical or args.quantize_existing or args.reembed:
+        index_file = resources_dir / "pdf_index.json"
+        with open(index_file, 'r', encoding='utf-8') as f:
+            textbooks = json.load(f)
+        if args.migrate_consolidated:
+            print(f"Migrating vector stores into the {args.index_layout} layout...")
+            preprocessor.migrate_to_consolidated(textbooks)
+        elif args.build_lexical:
+            print("Building lexical indexes...")
+            preprocessor.build_lexical_indexes(textbooks)
+        elif args.reembed:
+            print(f"Re-embedding vector stores with {args.embedding_model}...")
+            preprocessor.reembed_stores(textbooks)
+        else:
+            print(f"Quantizing vector stores to {args.quantize}...")
+            preprocessor.quantize_stores(textbooks)
+        return
     
     # Process PDFs in the textbook directory
     textbooks_dir = resources_dir / "textbook"
     if textbooks_dir.exists():
         print("Processing PDFs in textbook directory...")
-        textbooks = preprocessor.process_directory(str(textbooks_dir), args.update_only)
+        if args.incremental:
+            textbooks = preprocessor.process_directory_incremental(
+                str(textbooks_dir), workers=args.workers, batch_size=args.batch_size
+            )
+        elif args.workers > 1 and not args.update_only:
+            textbooks = preprocessor.process_directory_parallel(
+                str(textbooks_dir), workers=args.workers, batch_size=args.batch_size
+            )
+        else:
+            textbooks = preprocessor.process_directory(str(textbooks_dir), args.update_only)
         
         # Generate index
         print("Generating PDF index...")
@@ -0,0 +1,225 @@
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from langchain_core.documents import Document
+
+# Directory inside a per-PDF vector store holding its quantized copy
+QUANTIZED_DIR = "quantized"
+QUANTIZED_FORMATS = ("float16", "int8")
+# Stores with at least this many vectors are split into IVF lists
+IVF_MIN_VECTORS = 4096
+# Rows scored per block, bounding the float32 copy made for the dot products
+SEARCH_BLOCK_ROWS = 4096
+
+def _kmeans(vectors: np.ndarray, num_lists: int, iterations: int = 10, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Cluster vectors into num_lists lists, returning the centroids and each vector's list"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), num_lists, replace=False)].copy()
+    for _ in range(iterations):
+        distances = (centroids ** 2).sum(axis=1) - 2 * vectors @ centroids.T
+        assignments = distances.argmin(axis=1)
+        for list_no in range(num_lists):
+            members = vectors[assignments == list_no]
+            if len(members):
+                centroids[list_no] = members.mean(axis=0)
+    distances = (centroids ** 2).sum(axis=1) - 2 * vectors @ centroids.T
+    return centroids, distances.argmin(axis=1)
+
+def write_quantized_store(path: Path, ids: Sequence[str], vectors: Sequence[Sequence[float]], documents: Sequence[str],
+                          metadatas: Sequence[Optional[Dict]], fmt: str = "int8", keep_float32: bool = False,
+                          num_lists: Optional[int] = None, embedding: Optional[Dict] = None):
+    """Write a quantized copy of a store's chunks and embeddings
+    
+    int8 codes keep one float32 scale per vector (its largest absolute
+    component over 127). Exact squared norms are kept so distances match
+    Chroma's squared L2 distances. With `keep_float32` the original vectors
+    are written too, for re-ranking the best candidates exactly. Stores of
+    IVF_MIN_VECTORS or more are clustered into about sqrt(n) lists unless
+    `num_lists` says otherwise (0 for brute force). `embedding` records the
+    model and dimension the vectors were produced with.
+    """
+    if fmt not in QUANTIZED_FORMATS:
+        raise ValueError(f"Unknown quantized format: {fmt}")
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+    order = np.arange(len(ids))
+    centroids = offsets = None
+    if num_lists is None:
+        num_lists = int(np.sqrt(len(ids))) if len(ids) >= IVF_MIN_VECTORS else 0
+    if num_lists:
+        # Store the vectors of each list contiguously
+        centroids, assignments = _kmeans(vectors, min(num_lists, len(ids)))
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignments, minlength=len(centroids)))
+        vectors = vectors[order]
+    
+    tmp_dir = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    if fmt == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        np.save(tmp_dir / "codes.npy", np.round(vectors / scales[:, None]).astype(np.int8))
+        np.save(tmp_dir / "scales.npy", scales.astype(np.float32))
+    else:
+        np.save(tmp_dir / "codes.npy", vectors.astype(np.float16))
+    np.save(tmp_dir / "sq_norms.npy", (vectors ** 2).sum(axis=1).astype(np.float32))
+    if keep_float32:
+        np.save(tmp_dir / "vectors.npy", vectors)
+    if centroids is not None:
+        np.save(tmp_dir / "centroids.npy", centroids)
+        np.save(tmp_dir / "list_offsets.npy", offsets)
+    with open(tmp_dir / "chunks.json", 'w', encoding='utf-8') as f:
+        json.dump({
+            "format": fmt,
+            "embedding": embedding or {},
+            "ids": [ids[i] for i in order],
+            "documents": [documents[i] for i in order],
+            "metadatas": [metadatas[i] or {} for i in order]
+        }, f, ensure_ascii=False)
+    
+    # Swap the new copy in whole
+    old_dir = path.with_name(path.name + ".old")
+    if path.exists():
+        os.replace(path, old_dir)
+    os.replace(tmp_dir, path)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def read_store_format(path: Path) -> Optional[str]:
+    """Get the format of a quantized store, or None when there is none"""
+    try:
+        with open(path / "chunks.json", 'r', encoding='utf-8') as f:
+            return json.load(f)["format"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+class QuantizedStore:
+    """Vector store over quantized embeddings, memory-mapped from disk
+    
+    Answers the calls the backend makes on a Chroma store: the similarity
+    search of MultiStoreRetriever, and the count/get/query subset of the
+    collection API through `_collection`. Distances are squared L2 like
+    Chroma's. Small stores are searched exhaustively; IVF stores score the
+    `nprobe` lists closest to the query. With a float32 copy on disk, the
+    best `rerank` * k candidates are re-scored exactly.
+    """
+    
+    def __init__(self, path: Path, embeddings: Any = None, rerank: int = 4, nprobe: int = 8):
+        self.path = Path(path)
+        self.embeddings = embeddings
+        self.rerank = rerank
+        self.nprobe = nprobe
+        with open(self.path / "chunks.json", 'r', encoding='utf-8') as f:
+            chunks = json.load(f)
+        self.format = chunks["format"]
+        self.ids: List[str] = chunks["ids"]
+        self.documents: List[str] = chunks["documents"]
+        self.metadatas: List[Dict] = chunks["metadatas"]
+        # Embedding record, read like the metadata of a Chroma collection
+        self.metadata: Dict = chunks.get("embedding") or {}
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        
+        self.codes = np.load(self.path / "codes.npy", mmap_mode="r")
+        self.sq_norms = np.load(self.path / "sq_norms.npy")
+        self.scales = np.load(self.path / "scales.npy") if self.format == "int8" else None
+        self.vectors = self._load_optional("vectors.npy", mmap_mode="r")
+        self.centroids = self._load_optional("centroids.npy")
+        self.list_offsets = self._load_optional("list_offsets.npy")
+        # Chroma stores are closed through their client; there is nothing to close here
+        self._client = None
+        self._collection = self
+    
+    def _load_optional(self, name: str, mmap_mode: Optional[str] = None) -> Optional[np.ndarray]:
+        file = self.path / name
+        return np.load(file, mmap_mode=mmap_mode) if file.exists() else None
+    
+    def memory_bytes(self) -> int:
+        """Bytes of the quantized vectors, which stay in the page cache while the store is used"""
+        total = self.codes.nbytes + self.sq_norms.nbytes
+        if self.scales is not None:
+            total += self.scales.nbytes
+        return total
+    
+    def _candidate_ranges(self, query: np.ndarray) -> List[Tuple[int, int]]:
+        """Row ranges to score: the whole store, or the IVF lists closest to the query"""
+        if self.centroids is None:
+            return [(0, len(self.ids))]
+        distances = (self.centroids ** 2).sum(axis=1) - 2 * self.centroids @ query
+        probed = np.sort(np.argsort(distances)[:self.nprobe])
+        return [(int(self.list_offsets[i]), int(self.list_offsets[i + 1])) for i in probed]
+    
+    def _dot(self, start: int, end: int, query: np.ndarray) -> np.ndarray:
+        """Approximate dot products of the query with a range of rows, a block at a time"""
+        products = np.empty(end - start, dtype=np.float32)
+        for block_start in range(start, end, SEARCH_BLOCK_ROWS):
+            block_end = min(block_start + SEARCH_BLOCK_ROWS, end)
+            products[block_start - start:block_end - start] = self.codes[block_start:block_end].astype(np.float32) @ query
+        if self.scales is not None:
+            products *= self.scales[start:end]
+        return products
+    
+    def search(self, embedding: Sequence[float], k: int) -> List[Tuple[int, float]]:
+        """Find the k closest rows, returning (row, squared L2 distance) pairs, closest first"""
+        query = np.asarray(embedding, dtype=np.float32)
+        ranges = [(start, end) for start, end in self._candidate_ranges(query) if end > start]
+        if not ranges or k <= 0:
+            return []
+        rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+        products = np.concatenate([self._dot(start, end, query) for start, end in ranges])
+        distances = self.sq_norms[rows] + float(query @ query) - 2 * products
+        
+        rerank = self.rerank and self.vectors is not None
+        candidates = min(len(rows), k * self.rerank if rerank else k)
+        best = np.sort(np.argpartition(distances, candidates - 1)[:candidates])
+        rows, distances = rows[best], distances[best]
+        if rerank:
+            distances = ((np.asarray(self.vectors[rows], dtype=np.float32) - query) ** 2).sum(axis=1)
+        order = np.argsort(distances)[:k]
+        return [(int(rows[i]), float(distances[i])) for i in order]
+    
+    def similarity_search_by_vector_with_relevance_scores(self, embedding: List[float], k: int = 4,
+                                                          filter: Optional[Dict] = None) -> List[Tuple[Document, float]]:
+        if filter:
+            raise ValueError("Quantized stores hold a single chapter and take no filter")
+        return [
+            (Document(page_content=self.documents[row], metadata=self.metadatas[row]), distance)
+            for row, distance in self.search(embedding, k)
+        ]
+    
+    def _vector(self, row: int) -> List[float]:
+        if self.vectors is not None:
+            return self.vectors[row].tolist()
+        vector = self.codes[row].astype(np.float32)
+        if self.scales is not None:
+            vector *= self.scales[row]
+        return vector.tolist()
+    
+    def count(self) -> int:
+        return len(self.ids)
+    
+    def get(self, ids: Optional[List[str]] = None, limit: Optional[int] = None,
+            include: Sequence[str] = ("documents", "metadatas"), **kwargs) -> Dict:
+        """Get chunks by id, or the first `limit` chunks, like Collection.get"""
+        if ids is not None:
+            rows = [self._rows[chunk_id] for chunk_id in ids if chunk_id in self._rows]
+        else:
+            rows = list(range(len(self.ids)))[:limit]
+        result = {"ids": [self.ids[row] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [self.documents[row] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self.metadatas[row] for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = [self._vector(row) for row in rows]
+        return result
+    
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10, **kwargs) -> Dict:
+        """Nearest chunks of each query embedding, like Collection.query"""
+        results = [self.search(embedding, n_results) for embedding in query_embeddings]
+        return {
+            "ids": [[self.ids[row] for row, _ in hits] for hits in results],
+            "distances": [[distance for _, distance in hits] for hits in results]
+        }
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from text_utils import normalize_text
+
+class ResponseCache:
+    """Cache of generated answers for repeated questions
+    
+    Entries are scoped by model, active PDF set and a digest of the recent
+    conversation, so an answer is only reused in the same context. Within a
+    scope, the exact tier matches the normalized question, and the semantic
+    tier matches the closest earlier question whose embedding has at least
+    `similarity_threshold` cosine similarity (0 turns the tier off). Entries
+    expire after `ttl` seconds, the least recently used entry is dropped
+    beyond `max_entries`, and a SQLite file at `cache_path` keeps entries
+    across restarts.
+    """
+    
+    def __init__(self, embeddings: Optional[Embeddings] = None, max_entries: int = 1000, ttl: float = 86400.0,
+                 similarity_threshold: float = 0.95, cache_path: Optional[str] = None):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        # key -> (scope, response, sources, created, unit-length question embedding)
+        self._entries: "OrderedDict[str, Tuple[str, str, List[Dict], float, Optional[np.ndarray]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        
+        self._db = None
+        if cache_path:
+            Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(cache_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, scope TEXT NOT NULL, "
+                "response TEXT NOT NULL, sources TEXT NOT NULL, created REAL NOT NULL, vector BLOB)"
+            )
+            self._db.commit()
+            self._load()
+    
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        return normalize_text(question).casefold()
+    
+    @staticmethod
+    def scope(model: str, pdf_hashes: List[str], history: List[str]) -> str:
+        """Digest of everything besides the question that shapes an answer"""
+        parts = [model, ",".join(sorted(pdf_hashes))] + [normalize_text(text) for text in history]
+        return hashlib.sha1("\0".join(parts).encode("utf-8", "surrogatepass")).hexdigest()
+    
+    @staticmethod
+    def _key(scope: str, question: str) -> str:
+        return hashlib.sha1(f"{scope}\0{question}".encode("utf-8", "surrogatepass")).hexdigest()
+    
+    @staticmethod
+    def _unit(vector: List[float]) -> Optional[np.ndarray]:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else None
+    
+    def get(self, scope: str, question: str) -> Optional[Tuple[str, List[Dict], str]]:
+        """Get a cached answer as (response, sources, tier), tier being "exact" or "semantic" """
+        key = self._key(scope, self.normalize_question(question))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry):
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry[1], entry[2], "exact"
+        
+        if self.embeddings is not None and self.similarity_threshold:
+            # The retriever embeds the same question, so this is usually an embedding cache hit
+            query = self._unit(self.embeddings.embed_query(question))
+            with self._lock:
+                best_key, best_similarity = None, self.similarity_threshold
+                for key, entry in self._entries.items():
+                    if query is None or entry[0] != scope or entry[4] is None or self._expired(entry):
+                        continue
+                    similarity = float(np.dot(query, entry[4]))
+                    if similarity >= best_similarity:
+                        best_key, best_similarity = key, similarity
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    entry = self._entries[best_key]
+                    return entry[1], entry[2], "semantic"
+        
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def put(self, scope: str, question: str, response: str, sources: List[Dict]):
+        """Cache the answer to a question"""
+        key = self._key(scope, self.normalize_question(question))
+        created = time.time()
+        vector = None
+        if self.embeddings is not None and self.similarity_threshold:
+            vector = self._unit(self.embeddings.embed_query(question))
+        with self._lock:
+            self._entries[key] = (scope, response, sources, created, vector)
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, scope, response, sources, created, vector) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, scope, response, json.dumps(sources), created,
+                     None if vector is None else vector.tobytes())
+                )
+                self._db.executemany("DELETE FROM responses WHERE key = ?", [(k,) for k in evicted])
+                self._db.commit()
+    
+    def _expired(self, entry) -> bool:
+        return time.time() - entry[3] > self.ttl
+    
+    def _load(self):
+        """Load unexpired entries from disk, oldest first"""
+        cutoff = time.time() - self.ttl
+        self._db.execute("DELETE FROM responses WHERE created < ?", (cutoff,))
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT key, scope, response, sources, created, vector FROM responses ORDER BY created DESC LIMIT ?",
+            (self.max_entries,)
+        ).fetchall()
+        for key, scope, response, sources, created, vector in reversed(rows):
+            array = None if vector is None else np.frombuffer(vector, dtype=np.float32)
+            self._entries[key] = (scope, response, json.loads(sources), created, array)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.exact_hits + self.semantic_hits) / lookups, 3) if lookups else 0.0
+            }
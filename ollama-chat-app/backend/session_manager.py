@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from chat_manager import ChatManager
+from pdf_manager import PDFManager
+from response_cache import ResponseCache
+
+class SessionManager:
+    """Bounded table of per-session ChatManagers
+    
+    Each session gets its own memory, active PDFs and model choice, while the
+    PDFManager (embeddings and opened vector stores) and the response cache
+    are shared by all of them.
+    Sessions idle for longer than idle_timeout seconds are dropped, and the
+    least recently used session is dropped once max_sessions is reached.
+    """
+    
+    def __init__(self, pdf_manager: PDFManager, max_sessions: int = 200, idle_timeout: float = 3600.0,
+                 response_cache: Optional[ResponseCache] = None):
+        self.pdf_manager = pdf_manager
+        self.response_cache = response_cache
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions: "OrderedDict[str, Tuple[ChatManager, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+    
+    def get(self, session_id: str) -> ChatManager:
+        """Get the ChatManager of a session, creating it on first use"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                chat_manager = ChatManager(pdf_manager=self.pdf_manager, response_cache=self.response_cache)
+            else:
+                chat_manager = entry[0]
+            self._sessions[session_id] = (chat_manager, now)
+            self._sessions.move_to_end(session_id)
+            
+            while len(self._sessions) > self.max_sessions:
+                evicted_id, (evicted, _) = self._sessions.popitem(last=False)
+                evicted.close()
+                self.evictions += 1
+                print(f"Evicted least recently used session: {evicted_id}")
+            return chat_manager
+    
+    def _evict_idle(self, now: float):
+        """Drop sessions that have been idle for too long, oldest first"""
+        while self._sessions:
+            session_id, (_, last_used) = next(iter(self._sessions.items()))
+            if now - last_used <= self.idle_timeout:
+                break
+            evicted, _ = self._sessions.popitem(last=False)[1]
+            evicted.close()
+            self.evictions += 1
+            print(f"Evicted idle session: {session_id}")
+    
+    def stats(self) -> Dict:
+        """Get session table counters"""
+        with self._lock:
+            return {
+                "active": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "idle_timeout": self.idle_timeout,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,150 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from langchain_community.vectorstores import Chroma
+
+# Rough per-vector cost of the HNSW graph links and id mappings besides the floats
+VECTOR_OVERHEAD_BYTES = 256
+
+def estimate_store_bytes(store: Chroma) -> int:
+    """Estimate the memory a store's vector index takes once it is loaded"""
+    if hasattr(store, "memory_bytes"):
+        return store.memory_bytes()
+    try:
+        count = store._collection.count()
+        if not count:
+            return 0
+        sample = store._collection.get(limit=1, include=["embeddings"])
+        dimension = len(sample["embeddings"][0]) if len(sample["embeddings"]) else 0
+    except Exception as e:
+        print(f"Error estimating store size: {e}")
+        return 0
+    return count * (dimension * 4 + VECTOR_OVERHEAD_BYTES)
+
+def close_store(store: Chroma):
+    """Release a store's Chroma client, which stops it once no other store shares it"""
+    close = getattr(store._client, "close", None)
+    if close is None:
+        # Chroma versions before client.close() release the system when collected
+        return
+    try:
+        close()
+    except Exception as e:
+        print(f"Error closing vector store: {e}")
+
+class StoreCache:
+    """Bounded cache of opened Chroma stores
+    
+    Stores are kept in least recently used order and closed once more than
+    `max_stores` are open or their estimated size exceeds `max_bytes` (0
+    disables either limit). Pinned stores, such as the ones selected in a
+    live conversation, are never evicted, so the limits can be exceeded
+    while many conversations are active.
+    """
+    
+    def __init__(self, max_stores: int = 64, max_bytes: int = 0, on_evict: Optional[Callable[[str], None]] = None):
+        self.max_stores = max_stores
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        # key -> (store, estimated bytes)
+        self._stores: "OrderedDict[str, Tuple[Chroma, int]]" = OrderedDict()
+        self._pins: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self.opens = 0
+        self.hits = 0
+        self.evictions = 0
+    
+    def get(self, key: str, opener: Callable[[], Optional[Chroma]]) -> Optional[Chroma]:
+        """Get an open store, opening it with `opener` on a miss"""
+        with self._lock:
+            entry = self._stores.get(key)
+            if entry is not None:
+                self._stores.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            
+            store = opener()
+            if store is None:
+                return None
+            self.opens += 1
+            self._stores[key] = (store, estimate_store_bytes(store) if self.max_bytes else 0)
+            self._evict(keep=key)
+            return store
+    
+    def touch(self, keys: Iterable[str]):
+        """Mark stores used through references held outside the cache as recently used"""
+        with self._lock:
+            for key in keys:
+                if key in self._stores:
+                    self._stores.move_to_end(key)
+                    self.hits += 1
+    
+    def pin(self, keys: Iterable[str]):
+        """Keep stores open until they are unpinned as often as they were pinned"""
+        with self._lock:
+            for key in keys:
+                self._pins[key] = self._pins.get(key, 0) + 1
+    
+    def unpin(self, keys: Iterable[str]):
+        with self._lock:
+            for key in keys:
+                count = self._pins.get(key, 0) - 1
+                if count > 0:
+                    self._pins[key] = count
+                else:
+                    self._pins.pop(key, None)
+            self._evict()
+    
+    def _over_limit(self) -> bool:
+        if self.max_stores and len(self._stores) > self.max_stores:
+            return True
+        return bool(self.max_bytes) and self._total_bytes() > self.max_bytes
+    
+    def _total_bytes(self) -> int:
+        return sum(size for _, size in self._stores.values())
+    
+    def _evict(self, keep: Optional[str] = None):
+        """Close least recently used unpinned stores until the cache is within its limits"""
+        for key in list(self._stores):
+            if not self._over_limit():
+                break
+            if key in self._pins or key == keep:
+                continue
+            store, _ = self._stores.pop(key)
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(key)
+            close_store(store)
+    
+    def discard(self, keys: Iterable[str]):
+        """Close stores even when pinned, such as stores rebuilt on disk; their pins carry over to the reopened stores"""
+        with self._lock:
+            for key in keys:
+                entry = self._stores.pop(key, None)
+                if entry is None:
+                    continue
+                self.evictions += 1
+                if self.on_evict is not None:
+                    self.on_evict(key)
+                close_store(entry[0])
+    
+    def clear(self):
+        with self._lock:
+            for key, (store, _) in list(self._stores.items()):
+                if self.on_evict is not None:
+                    self.on_evict(key)
+                close_store(store)
+            self._stores.clear()
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "open_stores": len(self._stores),
+                "max_stores": self.max_stores,
+                "estimated_bytes": self._total_bytes(),
+                "max_bytes": self.max_bytes,
+                "pinned": sum(1 for key in self._pins if key in self._stores),
+                "opens": self.opens,
+                "hits": self.hits,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,49 @@
+import re
+import unicodedata
+from typing import List
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_text(text: str) -> str:
+    """Normalize text for cache keys: NFKC width folding and collapsed whitespace"""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+# CJK ideographs, kana and hangul, which tokenizers split roughly per character
+_CJK_RANGES = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_CJK_CHAR = re.compile(f"[{_CJK_RANGES}]")
+
+def estimate_tokens(text: str) -> int:
+    """Cheaply estimate the model token count of a text
+    
+    CJK characters count as one token each, other text as one token per
+    four characters, which is close enough for budgeting prompts.
+    """
+    cjk_chars = len(_CJK_CHAR.findall(text))
+    other_chars = len(text) - cjk_chars
+    return cjk_chars + (other_chars + 3) // 4
+
+# A line wrap inside CJK text, where no space separates the characters
+_CJK_LINE_WRAP = re.compile(rf"(?<=[{_CJK_RANGES}])\n(?=[{_CJK_RANGES}])")
+
+def join_wrapped_lines(text: str) -> str:
+    """Undo the line wraps PDF text extraction leaves inside Chinese sentences"""
+    return _CJK_LINE_WRAP.sub("", text)
+
+# Runs of CJK characters, or of other letters and digits
+_TERM_RUN = re.compile(rf"([{_CJK_RANGES}]+)|(?:(?![{_CJK_RANGES}])[^\W_])+")
+
+def lexical_terms(text: str) -> List[str]:
+    """Split text into terms for lexical search
+    
+    CJK runs, which have no spaces between words, become overlapping
+    character bigrams (a lone character stays a unigram); other text is
+    split into case-folded words.
+    """
+    terms = []
+    for match in _TERM_RUN.finditer(unicodedata.normalize("NFKC", text).casefold()):
+        run = match.group(0)
+        if match.group(1) and len(run) > 1:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run)
+    return terms
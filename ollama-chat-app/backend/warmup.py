@@ -0,0 +1,106 @@
+import threading
+import time
+from typing import Dict, List, Optional
+from pdf_manager import PDFManager
+from model_catalog import ModelCatalog
+from ollama_client import OllamaClient
+
+class Warmup:
+    """Startup stage that makes the first requests fast
+    
+    Refreshes the model catalog, opens the vector stores of the configured
+    chapters and runs one query against each so Chroma loads its index, and
+    preloads the chat and embedding models into Ollama. The instance reports
+    ready once this has finished, whether or not every step succeeded.
+    """
+    
+    def __init__(self, pdf_manager: PDFManager, model_catalog: ModelCatalog, client: OllamaClient,
+                 stores: str = "all", chat_model: Optional[str] = None, embedding_model: Optional[str] = None,
+                 keep_alive: str = "30m"):
+        self.pdf_manager = pdf_manager
+        self.model_catalog = model_catalog
+        self.client = client
+        self.stores = stores
+        self.chat_model = chat_model
+        self.embedding_model = embedding_model
+        self.keep_alive = keep_alive
+        self.state = "pending"
+        self.stores_warmed = 0
+        self.models_loaded: Dict[str, List[str]] = {}
+        self.errors: List[str] = []
+        self.duration: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+    
+    def start(self):
+        """Warm up in the background"""
+        self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        self._thread.start()
+    
+    def run(self):
+        start = time.perf_counter()
+        self.state = "warming"
+        print("Warming up...")
+        for step in (self.model_catalog.refresh, self._warm_stores, self._load_models):
+            try:
+                step()
+            except Exception as e:
+                self.errors.append(f"{step.__name__}: {e}")
+        self.duration = round(time.perf_counter() - start, 3)
+        self.state = "ready"
+        print(f"Warm-up finished in {self.duration}s: {self.stores_warmed} stores, models {self.models_loaded}")
+    
+    def _selected_pdfs(self) -> List[str]:
+        if self.stores == "none":
+            return []
+        if self.stores == "all":
+            return list(self.pdf_manager.available_pdfs)
+        try:
+            return self.pdf_manager.most_used_pdfs(int(self.stores))
+        except ValueError:
+            self.errors.append(f"invalid store selection: {self.stores}")
+            return []
+    
+    def _warm_stores(self):
+        """Open the stores and run one query each so their indexes are loaded"""
+        pdf_hashes = self._selected_pdfs()
+        if not pdf_hashes:
+            return
+        max_stores = self.pdf_manager.store_cache.max_stores
+        if self.pdf_manager.index_layout == "per_pdf" and max_stores:
+            # Opening more stores than the cache keeps would only close the first ones again
+            pdf_hashes = pdf_hashes[:max_stores]
+        for store, _ in self.pdf_manager.get_search_targets(pdf_hashes):
+            try:
+                sample = store._collection.get(limit=1, include=["embeddings"])
+                if len(sample["embeddings"]):
+                    store._collection.query(query_embeddings=[sample["embeddings"][0]], n_results=1)
+                self.stores_warmed += 1
+            except Exception as e:
+                self.errors.append(f"store {store._collection.name}: {e}")
+    
+    def _load_models(self):
+        """Load the chat and embedding models into Ollama and keep them loaded"""
+        models = {self.chat_model: False, self.embedding_model: True}
+        if self.chat_model == self.embedding_model:
+            # Loading the model for generation serves embeddings as well
+            models = {self.chat_model: False}
+        for model, embedding in models.items():
+            if not model:
+                continue
+            hosts = self.client.preload(model, keep_alive=self.keep_alive, embedding=embedding)
+            if not hosts:
+                self.errors.append(f"model {model}: not loaded on any host")
+            self.models_loaded[model] = hosts
+    
+    def status(self) -> Dict:
+        return {
+            "state": self.state,
+            "stores_warmed": self.stores_warmed,
+            "models_loaded": self.models_loaded,
+            "errors": self.errors,
+            "duration": self.duration
+        }
@@ -5,6 +5,11 @@ import { createVuetify } from 'vuetify'
 import * as components from 'vuetify/components'
 import * as directives from 'vuetify/directives'
 import '@mdi/font/css/materialdesignicons.css'
+import axios from 'axios'
+import { sessionId, SESSION_HEADER } from './session'
+
+// Scope chat history and chapter selection on the backend to this tab
+axios.defaults.headers.common[SESSION_HEADER] = sessionId
 
 const vuetify = createVuetify({
   components,
@@ -0,0 +1,14 @@
+// Identifies this browser tab to the backend so each tab keeps its own conversation
+const SESSION_STORAGE_KEY = 'studyAssistantSessionId'
+
+const createSessionId = (): string => {
+  if (window.crypto && 'randomUUID' in window.crypto) {
+    return window.crypto.randomUUID()
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+}
+
+export const sessionId: string = sessionStorage.getItem(SESSION_STORAGE_KEY) || createSessionId()
+sessionStorage.setItem(SESSION_STORAGE_KEY, sessionId)
+
+export const SESSION_HEADER = 'X-Session-ID'
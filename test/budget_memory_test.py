@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import threading
+
+# The summarizing model is a stand-in, no Ollama needed
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ollama-chat-app", "backend"))
+
+from langchain.schema import SystemMessage
+from budget_memory import TokenBudgetMemory
+
+class StandInLLM:
+    """Answers every summary request with a numbered summary, optionally waiting to be released"""
+    
+    def __init__(self, blocked=False):
+        self.calls = 0
+        self.release = threading.Event()
+        if not blocked:
+            self.release.set()
+    
+    def invoke(self, prompt):
+        self.release.wait(5)
+        self.calls += 1
+        return f"summary {self.calls}"
+
+def save_turn(memory, turn, words=40):
+    text = " ".join(f"word{turn}" for _ in range(words))
+    memory.save_context({"input": f"question {turn} {text}"}, {"output": f"answer {turn} {text}"})
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_budget():
+    memory = TokenBudgetMemory(llm=StandInLLM(), max_token_limit=200, return_messages=True)
+    for turn in range(6):
+        save_turn(memory, turn)
+    assert wait_for(lambda: not memory._pending), "older messages are summarized in the background"
+    messages = memory.load_memory_variables({})["chat_history"]
+    kept = messages[1:]
+    print(f"Budget: {len(kept)} messages kept verbatim, {memory._total_tokens} estimated tokens, summary {memory.summary!r}")
+    assert isinstance(messages[0], SystemMessage) and memory.summary in messages[0].content, "the summary comes first"
+    assert memory._total_tokens <= 200 and memory._total_tokens == sum(memory._token_counts)
+    assert "answer 5" in kept[-1].content and "question 5" in kept[-2].content, "the latest turn is kept verbatim"
+
+def test_latest_turn_over_budget():
+    memory = TokenBudgetMemory(llm=StandInLLM(), max_token_limit=10, return_messages=True)
+    save_turn(memory, 0, words=200)
+    assert len(memory.chat_memory.messages) == 2, "a turn larger than the budget is still kept"
+
+def test_pending_and_clear():
+    llm = StandInLLM(blocked=True)
+    memory = TokenBudgetMemory(llm=llm, max_token_limit=100, return_messages=True)
+    for turn in range(4):
+        save_turn(memory, turn)
+    messages = memory.load_memory_variables({})["chat_history"]
+    assert "question 0" in messages[0].content, "messages being summarized are still passed on verbatim"
+    memory.clear()
+    llm.release.set()
+    time.sleep(0.2)
+    assert memory.summary == "" and not memory.load_memory_variables({})["chat_history"], \
+        "a summary finished after clear is dropped"
+    print("Pending messages passed on while summarizing, discarded on clear")
+
+def main():
+    test_budget()
+    test_latest_turn_over_budget()
+    test_pending_and_clear()
+    print("All budget memory tests passed")
+
+if __name__ == "__main__":
+    main()
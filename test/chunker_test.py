@@ -0,0 +1,73 @@
+import os
+import re
+import sys
+
+# Chunking is tested on made-up pages, no PDFs or Ollama needed
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ollama-chat-app", "backend"))
+
+from langchain_core.documents import Document
+from chunking import HEADER_WINDOW, Chunker, strip_repeated_lines
+
+PAGES = 30
+MARKER = re.compile(r"(?:Page|第) ?(\d+) (?:fact|条)")
+
+def english_page(page):
+    body = "\n".join(f"Page {page} fact {i} says that cells divide and grow over time." for i in range(12))
+    return f"Cell Biology Textbook\n{body}\n- {page + 1} -"
+
+def chinese_page(page):
+    body = "\n".join(f"第{page} 条：细胞通过有丝分裂产生两个相同的子细胞，这是第{i}句。" for i in range(20))
+    return f"细胞生物学\n{body}\n第 {page + 1} 页"
+
+def pages(make_page):
+    for page in range(PAGES):
+        yield Document(page_content=make_page(page), metadata={"source": "book.pdf", "page": page})
+
+def check_page_mapping(make_page, chunk_size, chunk_overlap):
+    chunks = Chunker("tokens", chunk_size, chunk_overlap).split_pages(pages(make_page))
+    moved = 0
+    for chunk in chunks:
+        first = int(MARKER.search(chunk.page_content).group(1))
+        assert chunk.metadata["page"] == first, f"chunk starting on page {first} is tagged {chunk.metadata['page']}"
+        moved += chunk.metadata["page"] != chunks[0].metadata["page"]
+    spanning = sum(len(set(MARKER.findall(chunk.page_content))) > 1 for chunk in chunks)
+    print(f"{len(chunks)} chunks of {chunk_size}/{chunk_overlap} tokens, {spanning} spanning a page break, all tagged with their first page")
+    assert spanning and moved, "chunks run on across page breaks"
+    return chunks
+
+def test_page_mapping():
+    for make_page in (english_page, chinese_page):
+        check_page_mapping(make_page, 128, 32)
+        chunks = check_page_mapping(make_page, 512, 64)
+        text = "".join(chunk.page_content for chunk in chunks)
+        assert "Textbook" not in text and "细胞生物学" not in text, "running headers are dropped"
+        assert "- 7 -" not in text and "第 7 页" not in text, "page number footers are dropped"
+
+def test_characters():
+    chunks = Chunker("characters").split_pages(pages(english_page))
+    assert all(len(chunk.page_content) <= 1000 for chunk in chunks)
+    for chunk in chunks:
+        assert f"Page {chunk.metadata['page']} fact" in chunk.page_content, "characters chunks stay within their page"
+    print(f"{len(chunks)} character chunks, each within its page")
+
+def test_bounded_window():
+    read = []
+    def page_texts():
+        for page in range(PAGES):
+            read.append(page)
+            yield english_page(page)
+    stripped = strip_repeated_lines(page_texts())
+    next(stripped)
+    assert len(read) == HEADER_WINDOW, "pages are held back only until the window is full"
+    for page, _ in enumerate(stripped, start=1):
+        assert len(read) <= max(page + 1, HEADER_WINDOW), "later pages are released as they are read"
+    print(f"Headers found over a window of {HEADER_WINDOW} pages, later pages streamed")
+
+def main():
+    test_page_mapping()
+    test_characters()
+    test_bounded_window()
+    print("All chunker tests passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# Compares embedding models on the chunks of the bundled chapters; needs Ollama with the models pulled
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "ollama-chat-app" / "backend"
+RESOURCES_DIR = BACKEND_DIR.parent / "resources"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import chromadb
+from ollama_client import create_embeddings
+
+def load_chunks(copy_dir):
+    """Read the chunks of the bundled chapter stores from copies, since opening a store writes to it"""
+    with open(RESOURCES_DIR / "pdf_index.json", 'r', encoding='utf-8') as f:
+        textbooks = json.load(f)
+    chunks = []
+    for textbook in textbooks.values():
+        for chapter in textbook["chapters"]:
+            store_dir = RESOURCES_DIR / "vector_stores" / chapter["hash"]
+            if store_dir.exists():
+                store_copy = Path(copy_dir) / chapter["hash"]
+                shutil.copytree(store_dir, store_copy)
+                collection = chromadb.PersistentClient(path=str(store_copy)).get_collection("langchain")
+                chunks.extend(collection.get(include=["documents"])["documents"])
+    return [chunk for chunk in chunks if len(chunk.strip()) >= 60]
+
+def make_queries(chunks, count, rng):
+    """Use a passage from the middle of random chunks as the question; the chunk itself is the answer"""
+    queries = []
+    for index in rng.choice(len(chunks), min(count, len(chunks)), replace=False):
+        text = " ".join(chunks[index].split())
+        start = len(text) // 3
+        queries.append((int(index), text[start:start + max(30, len(text) // 4)]))
+    return queries
+
+def benchmark(model, chunks, queries, k):
+    embeddings = create_embeddings(model)
+    start = time.perf_counter()
+    matrix = np.asarray(embeddings.embed_documents(chunks), dtype=np.float32)
+    embed_seconds = time.perf_counter() - start
+    sq_norms = (matrix ** 2).sum(axis=1)
+
+    query_ms, search_ms, hits, reciprocal_ranks = [], [], 0, []
+    for answer, question in queries:
+        start = time.perf_counter()
+        query = np.asarray(embeddings.embed_query(question), dtype=np.float32)
+        query_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        # Squared L2 distances, as the vector stores rank them
+        distances = sq_norms - 2 * (matrix @ query)
+        ranking = np.argsort(distances)
+        search_ms.append((time.perf_counter() - start) * 1000)
+        rank = int(np.flatnonzero(ranking == answer)[0]) + 1
+        hits += rank <= k
+        reciprocal_ranks.append(1 / rank)
+    return {
+        "dimension": matrix.shape[1],
+        "chunks_per_sec": len(chunks) / embed_seconds if embed_seconds > 0 else 0.0,
+        "query_ms": float(np.median(query_ms)),
+        "search_ms": float(np.median(search_ms)),
+        "recall": hits / len(queries),
+        "mrr": float(np.mean(reciprocal_ranks)),
+        "store_bytes": matrix.nbytes
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding models on retrieval latency and quality")
+    parser.add_argument("models", nargs="*", default=["llama3.1", "nomic-embed-text", "bge-m3"])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        chunks = load_chunks(tmp)
+    queries = make_queries(chunks, args.queries, np.random.default_rng(0))
+    print(f"{len(chunks)} chunks, {len(queries)} queries taken from them, recall@{args.k} of the source chunk")
+    for model in args.models:
+        try:
+            result = benchmark(model, chunks, queries, args.k)
+        except Exception as e:
+            print(f"{model:20s} failed: {e}")
+            continue
+        print(f"{model:20s} dim {result['dimension']:5d}  "
+              f"recall@{args.k} {result['recall']:.3f}  MRR {result['mrr']:.3f}  "
+              f"embed {result['chunks_per_sec']:.1f} chunks/s  query {result['query_ms']:.1f} ms  "
+              f"search {result['search_ms']:.3f} ms  vectors {result['store_bytes'] / 1024:.0f}KB")
+
+if __name__ == "__main__":
+    main()
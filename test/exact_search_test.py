@@ -0,0 +1,123 @@
+import sys
+import json
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# Compares exact search with the Chroma stores it copies, on temporary copies of the bundled stores; no Ollama needed
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "ollama-chat-app" / "backend"
+RESOURCES_DIR = BACKEND_DIR.parent / "resources"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import config
+from pdf_manager import PDFManager
+from quantized_store import QUANTIZED_DIR, QuantizedStore, write_quantized_store
+from embedding_record import embedding_record
+
+K = 3
+CHAPTERS = 3
+QUERIES = 20
+
+def copy_resources(tmp):
+    """Copy the index and the chapter stores, since opening a store writes to it"""
+    resources = Path(tmp) / "resources"
+    shutil.copytree(RESOURCES_DIR / "vector_stores", resources / "vector_stores")
+    shutil.copy(RESOURCES_DIR / "pdf_index.json", resources / "pdf_index.json")
+    return resources
+
+def pick_chapters(manager):
+    hashes = [
+        pdf_hash for pdf_hash in manager.index.available_pdfs
+        if (store := manager.get_vector_store(pdf_hash)) is not None and store._collection.count() > K
+    ]
+    return hashes[:CHAPTERS], hashes[CHAPTERS:]
+
+def sample_queries(manager, other_hashes, rng):
+    """Use chunks of unselected chapters as queries, as a question about other content would be"""
+    vectors = np.concatenate([
+        np.asarray(manager.get_vector_store(pdf_hash)._collection.get(include=["embeddings"])["embeddings"])
+        for pdf_hash in other_hashes
+    ])
+    return vectors[rng.choice(len(vectors), QUERIES, replace=False)].astype(np.float32)
+
+def test_matches_chroma(manager, hashes, queries):
+    index = manager.get_exact_index(hashes)
+    assert index is not None, "a small selection gets an exact copy"
+    targets = manager.get_search_targets(hashes)
+    overlap, total, max_error = 0, 0, 0.0
+    for query in queries:
+        for (store, _), exact in zip(targets, index.search(query.tolist(), K)):
+            chroma = store.similarity_search_by_vector_with_relevance_scores(query.tolist(), k=K)
+            chroma_distances = {doc.page_content: distance for doc, distance in chroma}
+            for doc, distance in exact:
+                if doc.page_content in chroma_distances:
+                    overlap += 1
+                    max_error = max(max_error, abs(distance - chroma_distances[doc.page_content]) / max(distance, 1e-6))
+            total += len(chroma)
+    print(f"Exact search found {overlap / total:.3f} of Chroma's top {K}, largest relative distance error {max_error:.2e}")
+    assert overlap / total >= 0.95, "exact search finds what Chroma finds"
+    assert max_error < 1e-3, "with the same squared L2 distances"
+    return index
+
+def test_eviction(manager, hashes, index):
+    builds = manager.exact_index_builds
+    assert manager.get_exact_index(hashes) is index, "the copy is memoized per selection"
+    manager.store_cache.clear()
+    assert manager.exact_index_stats()["selections"] == 0, "evicting a store drops the copies of it"
+    assert manager.get_exact_index(hashes) is not index and manager.exact_index_builds == builds + 1
+    manager.reload_index()
+    assert manager.exact_index_stats()["selections"] == 0, "reloading the index drops every copy"
+
+def test_memory_cap(manager, hashes):
+    manager.reload_index()
+    sizes = [manager.get_exact_index([pdf_hash]).nbytes for pdf_hash in hashes]
+    manager.reload_index()
+    try:
+        config.EXACT_SEARCH_MAX_MB = (sizes[-2] + sizes[-1]) / 2**20
+        for pdf_hash in hashes:
+            manager.get_exact_index([pdf_hash])
+        stats = manager.exact_index_stats()
+        print(f"Exact search copies within {stats['max_bytes']:.0f} bytes: {stats['indexes']} copies, {stats['bytes']} bytes")
+        assert stats["indexes"] == 2 and stats["bytes"] <= stats["max_bytes"], "the oldest copies are dropped past the cap"
+        config.EXACT_SEARCH_MAX_MB = min(sizes) / 2 / 2**20
+        assert manager.get_exact_index(hashes) is None, "a copy larger than the cap is not made"
+    finally:
+        config.EXACT_SEARCH_MAX_MB = 0
+
+def test_quantized(resources, hashes):
+    for pdf_hash in hashes:
+        store_dir = resources / "vector_stores" / pdf_hash
+        records = PDFManager(str(resources)).get_vector_store(pdf_hash)._collection.get(
+            include=["embeddings", "documents", "metadatas"]
+        )
+        write_quantized_store(
+            store_dir / QUANTIZED_DIR, records["ids"], records["embeddings"], records["documents"], records["metadatas"],
+            fmt="int8", embedding=embedding_record(config.EMBEDDING_MODEL, len(records["embeddings"][0]))
+        )
+    config.VECTOR_STORE_FORMAT = "int8"
+    try:
+        manager = PDFManager(str(resources))
+        assert all(isinstance(store, QuantizedStore) for store, _ in manager.get_search_targets(hashes))
+        assert manager.get_exact_index(hashes) is None, "quantized stores are searched as they are"
+        assert manager.exact_index_builds == 0, "without a float32 copy of them"
+        print("Quantized selection searched without an exact copy")
+    finally:
+        config.VECTOR_STORE_FORMAT = "chroma"
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        resources = copy_resources(tmp)
+        manager = PDFManager(str(resources))
+        hashes, other_hashes = pick_chapters(manager)
+        queries = sample_queries(manager, other_hashes, np.random.default_rng(0))
+        index = test_matches_chroma(manager, hashes, queries)
+        test_eviction(manager, hashes, index)
+        test_memory_cap(manager, hashes)
+        manager.store_cache.clear()
+        test_quantized(resources, hashes)
+    print("All exact search tests passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+
+from chromadb.api.client import SharedSystemClient
+
+# Runs incremental preprocessing over copies of bundled chapters, with stand-in embeddings; no Ollama needed
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "ollama-chat-app" / "backend"
+BOOK_DIR = BACKEND_DIR.parent / "resources" / "textbook" / "chinese_grade_6_1"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from preprocess_pdfs import MANIFEST_FILE, PDFPreprocessor
+
+class StandInEmbeddings:
+    """Embeds text as a few bytes of its hash"""
+    
+    def embed_documents(self, texts):
+        return [[byte / 255 for byte in hashlib.md5(text.encode("utf-8", "surrogatepass")).digest()[:8]] for text in texts]
+
+class RecordingPreprocessor(PDFPreprocessor):
+    """Records the PDFs it rebuilds"""
+    
+    def __init__(self, resources_dir, chunker="characters"):
+        super().__init__(resources_dir, index_layout="per_pdf", store_format="chroma", chunker=chunker)
+        self.embeddings.embeddings = StandInEmbeddings()
+        self.processed = []
+    
+    def process_pdf(self, pdf_path, update_only=False):
+        self.processed.append(Path(pdf_path).name)
+        return super().process_pdf(pdf_path, update_only)
+
+def run(resources, chunker="characters"):
+    # Each preprocessor run is a process of its own, so start without the Chroma clients of earlier runs
+    SharedSystemClient.clear_system_cache()
+    preprocessor = RecordingPreprocessor(str(resources), chunker)
+    textbooks = preprocessor.process_directory_incremental(str(resources / "textbook"))
+    with open(resources / "vector_stores" / MANIFEST_FILE, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    chapters = sum(len(book["chapters"]) for book in textbooks.values())
+    assert chapters == len(manifest), "every indexed PDF is in the index"
+    return sorted(preprocessor.processed), manifest
+
+def store_hashes(resources):
+    return {path.name for path in (resources / "vector_stores").iterdir() if path.is_dir() and len(path.name) == 32}
+
+def test_skip_and_rebuild(resources, book):
+    processed, manifest = run(resources)
+    assert processed == ["chapter1.pdf", "chapter2.pdf"], "a first run indexes every PDF"
+    assert store_hashes(resources) == {entry["hash"] for entry in manifest.values()}
+    
+    processed, _ = run(resources)
+    assert processed == [], "unchanged PDFs are skipped"
+    
+    os.utime(book / "chapter1.pdf", (0, 1_000_000_000))
+    processed, manifest = run(resources)
+    assert processed == [], "a touched PDF with the same contents is skipped"
+    assert manifest["textbook/book/chapter1.pdf"]["mtime"] == 1_000_000_000, "with its new mtime recorded"
+    
+    old_hash = manifest["textbook/book/chapter2.pdf"]["hash"]
+    shutil.copy(BOOK_DIR / "chapter-4.pdf", book / "chapter2.pdf")
+    processed, manifest = run(resources)
+    assert processed == ["chapter2.pdf"], "a changed PDF is rebuilt"
+    assert old_hash not in store_hashes(resources), "and its previous store removed"
+    
+    shutil.rmtree(resources / "vector_stores" / manifest["textbook/book/chapter1.pdf"]["hash"])
+    processed, _ = run(resources)
+    assert processed == ["chapter1.pdf"], "a PDF whose store went missing is rebuilt"
+    
+    processed, manifest = run(resources, chunker="tokens")
+    assert processed == ["chapter1.pdf", "chapter2.pdf"], "other chunking settings rebuild every PDF"
+    assert all(entry["chunker"] == "tokens" for entry in manifest.values())
+    print(f"Rebuilt only new, changed or missing stores, {len(manifest)} PDFs indexed")
+
+def test_orphans(resources, book):
+    orphan = resources / "vector_stores" / ("0" * 32)
+    orphan.mkdir()
+    other = resources / "vector_stores" / "notes"
+    other.mkdir()
+    processed, manifest = run(resources, chunker="tokens")
+    assert processed == []
+    removed_hash = manifest["textbook/book/chapter1.pdf"]["hash"]
+    assert not orphan.exists(), "stores no PDF references are removed"
+    assert other.exists(), "directories that are not stores are left alone"
+    
+    (book / "chapter1.pdf").unlink()
+    processed, manifest = run(resources, chunker="tokens")
+    assert processed == [] and list(manifest) == ["textbook/book/chapter2.pdf"]
+    assert removed_hash not in store_hashes(resources), "the store of a deleted PDF is removed"
+    assert not (resources / "vector_stores" / "lexical" / f"{removed_hash}.npz").exists(), "with its lexical index"
+    print(f"Orphaned stores removed, {len(store_hashes(resources))} left")
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        resources = Path(tmp) / "resources"
+        book = resources / "textbook" / "book"
+        book.mkdir(parents=True)
+        shutil.copy(BOOK_DIR / "chapter-2.pdf", book / "chapter1.pdf")
+        shutil.copy(BOOK_DIR / "chapter-3.pdf", book / "chapter2.pdf")
+        test_skip_and_rebuild(resources, book)
+        test_orphans(resources, book)
+    print("All incremental index tests passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+from pathlib import Path
+
+# Rebuilds a chapter store in place, as preprocess_pdfs.py does, on temporary copies of the bundled stores; no Ollama needed
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "ollama-chat-app" / "backend"
+RESOURCES_DIR = BACKEND_DIR.parent / "resources"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import config
+from pdf_manager import PDFManager
+from chat_manager import ChatManager
+
+# Deletes and recreates the collection with every chunk marked, in another process like the preprocessor
+REBUILD = """
+import sys, chromadb
+client = chromadb.PersistentClient(path=sys.argv[1])
+old = client.get_collection("langchain")
+records = old.get(include=["embeddings", "documents", "metadatas"])
+metadata = old.metadata
+client.delete_collection("langchain")
+new = client.create_collection("langchain", metadata=metadata)
+new.add(ids=[f"rebuilt-{i}" for i in range(len(records["ids"]))], embeddings=records["embeddings"],
+        documents=["REBUILT " + text for text in records["documents"]], metadatas=records["metadatas"])
+"""
+
+class FixedEmbedding:
+    """Embeds every question as one stored chunk vector"""
+    
+    def __init__(self, vector):
+        self.vector = vector
+    
+    def embed_query(self, text):
+        return self.vector
+
+def copy_resources(tmp):
+    """Copy the index and the chapter stores, since opening a store writes to it"""
+    resources = Path(tmp) / "resources"
+    shutil.copytree(RESOURCES_DIR / "vector_stores", resources / "vector_stores")
+    shutil.copy(RESOURCES_DIR / "pdf_index.json", resources / "pdf_index.json")
+    return resources
+
+def check_rebuild(resources, exact_max_chunks):
+    config.EXACT_SEARCH_MAX_CHUNKS = exact_max_chunks
+    with open(resources / "pdf_index.json", 'r', encoding='utf-8') as f:
+        pdf_hash = next(iter(json.load(f).values()))["chapters"][0]["hash"]
+    pdf_manager = PDFManager(str(resources))
+    session = ChatManager(pdf_manager=pdf_manager)
+    session.set_active_pdfs([pdf_hash])
+    store = pdf_manager.get_vector_store(pdf_hash)
+    session.retriever.embeddings = FixedEmbedding(store._collection.get(limit=1, include=["embeddings"])["embeddings"][0])
+    _, docs = session._build_prompt("question", {})
+    assert docs and not docs[0].page_content.startswith("REBUILT")
+    
+    subprocess.run([sys.executable, "-c", REBUILD, str(resources / "vector_stores" / pdf_hash)], check=True)
+    assert pdf_manager.reload_index()
+    _, docs = session._build_prompt("question", {})
+    print(f"Exact search up to {exact_max_chunks} chunks: {len(docs)} chunks after the rebuild, "
+          f"first {docs[0].page_content[:30]!r}" if docs else "no chunks after the rebuild")
+    assert docs and all(doc.page_content.startswith("REBUILT") for doc in docs), "the session searches the rebuilt store"
+    assert pdf_manager.get_vector_store(pdf_hash) is not store, "the stale handle was closed and reopened"
+    session.close()
+
+def main():
+    for exact_max_chunks in (0, 2048):
+        with tempfile.TemporaryDirectory() as tmp:
+            check_rebuild(copy_resources(tmp), exact_max_chunks)
+    print("All index reload tests passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Routing is tested against local stand-in Ollama servers, no real Ollama needed
+PORTS = [11501, 11502, 11503]
+os.environ["OLLAMA_BASE_URLS"] = ",".join(f"http://127.0.0.1:{port}" for port in PORTS)
+os.environ["OLLAMA_EMBED_PARALLEL"] = "2"
+os.environ["OLLAMA_HEALTH_INTERVAL"] = "0"
+os.environ["OLLAMA_RETRIES"] = "0"
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ollama-chat-app", "backend"))
+
+import requests
+from ollama_client import create_embeddings, create_llm, get_client
+from chat_manager import _astream_generate
+from model_catalog import ModelCatalog
+
+requests_by_port = Counter()
+loaded_models = {port: [] for port in PORTS}
+
+class StandInOllama(BaseHTTPRequestHandler):
+    """Answers the few Ollama endpoints the backend uses"""
+    
+    def log_message(self, *args):
+        pass
+    
+    def _send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        port = self.server.server_address[1]
+        if self.path == "/api/ps":
+            self._send_json({"models": [{"name": name} for name in loaded_models[port]]})
+        elif self.path == "/api/tags":
+            self._send_json({"models": [{"name": f"model-{port}:latest"}]})
+        else:
+            self.send_error(404)
+    
+    def do_POST(self):
+        port = self.server.server_address[1]
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        requests_by_port[port] += 1
+        if body.get("prompt") == "slow":
+            time.sleep(0.5)
+        if self.path == "/api/show":
+            # Like Ollama, a host only describes the models it has pulled
+            if body["model"] != f"model-{port}:latest":
+                self.send_error(404)
+                return
+            self._send_json({"capabilities": ["completion", f"on-{port}"]})
+        elif self.path == "/api/embeddings":
+            time.sleep(0.02)
+            self._send_json({"embedding": [float(port), float(len(body["prompt"]))]})
+        elif self.path == "/api/generate":
+            lines = [{"response": f"{port} ", "done": False}, {"response": "ok", "done": True}]
+            data = "".join(json.dumps(line) + "\n" for line in lines).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            if body.get("prompt") == "stall":
+                # Send the first line, then stall the rest of the stream
+                first = data.index(b"\n") + 1
+                self.wfile.write(data[:first])
+                self.wfile.flush()
+                time.sleep(0.5)
+                data = data[first:]
+            self.wfile.write(data)
+        else:
+            self.send_error(404)
+
+def start_servers():
+    servers = {}
+    for port in PORTS:
+        server = ThreadingHTTPServer(("127.0.0.1", port), StandInOllama)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers[port] = server
+    return servers
+
+def test_embedding_fan_out():
+    requests_by_port.clear()
+    vectors = create_embeddings("llama3.1").embed_documents([f"chunk {i}" for i in range(30)])
+    print(f"Embedding requests per host: {dict(requests_by_port)}")
+    assert len(vectors) == 30
+    assert all(requests_by_port[port] > 0 for port in PORTS), "every host should embed"
+
+def test_model_affinity():
+    client = get_client()
+    client.policy = "model_affinity"
+    loaded_models[PORTS[1]] = ["llama3.1:latest"]
+    client.check_health()
+    requests_by_port.clear()
+    llm = create_llm("llama3.1")
+    answers = [llm.invoke("hello") for _ in range(5)]
+    print(f"Generate requests with affinity: {dict(requests_by_port)}, first answer: {answers[0]!r}")
+    assert requests_by_port == Counter({PORTS[1]: 5}), "the host with the model loaded should serve it"
+    client.policy = "least_outstanding"
+
+def test_model_catalog():
+    catalog = ModelCatalog(get_client())
+    capabilities = {model["name"]: model["capabilities"] for model in catalog.get_models()}
+    print(f"Capabilities from the hosts that have each model: {capabilities}")
+    for port in PORTS:
+        assert capabilities[f"model-{port}:latest"] == ["completion", f"on-{port}"]
+    assert catalog.stats()["capabilities_cached"] == len(PORTS)
+
+def test_failover(servers):
+    servers[PORTS[0]].shutdown()
+    servers[PORTS[0]].server_close()
+    requests_by_port.clear()
+    vectors = create_embeddings("llama3.1").embed_documents([f"chunk {i}" for i in range(10)])
+    hosts = {host["url"]: host["healthy"] for host in get_client().stats()["hosts"]}
+    print(f"Embedding requests after one host went down: {dict(requests_by_port)}, health: {hosts}")
+    assert len(vectors) == 10
+    assert requests_by_port[PORTS[0]] == 0
+    assert not hosts[f"http://127.0.0.1:{PORTS[0]}"]
+
+def test_async_stream():
+    async def collect():
+        payload = {"model": "llama3.1", "prompt": "hello", "stream": True}
+        return [token async for token in _astream_generate(payload)]
+    tokens = asyncio.run(collect())
+    print(f"Async stream tokens: {tokens}")
+    assert tokens[-1] == "ok"
+    assert all(host["outstanding"] == 0 for host in get_client().stats()["hosts"])
+
+def test_timeout():
+    client = get_client()
+    try:
+        client.post("/api/embeddings", timeout=0.1, json={"model": "llama3.1", "prompt": "slow"})
+        assert False, "the request should time out"
+    except requests.exceptions.ReadTimeout:
+        pass
+    try:
+        payload = {"model": "llama3.1", "prompt": "stall", "stream": True}
+        lines = list(client.stream_lines("/api/generate", timeout=0.1, json=payload))
+        assert False, f"the stream should time out, got {lines}"
+    except requests.exceptions.RequestException:
+        pass
+    hosts = client.stats()["hosts"]
+    print(f"Hosts after a timed out request and stream: {hosts}")
+    assert all(host["outstanding"] == 0 for host in hosts), "timed out requests release their host"
+
+def main():
+    servers = start_servers()
+    print(f"Models on all hosts: {[model['name'] for model in get_client().list_models()]}")
+    test_embedding_fan_out()
+    test_model_affinity()
+    test_model_catalog()
+    test_failover(servers)
+    test_async_stream()
+    test_timeout()
+    print("All routing checks passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import sys
+import json
+import time
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# Compares quantized stores with the Chroma stores they are built from; no Ollama needed
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "ollama-chat-app" / "backend"
+RESOURCES_DIR = BACKEND_DIR.parent / "resources"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import chromadb
+from quantized_store import QuantizedStore, write_quantized_store
+
+K = 3
+QUERIES_PER_STORE = 20
+# (label, format, keep float32 for re-ranking, IVF lists, lists probed)
+CONFIGS = [
+    ("float16", "float16", False, 0, 0),
+    ("int8", "int8", False, 0, 0),
+    ("int8 + float32 re-rank", "int8", True, 0, 0),
+    ("int8 IVF 4 lists, probe 2", "int8", False, 4, 2),
+]
+
+def load_chapters(copy_dir):
+    """Read the bundled chapter stores from copies, since opening a store writes to it"""
+    with open(RESOURCES_DIR / "pdf_index.json", 'r', encoding='utf-8') as f:
+        textbooks = json.load(f)
+    chapters = {}
+    for textbook in textbooks.values():
+        for chapter in textbook["chapters"]:
+            store_dir = RESOURCES_DIR / "vector_stores" / chapter["hash"]
+            if not store_dir.exists():
+                continue
+            store_copy = Path(copy_dir) / chapter["hash"]
+            shutil.copytree(store_dir, store_copy)
+            collection = chromadb.PersistentClient(path=str(store_copy)).get_collection("langchain")
+            records = collection.get(include=["embeddings", "documents", "metadatas"])
+            if len(records["ids"]) > K:
+                chapters[chapter["hash"]] = (collection, records)
+    return chapters
+
+def sample_queries(chapters, pdf_hash, rng):
+    """Use chunks of other chapters as queries, as a question about other content would be"""
+    others = np.concatenate([np.asarray(records["embeddings"]) for key, (_, records) in chapters.items() if key != pdf_hash])
+    return others[rng.choice(len(others), QUERIES_PER_STORE, replace=False)].astype(np.float32)
+
+def compare(chapters, quantized_dir):
+    print(f"Comparing {len(chapters)} chapter stores, {QUERIES_PER_STORE} queries each, recall@{K} against Chroma")
+    rng = np.random.default_rng(0)
+    queries = {pdf_hash: sample_queries(chapters, pdf_hash, rng) for pdf_hash in chapters}
+    expected = {
+        pdf_hash: [set(ids) for ids in collection.query(query_embeddings=queries[pdf_hash].tolist(), n_results=K)["ids"]]
+        for pdf_hash, (collection, _) in chapters.items()
+    }
+    float32_bytes = sum(np.asarray(records["embeddings"], dtype=np.float32).nbytes for _, records in chapters.values())
+
+    for label, fmt, keep_float32, num_lists, nprobe in CONFIGS:
+        recalls, seconds, vector_bytes = [], 0.0, 0
+        for pdf_hash, (_, records) in chapters.items():
+            path = quantized_dir / label.replace(" ", "_") / pdf_hash
+            write_quantized_store(
+                path, records["ids"], records["embeddings"], records["documents"], records["metadatas"],
+                fmt=fmt, keep_float32=keep_float32, num_lists=min(num_lists, len(records["ids"]))
+            )
+            store = QuantizedStore(path, rerank=4 if keep_float32 else 0, nprobe=nprobe)
+            vector_bytes += store.memory_bytes()
+            for query, expected_ids in zip(queries[pdf_hash], expected[pdf_hash]):
+                start = time.perf_counter()
+                found = {store.ids[row] for row, _ in store.search(query, K)}
+                seconds += time.perf_counter() - start
+                recalls.append(len(found & expected_ids) / len(expected_ids))
+        print(f"{label:28s} recall@{K} {np.mean(recalls):.3f}  "
+              f"vectors {vector_bytes / float32_bytes:.0%} of float32  "
+              f"{seconds / len(recalls) * 1000:.3f} ms/query")
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        compare(load_chapters(Path(tmp) / "chroma"), Path(tmp) / "quantized")
+
+if __name__ == "__main__":
+    main()
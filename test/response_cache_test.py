@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import tempfile
+
+# Questions are embedded by a stand-in bag of words, no Ollama needed
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ollama-chat-app", "backend"))
+
+import config
+from response_cache import ResponseCache
+from pdf_manager import PDFManager
+from chat_manager import ChatManager
+
+VOCABULARY = ["what", "is", "photosynthesis", "mitosis", "explain", "please", "the"]
+
+class BagOfWords:
+    def embed_query(self, text):
+        words = text.lower().replace("?", " ").split()
+        return [float(words.count(word)) for word in VOCABULARY]
+
+def test_scope():
+    scope = ResponseCache.scope("llama3.1", ["a", "b"], ["hi", "hello"])
+    assert scope == ResponseCache.scope("llama3.1", ["b", "a"], ["hi", "hello"]), "chapter order does not matter"
+    assert scope != ResponseCache.scope("qwen2", ["a", "b"], ["hi", "hello"]), "the model does"
+    assert scope != ResponseCache.scope("llama3.1", ["a"], ["hi", "hello"]), "the chapters do"
+    assert scope != ResponseCache.scope("llama3.1", ["a", "b"], ["hi", "bye"]), "the recent conversation does"
+
+def test_tiers():
+    cache = ResponseCache(embeddings=BagOfWords(), similarity_threshold=0.85)
+    scope = ResponseCache.scope("llama3.1", ["a"], [])
+    other = ResponseCache.scope("llama3.1", ["b"], [])
+    cache.put(scope, "What is photosynthesis?", "Plants make sugar.", [{"page": 1}])
+    assert cache.get(scope, "  what IS   photosynthesis? ")[2] == "exact", "questions are matched normalized"
+    assert cache.get(scope, "what is the photosynthesis")[2] == "semantic", "close wording matches semantically"
+    assert cache.get(scope, "what is mitosis") is None, "different questions miss"
+    assert cache.get(other, "What is photosynthesis?") is None, "answers never leave their scope"
+    print(f"Tiers: {cache.stats()}")
+
+def test_expiry_and_lru():
+    cache = ResponseCache(max_entries=2, ttl=0.1, similarity_threshold=0)
+    scope = ResponseCache.scope("llama3.1", [], [])
+    for question in ("one", "two", "three"):
+        cache.put(scope, question, question, [])
+    assert cache.get(scope, "one") is None and cache.get(scope, "three"), "the least recently used entry is dropped"
+    time.sleep(0.2)
+    assert cache.get(scope, "three") is None, "entries expire after ttl"
+
+def test_persistence(tmp):
+    path = os.path.join(tmp, "responses.sqlite")
+    scope = ResponseCache.scope("llama3.1", ["a"], [])
+    cache = ResponseCache(embeddings=BagOfWords(), similarity_threshold=0.85, cache_path=path)
+    cache.put(scope, "what is mitosis", "Cells divide.", [])
+    reloaded = ResponseCache(embeddings=BagOfWords(), similarity_threshold=0.85, cache_path=path)
+    assert reloaded.get(scope, "What is mitosis")[0] == "Cells divide.", "entries survive a restart"
+    assert reloaded.get(scope, "please what is mitosis")[2] == "semantic", "with their embeddings"
+
+def test_session_scope(tmp):
+    config.RESPONSE_CACHE_HISTORY_TURNS = 1
+    cache = ResponseCache(similarity_threshold=0)
+    pdf_manager = PDFManager(tmp)
+    first = ChatManager(pdf_manager=pdf_manager, response_cache=cache)
+    second = ChatManager(pdf_manager=pdf_manager, response_cache=cache)
+    scope, _ = first._lookup_cache("what is mitosis", {})
+    assert second._lookup_cache("what is mitosis", {})[0] == scope, "an opening question is shared across sessions"
+    for chat_manager, answer in ((first, "Cells divide."), (second, "A kind of division.")):
+        chat_manager.memory.save_context({"input": "what is mitosis"}, {"response": answer})
+    assert first._lookup_cache("why", {})[0] != second._lookup_cache("why", {})[0], "a follow-up depends on its conversation"
+    first.memory.save_context({"input": "and meiosis"}, {"response": "Gametes."})
+    second.memory.save_context({"input": "and meiosis"}, {"response": "Gametes."})
+    assert first._lookup_cache("why", {})[0] == second._lookup_cache("why", {})[0], \
+        "only the last RESPONSE_CACHE_HISTORY_TURNS exchanges count"
+    print("Session scopes follow the recent conversation only")
+
+def main():
+    test_scope()
+    test_tiers()
+    test_expiry_and_lru()
+    with tempfile.TemporaryDirectory() as tmp:
+        test_persistence(tmp)
+        test_session_scope(tmp)
+    print("All response cache tests passed")
+
+if __name__ == "__main__":
+    main()
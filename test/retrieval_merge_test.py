@@ -0,0 +1,123 @@
+import os
+import sys
+import asyncio
+
+# Merging and fusion are tested on stand-in stores, no Ollama or vector stores needed
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ollama-chat-app", "backend"))
+
+from langchain.schema import Document
+from chat_manager import MultiStoreRetriever, _mean_distance
+from lexical_index import LexicalIndex
+
+class StandInStore:
+    """Answers the few vector store calls the retriever makes from fixed distances"""
+    
+    def __init__(self, chunks, fail=False):
+        # chunk id -> (text, metadata, distance)
+        self.chunks = chunks
+        self.fail = fail
+        self._collection = self
+    
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k, filter=None):
+        if self.fail:
+            raise RuntimeError("store is down")
+        ranked = sorted(self.chunks.values(), key=lambda chunk: chunk[2])[:k]
+        return [(Document(page_content=text, metadata=dict(metadata)), distance) for text, metadata, distance in ranked]
+    
+    def get(self, ids=None, include=None):
+        if self.fail:
+            raise RuntimeError("store is down")
+        found = [chunk_id for chunk_id in ids if chunk_id in self.chunks]
+        return {
+            "ids": found,
+            "documents": [self.chunks[chunk_id][0] for chunk_id in found],
+            "metadatas": [self.chunks[chunk_id][1] for chunk_id in found]
+        }
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.queries = 0
+    
+    def embed_query(self, text):
+        self.queries += 1
+        return [0.0]
+    
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+def chapter(pdf_hash, distances):
+    return StandInStore({
+        f"{pdf_hash}-{i}": (f"{pdf_hash} chunk {i}", {"pdf_hash": pdf_hash, "source": pdf_hash}, distance)
+        for i, distance in enumerate(distances)
+    })
+
+def retriever(stores, **kwargs):
+    return MultiStoreRetriever(vector_stores=stores, embeddings=CountingEmbeddings(), **kwargs)
+
+def test_global_top_k():
+    stores = [chapter("a", [0.1, 0.5, 0.9]), chapter("b", [0.2, 0.3, 0.4])]
+    scored = retriever(stores, k=3, top_k=4).search_with_scores("question")
+    print(f"Global top-k: {[round(score, 1) for _, score in scored]}")
+    assert [score for _, score in scored] == [0.1, 0.2, 0.3, 0.4], "closest candidates across stores, in order"
+
+def test_per_store_and_threshold():
+    stores = [chapter("a", [0.1, 0.5, 0.9]), chapter("b", [0.2, 0.3, 0.4])]
+    scored = retriever(stores, k=2, mode="per_store").search_with_scores("question")
+    assert [score for _, score in scored] == [0.1, 0.5, 0.2, 0.3], "top k of each store, concatenated"
+    scored = retriever(stores, k=3, top_k=6, score_threshold=0.35).search_with_scores("question")
+    assert [score for _, score in scored] == [0.1, 0.2, 0.3], "distances over the threshold are dropped"
+
+def test_duplicates_and_failed_stores():
+    stores = [chapter("a", [0.1, 0.2]), chapter("a", [0.1, 0.2]), StandInStore({}, fail=True)]
+    scored = retriever(stores, k=2, top_k=6).search_with_scores("question")
+    assert len(scored) == 2, "a chunk found in two stores is kept once and a failing store is skipped"
+    scored = asyncio.run(retriever(stores, k=2, top_k=6).asearch_with_scores("question"))
+    assert len(scored) == 2, "the async search merges the same way"
+
+def lexical_chapter(pdf_hash, texts, distances):
+    store = StandInStore({
+        f"{pdf_hash}-{i}": (text, {"pdf_hash": pdf_hash, "source": pdf_hash}, distance)
+        for i, (text, distance) in enumerate(zip(texts, distances))
+    })
+    index = LexicalIndex.build(pdf_hash, list(store.chunks), texts)
+    return index, store
+
+def test_fusion():
+    texts = ["photosynthesis converts light", "cell membranes", "mitochondria produce energy", "the krebs cycle"]
+    index, store = lexical_chapter("a", texts, [0.9, 0.1, 0.2, 0.3])
+    scored = retriever([store], k=2, top_k=3, lexical_targets=[(index, store)]).search_with_scores("photosynthesis")
+    texts_found = [doc.page_content for doc, _ in scored]
+    print(f"Fused: {texts_found}")
+    assert texts[0] in texts_found, "a chunk found only lexically joins the results"
+    lexical_only = next(score for doc, score in scored if doc.page_content == texts[0])
+    assert lexical_only == max(score for _, score in scored), "and takes the largest vector distance"
+
+def test_decisive():
+    texts = ["the krebs cycle oxidizes acetyl", "cell membranes", "mitochondria produce energy"]
+    index, store = lexical_chapter("a", texts, [0.9, 0.1, 0.2])
+    search = retriever([store], k=2, top_k=3, lexical_targets=[(index, store)], decisive_ratio=1.5, score_threshold=0.5)
+    scored = search.search_with_scores("krebs cycle")
+    print(f"Decisive: {scored}")
+    assert search.embeddings.queries == 0, "a decisive lexical hit skips embedding the query"
+    assert scored[0][0].page_content == texts[0] and scored[0][1] is None, "decisive hits have no distance"
+    assert _mean_distance(scored) == float("inf"), "so they never win a race on distance"
+    
+    store.fail = True
+    scored = search.search_with_scores("krebs cycle")
+    assert search.embeddings.queries == 1 and scored == [], "a failed fetch falls back to the vector search, which fails here as well"
+    store.fail = False
+    store.get = lambda ids=None, include=None: {"ids": [], "documents": [], "metadatas": []}
+    scored = search.search_with_scores("krebs cycle")
+    assert search.embeddings.queries == 2 and scored, "hits missing from the store fall back to vector search"
+    assert all(score is not None and score <= 0.5 for _, score in scored)
+
+def main():
+    test_global_top_k()
+    test_per_store_and_threshold()
+    test_duplicates_and_failed_stores()
+    test_fusion()
+    test_decisive()
+    print("All retrieval merge tests passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+import tempfile
+
+# Sessions are tested against an empty resources directory, no Ollama or vector stores needed
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ollama-chat-app", "backend"))
+
+from pdf_manager import PDFManager
+from session_manager import SessionManager
+
+def test_lru(pdf_manager):
+    sessions = SessionManager(pdf_manager, max_sessions=2, idle_timeout=3600)
+    first = sessions.get("a")
+    first.set_active_pdfs(["chapter-a"])
+    sessions.get("b").set_active_pdfs(["chapter-b"])
+    assert sessions.get("a") is first, "a session keeps its ChatManager"
+    sessions.get("c")
+    stats = sessions.stats()
+    print(f"LRU: {stats}")
+    assert stats["active"] == 2 and stats["evictions"] == 1
+    assert "chapter-b" not in pdf_manager.store_cache._pins, "the least recently used session was dropped and unpinned"
+    assert "chapter-a" in pdf_manager.store_cache._pins, "recently used sessions keep their stores pinned"
+    assert sessions.get("b") is not first and sessions.stats()["evictions"] == 2, "a dropped session starts over"
+
+def test_idle_timeout(pdf_manager):
+    sessions = SessionManager(pdf_manager, max_sessions=10, idle_timeout=0.1)
+    sessions.get("a").set_active_pdfs(["chapter-idle"])
+    sessions.get("b")
+    time.sleep(0.2)
+    sessions.get("c")
+    stats = sessions.stats()
+    print(f"Idle timeout: {stats}")
+    assert stats["active"] == 1 and stats["evictions"] == 2, "idle sessions are dropped on the next lookup"
+    assert "chapter-idle" not in pdf_manager.store_cache._pins
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_manager = PDFManager(tmp)
+        test_lru(pdf_manager)
+        test_idle_timeout(pdf_manager)
+    print("All session manager tests passed")
+
+if __name__ == "__main__":
+    main()
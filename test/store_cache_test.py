@@ -0,0 +1,94 @@
+import os
+import sys
+
+# The cache is tested with stand-in stores, no Chroma stores or Ollama needed
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ollama-chat-app", "backend"))
+
+from store_cache import StoreCache
+
+class StandInClient:
+    def __init__(self):
+        self.closed = False
+    
+    def close(self):
+        self.closed = True
+
+class StandInStore:
+    """Reports a fixed size and records whether its client was closed"""
+    
+    def __init__(self, size=0):
+        self.size = size
+        self._client = StandInClient()
+    
+    def memory_bytes(self):
+        return self.size
+    
+    @property
+    def closed(self):
+        return self._client.closed
+
+def open_stores(cache, keys, size=0):
+    stores = {}
+    for key in keys:
+        stores[key] = cache.get(key, lambda: StandInStore(size))
+    return stores
+
+def test_lru():
+    evicted = []
+    cache = StoreCache(max_stores=2, on_evict=evicted.append)
+    stores = open_stores(cache, ["a", "b"])
+    assert cache.get("a", lambda: None) is stores["a"], "an open store is reused"
+    stores.update(open_stores(cache, ["c"]))
+    print(f"LRU: {cache.stats()}")
+    assert evicted == ["b"] and stores["b"].closed, "the least recently used store is closed"
+    assert not stores["a"].closed and not stores["c"].closed
+    assert cache.get("missing", lambda: None) is None and cache.stats()["open_stores"] == 2, "failed opens are not cached"
+
+def test_pins():
+    evicted = []
+    cache = StoreCache(max_stores=2, on_evict=evicted.append)
+    stores = open_stores(cache, ["a"])
+    cache.pin(["a"])
+    cache.pin(["a"])
+    stores.update(open_stores(cache, ["b", "c", "d"]))
+    assert "a" not in evicted and not stores["a"].closed, "a pinned store is never closed while in use"
+    assert stores["b"].closed and stores["c"].closed and not stores["d"].closed
+    cache.unpin(["a"])
+    stores.update(open_stores(cache, ["e"]))
+    assert not stores["a"].closed, "it stays pinned until unpinned as often as it was pinned"
+    cache.unpin(["a"])
+    stores.update(open_stores(cache, ["f"]))
+    print(f"Pins: {cache.stats()}")
+    assert stores["a"].closed and evicted[-1] == "a", "once unpinned it is evicted like any other store"
+
+def test_bytes():
+    cache = StoreCache(max_stores=0, max_bytes=250)
+    stores = open_stores(cache, ["a", "b"], size=100)
+    stores.update(open_stores(cache, ["c"], size=100))
+    assert stores["a"].closed and cache.stats()["estimated_bytes"] == 200, "stores are closed to fit max_bytes"
+    stores.update(open_stores(cache, ["huge"], size=1000))
+    print(f"Bytes: {cache.stats()}")
+    assert not stores["huge"].closed, "a store larger than max_bytes is still kept while it is used"
+    assert stores["b"].closed and stores["c"].closed
+
+def test_discard():
+    evicted = []
+    cache = StoreCache(max_stores=2, on_evict=evicted.append)
+    stores = open_stores(cache, ["a", "b"])
+    cache.pin(["a"])
+    cache.discard(["a", "unknown"])
+    assert stores["a"].closed and evicted == ["a"], "discarding closes a store even when it is pinned"
+    reopened = cache.get("a", lambda: StandInStore())
+    assert reopened is not stores["a"]
+    open_stores(cache, ["c", "d"])
+    assert not reopened.closed, "the pin carries over to the reopened store"
+
+def main():
+    test_lru()
+    test_pins()
+    test_bytes()
+    test_discard()
+    print("All store cache tests passed")
+
+if __name__ == "__main__":
+    main()